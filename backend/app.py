@@ -1,30 +1,53 @@
 import base64
 import os
 import json
-from flask import Flask, request, jsonify, render_template, session, send_file
+from flask import Flask, request, jsonify, render_template, session, send_file, Response, stream_with_context, g
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import HumanMessage
 from flask_cors import CORS
 from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.prompts.chat import (
     ChatPromptTemplate,
     HumanMessagePromptTemplate,
     MessagesPlaceholder,
+    SystemMessagePromptTemplate,
 )
 from pydantic import BaseModel, Field
-from typing import Any, Dict, List, Union, Optional
-import re
+from typing import Any, List, Optional
 import pandas as pd
 import uuid
+import shutil
+import socket
+import threading
+import cProfile
+from contextlib import contextmanager
+import time
+import math
 from io import BytesIO
+from PIL import Image
+from image_preprocessing import detect_mime_type, preprocess_image, scaled_size
+from concurrent.futures import ThreadPoolExecutor
+from extraction_cache import ExtractionCache, fingerprint
+from dedup import DuplicateIndex, cluster, dhash, file_digest
+from storage import MemoryStore, create_store
+from rate_limiter import RateLimitedModel, RateLimiter
+from scheduler import FairScheduler
+from work_queue import WorkQueue
+from pipeline import Stage, run_pipeline
+from chat_memory import MEMORY_STRATEGIES, create_memory
+from quick_answers import AnswerBook, ChatPreparation
+from usage import TOKEN_KEYS, UsageCollector, add_usage, empty_usage, split_usage, usage_cost, usage_of
+from metrics import Counter, Histogram, register_collector, render as render_metrics
+from export import EXPORT_FORMATS, csv_chunks, ndjson_chunks, parquet_chunks, pq, result_columns
+from schemas import build_batch_model, build_schema_model, json_to_pydantic_model, normalize_fields, schema_fingerprint
 
 # Load environment variables
 load_dotenv()
-os.environ['GOOGLE_API_KEY'] = os.getenv("GOOGLE_API_KEY")
+if os.getenv("GOOGLE_API_KEY"):
+    os.environ['GOOGLE_API_KEY'] = os.getenv("GOOGLE_API_KEY")
 model_name = os.getenv("MODEL")
 
 # Initialize Flask app
@@ -32,36 +55,263 @@ app = Flask(__name__)
 CORS(app) 
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "your-secret-key")
 
-# Configure upload folder for image extraction
-app.config['UPLOAD_FOLDER'] = 'uploads'
+# Configure upload folder for image extraction. Default paths here and below
+# are inside the backend directory, whatever the working directory of the
+# server, worker or CLI
+app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max upload
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Schema, job and result stores: 'memory' is per process, 'sqlite' is shared
+# by every worker process on the host. Entries expire after STORAGE_TTL.
+app.config['STORAGE_BACKEND'] = os.getenv("STORAGE_BACKEND", "memory")
+app.config['STORAGE_PATH'] = os.getenv("STORAGE_PATH", os.path.join(app.root_path, 'data', 'database', 'storage.sqlite3'))
+app.config['STORAGE_TTL'] = float(os.getenv("STORAGE_TTL", 24 * 3600))
+app.config['MAX_SCHEMAS'] = int(os.getenv("MAX_SCHEMAS", 1000))
+app.config['MAX_JOBS'] = int(os.getenv("MAX_JOBS", 1000))
+app.config['MAX_CHAT_SESSIONS'] = int(os.getenv("MAX_CHAT_SESSIONS", 500))
+# Default chat memory strategy, see chat_memory.MEMORY_STRATEGIES; sessions
+# may pick their own with the 'memory' field of /upload_image or /chat
+app.config['CHAT_MEMORY'] = os.getenv("CHAT_MEMORY", "window")
+app.config['CHAT_MEMORY_WINDOW'] = int(os.getenv("CHAT_MEMORY_WINDOW", 6))
+app.config['CHAT_MEMORY_MAX_TOKENS'] = int(os.getenv("CHAT_MEMORY_MAX_TOKENS", 2000))
+# Answer field lookups and repeated questions from the session's extracted
+# invoice facts and answer cache instead of calling the model
+app.config['CHAT_QUICK_ANSWERS'] = os.getenv("CHAT_QUICK_ANSWERS", "1") != "0"
+# 'memory' keeps uploaded bytes in job_storage, 'spool' streams them to
+# UPLOAD_FOLDER/jobs/<job_id>/ and reads each file only when it is processed.
+# SQLite job records are rewritten as their files finish, so with that
+# backend uploads are always spooled
+app.config['UPLOAD_STORAGE'] = os.getenv(
+    "UPLOAD_STORAGE", "spool" if app.config['STORAGE_BACKEND'] == 'sqlite' else "memory"
+)
+if app.config['STORAGE_BACKEND'] == 'sqlite' and app.config['UPLOAD_STORAGE'] != 'spool':
+    app.logger.warning("UPLOAD_STORAGE=%s is ignored with STORAGE_BACKEND=sqlite; spooling uploads", app.config['UPLOAD_STORAGE'])
+    app.config['UPLOAD_STORAGE'] = 'spool'
+
+# Number of files extracted in parallel per job (override per request)
+app.config['EXTRACTION_CONCURRENCY'] = int(os.getenv("EXTRACTION_CONCURRENCY", 4))
+app.config['MAX_EXTRACTION_CONCURRENCY'] = int(os.getenv("MAX_EXTRACTION_CONCURRENCY", 16))
+# 'two_pass' transcribes the image then structures the text, 'single_pass'
+# sends the image and schema in one structured call (override per request)
+app.config['EXTRACTION_MODE'] = os.getenv("EXTRACTION_MODE", "two_pass")
+# Limits for 'batched' mode, which packs several images into one request
+app.config['BATCH_MAX_IMAGES'] = int(os.getenv("BATCH_MAX_IMAGES", 8))
+app.config['BATCH_MAX_BYTES'] = int(os.getenv("BATCH_MAX_BYTES", 8 * 1024 * 1024))
+app.config['BATCH_MAX_TOKENS'] = int(os.getenv("BATCH_MAX_TOKENS", 8000))
+# Downscale and recompress images before they are sent to the model
+app.config['IMAGE_PREPROCESSING'] = os.getenv("IMAGE_PREPROCESSING", "1") != "0"
+app.config['IMAGE_MAX_DIMENSION'] = int(os.getenv("IMAGE_MAX_DIMENSION", 2048))
+app.config['IMAGE_QUALITY'] = int(os.getenv("IMAGE_QUALITY", 85))
+app.config['IMAGE_FORMAT'] = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+app.config['IMAGE_GRAYSCALE'] = os.getenv("IMAGE_GRAYSCALE", "0") == "1"
+# Durable queue read by worker.py processes; jobs are put on it with
+# "queue": true in /process_images. Needs the sqlite storage backend so the
+# workers and the web app share jobs and results.
+app.config['WORK_QUEUE_PATH'] = os.getenv("WORK_QUEUE_PATH", app.config['STORAGE_PATH'])
+app.config['WORKER_LEASE_SECONDS'] = float(os.getenv("WORKER_LEASE_SECONDS", 300))
+app.config['WORKER_MAX_ATTEMPTS'] = int(os.getenv("WORKER_MAX_ATTEMPTS", 3))
+# Files processed at once across all jobs by the async serving mode, see
+# asgi_app.py. Their model calls are still capped by the rate limiter's
+# concurrency (RATE_LIMIT_MAX_CONCURRENCY); raise that too, as far as the
+# provider quota allows, or set RATE_LIMIT=0 to rely on this limit alone
+app.config['ASYNC_MAX_IN_FLIGHT'] = int(os.getenv("ASYNC_MAX_IN_FLIGHT", 256))
+# Number of background jobs that can be active at the same time; their files
+# are run by the extraction scheduler, so these threads mostly wait
+app.config['JOB_WORKERS'] = int(os.getenv("JOB_WORKERS", 32))
+# Seconds without a finished file after which another process's running job may be resumed
+app.config['JOB_STALE_SECONDS'] = float(os.getenv("JOB_STALE_SECONDS", 900))
+# Duplicate uploads, within a job and across recent jobs, are extracted once
+# (DEDUP=0 disables). Near copies (same invoice re-scanned or re-encoded, up
+# to DEDUP_MAX_DISTANCE of 256 dHash bits apart) are only flagged unless
+# DEDUP_NEAR=reuse, since invoices from one template can look that alike;
+# DEDUP_NEAR=off ignores them. Exact copies are found across every process
+# sharing STORAGE_BACKEND=sqlite, near copies only among the jobs queued by
+# the same process. See dedup.py
+app.config['DEDUP'] = os.getenv("DEDUP", "1") != "0"
+app.config['DEDUP_NEAR'] = os.getenv("DEDUP_NEAR", "flag")
+app.config['DEDUP_MAX_DISTANCE'] = int(os.getenv("DEDUP_MAX_DISTANCE", 10))
+app.config['DEDUP_RECENT_FILES'] = int(os.getenv("DEDUP_RECENT_FILES", 10000))
+# Extraction worker threads shared by all jobs, and the share one tenant
+# (API key, session or client address) may occupy at once
+app.config['SCHEDULER_WORKERS'] = int(os.getenv("SCHEDULER_WORKERS", 8))
+app.config['TENANT_MAX_IN_FLIGHT'] = int(os.getenv("TENANT_MAX_IN_FLIGHT", 4))
+# Threads per job that read, resize and encode images ahead of the model
+# calls, and how many files may wait between two pipeline stages
+app.config['PIPELINE_PREPARE_WORKERS'] = int(os.getenv("PIPELINE_PREPARE_WORKERS", min(4, os.cpu_count() or 1)))
+app.config['PIPELINE_QUEUE_SIZE'] = int(os.getenv("PIPELINE_QUEUE_SIZE", 4))
+# USD per million tokens, used to report the cost of jobs and chat sessions
+app.config['TOKEN_PRICE_INPUT'] = float(os.getenv("TOKEN_PRICE_INPUT", 0))
+app.config['TOKEN_PRICE_OUTPUT'] = float(os.getenv("TOKEN_PRICE_OUTPUT", 0))
+# PROFILING=1 lets a request ask for a profile with ?profile=1 (cProfile) or
+# ?profile=pyinstrument; reports are written to PROFILE_DIR. One request is
+# profiled at a time; others asking meanwhile run unprofiled
+app.config['PROFILING'] = os.getenv("PROFILING", "0") == "1"
+app.config['PROFILE_DIR'] = os.getenv("PROFILE_DIR", os.path.join(app.root_path, 'data', 'profiles'))
+# Longest wait between checks for new results in /job_events streams, and
+# the idle time after which a keep-alive comment is sent
+app.config['JOB_EVENTS_POLL_INTERVAL'] = float(os.getenv("JOB_EVENTS_POLL_INTERVAL", 1))
+app.config['JOB_EVENTS_KEEPALIVE'] = float(os.getenv("JOB_EVENTS_KEEPALIVE", 15))
+app.config['MAX_FILE_RESULTS'] = int(os.getenv("MAX_FILE_RESULTS", 100000))
+
+# Client-side quota shared by every model call (RATE_LIMIT=0 disables it).
+# Limits of 0 mean unlimited; throttled calls are retried with jittered backoff.
+rate_limiter = None
+if os.getenv("RATE_LIMIT", "1") != "0":
+    rate_limiter = RateLimiter(
+        requests_per_minute=float(os.getenv("RATE_LIMIT_RPM", 0)),
+        tokens_per_minute=float(os.getenv("RATE_LIMIT_TPM", 0)),
+        max_concurrency=int(os.getenv("RATE_LIMIT_MAX_CONCURRENCY", 16)),
+        min_concurrency=int(os.getenv("RATE_LIMIT_MIN_CONCURRENCY", 1)),
+        max_retries=int(os.getenv("RATE_LIMIT_RETRIES", 5)),
+        backoff_base=float(os.getenv("RATE_LIMIT_BACKOFF", 1)),
+        backoff_max=float(os.getenv("RATE_LIMIT_BACKOFF_MAX", 60))
+    )
+
+def initialize_model():
+    """Create the chat model, or the local fake model when MODEL=fake"""
+    if model_name == "fake":
+        from fake_model import FakeVisionModel, padded_description
+        model = FakeVisionModel(
+            latency=float(os.getenv("FAKE_MODEL_LATENCY", 0)),
+            response_text=padded_description(int(os.getenv("FAKE_MODEL_RESPONSE_SIZE", 0))),
+            error_rate=float(os.getenv("FAKE_MODEL_ERROR_RATE", 0)),
+            throttle_pattern=os.getenv("FAKE_MODEL_THROTTLE", ""),
+            quota_per_minute=int(os.getenv("FAKE_MODEL_QUOTA_RPM", 0))
+        )
+    elif rate_limiter:
+        # The limiter owns retries, so the client makes a single attempt
+        model = ChatGoogleGenerativeAI(model=model_name, max_retries=1)
+    else:
+        model = ChatGoogleGenerativeAI(model=model_name)
+    return RateLimitedModel(model, rate_limiter) if rate_limiter else model
 
 # Initialize the model
-model_vision = ChatGoogleGenerativeAI(model=model_name)
+model_vision = initialize_model()
+
+def make_store(name, max_entries, on_evict=None):
+    """Create a bounded store on the configured storage backend"""
+    return create_store(
+        name, app.config['STORAGE_BACKEND'], app.config['STORAGE_PATH'],
+        max_entries=max_entries, ttl=app.config['STORAGE_TTL'], on_evict=on_evict
+    )
+
+# Conversation chains for each session; they hold live model objects, so
+# they stay in this process and load the session's state from
+# chat_session_storage on every turn
+conversation_chains = MemoryStore('conversation_chains', app.config['MAX_CHAT_SESSIONS'], app.config['STORAGE_TTL'])
+
+# Bounded, expiring storage
+# Memory of each chat session: strategy, pinned invoice descriptions, summary and messages
+chat_session_storage = make_store('chat_sessions', app.config['MAX_CHAT_SESSIONS'])
+# Invoice facts and cached answers of each chat session, see quick_answers
+answer_books = make_store('answer_books', app.config['MAX_CHAT_SESSIONS'])
+schema_storage = make_store('schemas', app.config['MAX_SCHEMAS'])  # Store schemas with schema_id as key
+job_storage = make_store(  # Store job info with job_id as key
+    'jobs', app.config['MAX_JOBS'],
+    on_evict=lambda job_id: shutil.rmtree(job_upload_dir(job_id), ignore_errors=True)
+)
+# Uploaded files of each job, apart from the job record that every finished file updates
+job_file_storage = make_store('job_files', app.config['MAX_JOBS'])
+result_storage = make_store('results', app.config['MAX_JOBS'])  # Store results with job_id as key
+export_storage = make_store('exports', app.config['MAX_JOBS'])  # Store generated Excel files with job_id as key
+# Token usage of chat sessions and of jobs started with their session_id
+session_usage = make_store('session_usage', app.config['MAX_CHAT_SESSIONS'])
+# Results of finished files while their job is still running, keyed by "<job_id>:<index>"
+file_result_storage = make_store('file_results', app.config['MAX_FILE_RESULTS'])
+# Timing, status and tokens of each finished file, keyed like file_result_storage;
+# kept out of the job record so finishing a file does not rewrite every file's timing
+file_timing_storage = make_store('file_timings', app.config['MAX_FILE_RESULTS'])
+# Fingerprints of recently queued files, for duplicates across jobs. Exact
+# copies are looked up in duplicate_digests, which every process shares on the
+# sqlite backend; near copies only among the files this process has seen
+duplicate_digests = make_store('duplicate_digests', app.config['DEDUP_RECENT_FILES'])
+duplicate_index = DuplicateIndex(app.config['DEDUP_RECENT_FILES'], app.config['STORAGE_TTL'], duplicate_digests)
+# Files of queued jobs waiting for worker processes
+work_queue = WorkQueue(app.config['WORK_QUEUE_PATH']) if app.config['STORAGE_BACKEND'] == 'sqlite' else None
+
+# Persistent cache of descriptions and structured results (EXTRACTION_CACHE=0 disables)
+extraction_cache = None
+if os.getenv("EXTRACTION_CACHE", "1") != "0":
+    extraction_cache = ExtractionCache(
+        os.getenv("EXTRACTION_CACHE_PATH", os.path.join(app.root_path, 'data', 'database', 'extraction_cache.sqlite3')),
+        max_entries=int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", 10000)),
+        ttl=float(os.getenv("EXTRACTION_CACHE_TTL", 7 * 24 * 3600))
+    )
 
-# Dictionary to store conversation chains for each session
-conversation_chains = {}
+# Structured-output runnables keyed by schema fingerprint, reset with the model
+structured_llms = {}
+MAX_STRUCTURED_LLMS = 256
 
-# In-memory storage
-schema_storage = {}  # Store schemas with schema_id as key
-job_storage = {}    # Store job info with job_id as key
-result_storage = {} # Store results with job_id as key
+# Owner recorded on the jobs this process runs, see job_is_active
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Background job runner for /process_images with "async": true
+job_executor = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'], thread_name_prefix='job')
+# Runs the files of every job, by priority and round-robin across tenants
+extraction_scheduler = FairScheduler(
+    workers=app.config['SCHEDULER_WORKERS'],
+    max_in_flight_per_tenant=app.config['TENANT_MAX_IN_FLIGHT'],
+    name='extract'
+)
+# Notified whenever a job record changes, wakes /job_events streams
+job_events = threading.Condition()
+
+# ====================================================
+# Metrics
+
+HTTP_REQUESTS = Counter('invoice_http_requests_total', 'HTTP requests by endpoint and status', ('method', 'endpoint', 'status'))
+HTTP_SECONDS = Histogram('invoice_http_request_duration_seconds', 'Time to build the HTTP response', ('method', 'endpoint'))
+OPERATION_SECONDS = Histogram('invoice_operation_duration_seconds', 'Duration of hot-path operations', ('operation',))
+OPERATION_ERRORS = Counter('invoice_operation_errors_total', 'Hot-path operations that raised', ('operation',))
+STAGE_SECONDS = Histogram('invoice_pipeline_stage_seconds', 'Seconds a file spent in each extraction stage', ('stage',))
+FILES_PROCESSED = Counter('invoice_files_processed_total', 'Files extracted by background and sync jobs', ('status',))
+DUPLICATE_FILES = Counter('invoice_duplicate_files_total', 'Duplicate uploads by match (exact or near) and action (reused or flagged)', ('match', 'action'))
+IMAGE_BYTES = Counter('invoice_image_bytes_total', 'Image bytes before (in) and after (out) preprocessing', ('direction',))
+MODEL_TOKENS = Counter('invoice_model_tokens_total', 'Tokens reported by the model', ('operation', 'kind'))
+CHAT_ANSWERS = Counter('invoice_chat_answers_total', 'Chat answers by source: facts, cache or model', ('source',))
+
+@contextmanager
+def instrumented(operation):
+    """Time a hot-path operation and count its failures"""
+    with OPERATION_SECONDS.time(operation=operation):
+        try:
+            yield
+        except Exception:
+            OPERATION_ERRORS.inc(operation=operation)
+            raise
+
+def record_tokens(operation, usage):
+    """Count the tokens of one model call, see usage.usage_of"""
+    MODEL_TOKENS.inc(usage['input_tokens'], operation=operation, kind='input')
+    MODEL_TOKENS.inc(usage['output_tokens'], operation=operation, kind='output')
+
+def usage_report(usage):
+    """Token totals with their cost at the configured prices"""
+    return {
+        **usage,
+        'total_tokens': usage['input_tokens'] + usage['output_tokens'],
+        'cost': usage_cost(usage, app.config['TOKEN_PRICE_INPUT'], app.config['TOKEN_PRICE_OUTPUT'])
+    }
+
+def add_session_usage(session_id, usage):
+    """Add token usage to a session's running total and return the new total"""
+    if session_id not in session_usage:
+        session_usage[session_id] = empty_usage()
+    return session_usage.modify(session_id, lambda total: add_usage(total, usage)) or usage
 
 # ====================================================
 # Chat & Image Analysis Functions
 # ====================================================
 
-def get_image_description(image_file):
-    """
-    Function to get description of an image
-    
-    Args:
-        image_file: Uploaded image file
-    
-    Returns:
-        str: Description of the image
-    """
+DESCRIPTION_PROMPT = (
+    "You are an expert at reading invoices and extracting all visible information as-is.\n\n"
+    "From the image below, list all invoice details exactly as they appear, without correcting typos, OCR mistakes, or formatting issues.\n"
+    "Output everything in plain, detailed text — no summaries, no corrections, but formatting.\n"
+    "Preserve the original text, layout order, and any errors in the invoice."
+)
+
+def read_image_bytes(image_file):
+    """Read raw bytes from an uploaded file object or a file path"""
     if hasattr(image_file, 'read'):
         # If it's a file object from request
         image_bytes = image_file.read()
@@ -71,118 +321,1380 @@ def get_image_description(image_file):
         # If it's a file path
         with open(image_file, 'rb') as f:
             image_bytes = f.read()
+    return image_bytes
+
+def load_file_bytes(file_info):
+    """Return the bytes of an uploaded file, reading spooled files from disk"""
+    if 'data' in file_info:
+        return file_info['data']
+    with open(file_info['path'], 'rb') as f:
+        return f.read()
+
+def file_size(file_info):
+    """Return the size in bytes of an uploaded file without loading it"""
+    if 'data' in file_info:
+        return len(file_info['data'])
+    return file_info['size']
+
+def job_upload_dir(job_id):
+    """Directory holding the spooled uploads of a job"""
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'jobs', job_id)
+
+def preprocessing_settings():
+    """Describe the active preprocessing settings, for use in cache keys"""
+    if not app.config['IMAGE_PREPROCESSING']:
+        return "raw"
+    return json.dumps([
+        app.config['IMAGE_MAX_DIMENSION'], app.config['IMAGE_QUALITY'],
+        app.config['IMAGE_FORMAT'], app.config['IMAGE_GRAYSCALE']
+    ])
+
+def prepare_image(image_bytes):
+    """
+    Apply the configured preprocessing to an image before encoding it
     
-    image_data = base64.b64encode(image_bytes).decode("utf-8")
+    Args:
+        image_bytes (bytes): Raw uploaded image
     
-    message = HumanMessage(
+    Returns:
+        dict: 'data', 'mime_type', 'bytes_in', 'bytes_out', 'width', 'height'
+    """
+    if not app.config['IMAGE_PREPROCESSING']:
+        return {
+            'data': image_bytes,
+            'mime_type': detect_mime_type(image_bytes),
+            'bytes_in': len(image_bytes),
+            'bytes_out': len(image_bytes),
+            'width': None,
+            'height': None
+        }
+    with instrumented('preprocess'):
+        prepared = preprocess_image(
+            image_bytes,
+            max_dimension=app.config['IMAGE_MAX_DIMENSION'],
+            quality=app.config['IMAGE_QUALITY'],
+            output_format=app.config['IMAGE_FORMAT'],
+            grayscale=app.config['IMAGE_GRAYSCALE']
+        )
+    IMAGE_BYTES.inc(prepared['bytes_in'], direction='in')
+    IMAGE_BYTES.inc(prepared['bytes_out'], direction='out')
+    return prepared
+
+def image_stats(prepared):
+    """Keep the size report of a prepared image, without its bytes"""
+    return {key: value for key, value in prepared.items() if key != 'data'}
+
+def image_content(prepared):
+    """Build the image_url content part for a prepared image"""
+    image_data = base64.b64encode(prepared['data']).decode("utf-8")
+    return {
+        "type": "image_url",
+        "image_url": {"url": f"data:{prepared['mime_type']};base64,{image_data}"},
+    }
+
+def build_image_message(image_part, prompt):
+    """Build a multimodal message carrying a text prompt and one image_content part"""
+    return HumanMessage(
         content=[
-            {"type": "text", "text": "You are an expert at reading invoices and extracting all visible information as-is.\n\n"
-                "From the image below, list all invoice details exactly as they appear, without correcting typos, OCR mistakes, or formatting issues.\n"
-                "Output everything in plain, detailed text — no summaries, no corrections, but formatting.\n"
-                "Preserve the original text, layout order, and any errors in the invoice."},
-            {
-                "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{image_data}"},
-            },
+            {"type": "text", "text": prompt},
+            image_part,
         ],
     )
-    response = model_vision.invoke([message])
-    return response.content
 
-def suggest_questions(image_description):
+def description_cache_key(image_bytes):
+    """Cache key of an image's transcription"""
+    # Same image, model, prompt and preprocessing always give the same transcription
+    return fingerprint(model_name, DESCRIPTION_PROMPT, preprocessing_settings(), image_bytes)
+
+def describe_image(image_part, cache_key=None):
+    """
+    Transcribe an encoded image with the vision model and cache the text
+    
+    Returns:
+        tuple: (description, token usage of the call)
+    """
+    with instrumented('describe'):
+        response = model_vision.invoke([build_image_message(image_part, DESCRIPTION_PROMPT)])
+    usage = usage_of(response)
+    record_tokens('describe', usage)
+    if extraction_cache and cache_key:
+        extraction_cache.set('description', cache_key, response.content)
+    return response.content, usage
+
+def invoke_structured(structured_llm, model_input, operation):
+    """
+    Call a structured-output runnable created with include_raw=True
+    
+    Returns:
+        tuple: (parsed Pydantic object, token usage of the call)
+    
+    Raises:
+        ValueError: If the model returned nothing that fits the schema
+    """
+    with instrumented(operation):
+        response = structured_llm.invoke(model_input)
+    usage = usage_of(response)
+    record_tokens(operation, usage)
+    if response.get('parsed') is None:
+        raise ValueError(f"Model returned no structured output: {response.get('parsing_error')}")
+    return response['parsed'], usage
+
+def get_image_description(image_file, prepared=None, usage=None):
+    """
+    Function to get description of an image
+    
+    Args:
+        image_file: Uploaded image file
+        prepared (dict): prepare_image output for the same file, if already computed
+        usage (dict): If given, the call's token usage is added to it
+    
+    Returns:
+        str: Description of the image
+    """
+    image_bytes = read_image_bytes(image_file)
+    
+    cache_key = description_cache_key(image_bytes)
+    if extraction_cache:
+        cached = extraction_cache.get('description', cache_key)
+        if cached is not None:
+            return cached
+    
+    description, call_usage = describe_image(image_content(prepared or prepare_image(image_bytes)), cache_key)
+    if usage is not None:
+        add_usage(usage, call_usage)
+    return description
+
+class Question(BaseModel):
+    question: str = Field(None, description="Generate simple and useful suggestion questions based on the given content. The questions should be directly answerable using the information within the content.")
+
+class SuggestQue(BaseModel):
+    questions: List[Question]
+
+def suggest_questions(image_description, usage=None, answer_book=None):
     """
     Function to suggest questions based on image description
     
     Args:
         image_description (str): Description of the image
+        usage (dict): If given, the call's token usage is added to it
+        answer_book (AnswerBook): If given, the same call also extracts the
+            invoice facts and answers the suggested questions, and both are
+            stored in the book
     
     Returns:
         list: List of suggested questions
     """
-    class Question(BaseModel):
-        question: str = Field(None, description="Generate simple and useful suggestion questions based on the given content. The questions should be directly answerable using the information within the content.")
-    
-    class SuggestQue(BaseModel):
-        questions: List[Question]
+    if answer_book is not None:
+        query_llm = model_vision.with_structured_output(ChatPreparation, include_raw=True)
+        result, call_usage = invoke_structured(query_llm, image_description, 'suggest_questions')
+        if usage is not None:
+            add_usage(usage, call_usage)
+        answer_book.set_facts(result.facts.model_dump(), [(q.question, q.answer) for q in result.questions])
+        return [q.question for q in result.questions]
     
-    query_llm = model_vision.with_structured_output(SuggestQue)
-    result = query_llm.invoke(image_description)
+    query_llm = model_vision.with_structured_output(SuggestQue, include_raw=True)
+    result, call_usage = invoke_structured(query_llm, image_description, 'suggest_questions')
+    if usage is not None:
+        add_usage(usage, call_usage)
     return [q.question for q in result.questions]
 
-def get_conversation_chain(session_id):
-    """Create and return the conversation chain with memory for a session"""
-    if session_id in conversation_chains:
-        return conversation_chains[session_id]
+def get_conversation_chain(session_id, strategy=None):
+    """
+    Return the conversation chain with memory for a session
+    
+    The chain is built once per process; its memory is loaded from
+    chat_session_storage on every call, so any process can continue a
+    session another one started.
+    
+    Args:
+        session_id (str): Chat session
+        strategy (str): Memory strategy, see chat_memory.MEMORY_STRATEGIES;
+            switches an existing session's strategy when given
     
+    Returns:
+        tuple: (LLMChain, SessionMemory)
+    
+    Raises:
+        ValueError: If the strategy is unknown
+    """
+    if strategy is not None and strategy not in MEMORY_STRATEGIES:
+        raise ValueError(f"memory must be one of {', '.join(MEMORY_STRATEGIES)}")
+    cached = conversation_chains.get(session_id)
+    if cached is None:
+        cached = conversation_chains[session_id] = build_conversation_chain()
+    chain, memory = cached
+    memory.load_state(chat_session_storage.get(session_id) or {
+        'strategy': app.config['CHAT_MEMORY'], 'pinned': [], 'summary': '', 'messages': []
+    })
+    if strategy and strategy != memory.strategy:
+        memory.strategy = strategy
+        memory.trim()
+        save_chat_session(session_id, memory)
+    return chain, memory
+
+def build_conversation_chain():
+    """Create a conversation chain and its memory, with an empty history"""
+    # Invoice transcriptions are pinned in the system message, so trimming
+    # the history never loses them
     prompt = ChatPromptTemplate(
         [
-            SystemMessage(content="Act as a Teacher, Based on the information you know answer the user Questions"),
+            SystemMessagePromptTemplate.from_template(
+                "Act as a Teacher, Based on the information you know answer the user Questions\n\n"
+                "Invoice information:\n{invoice_facts}"
+            ),
             MessagesPlaceholder(variable_name="chat_history"),
             HumanMessagePromptTemplate.from_template("User: {question}, Give the Answer in plan text"),
         ]
     )
     
-    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+    memory = create_memory(
+        app.config['CHAT_MEMORY'],
+        summary_llm=model_vision,
+        window=app.config['CHAT_MEMORY_WINDOW'],
+        max_tokens=app.config['CHAT_MEMORY_MAX_TOKENS']
+    )
     
     chain = LLMChain(
         llm=model_vision,
         prompt=prompt,
         memory=memory,
     )
-        
-    conversation_chains[session_id] = (chain, memory)
     return chain, memory
 
+def save_chat_session(session_id, memory, answer_book=None):
+    """Store a session's memory, and its answer book when given, for the next turn"""
+    chat_session_storage[session_id] = memory.dump_state()
+    if answer_book is not None:
+        answer_books[session_id] = answer_book
+
+def session_answer_book(session_id, create=False):
+    """Return the session's AnswerBook, or None if quick answers are disabled or it has none"""
+    if not app.config['CHAT_QUICK_ANSWERS']:
+        return None
+    answer_book = answer_books.get(session_id)
+    if answer_book is None and create:
+        answer_book = AnswerBook()
+        answer_books[session_id] = answer_book
+    return answer_book
+
+def upload_reply(session_id, image_description, suggested_questions, usage):
+    """Build the /upload_image response and add its usage to the session"""
+    return {
+        "session_id": session_id,
+        "description": image_description,
+        "suggested_questions": suggested_questions,
+        "usage": usage_report(usage),
+        "session_usage": usage_report(add_session_usage(session_id, usage))
+    }
+
+def quick_chat_reply(session_id, question, memory):
+    """
+    Answer a chat question from the session's invoice facts or answer cache
+    
+    Returns:
+        dict: The /chat response, or None if the question needs the model
+    """
+    answer_book = session_answer_book(session_id)
+    if not answer_book:
+        return None
+    answer, source = answer_book.answer(question)
+    if answer is None:
+        return None
+    # Keep the exchange in the history for follow-up questions
+    memory.save_context({"question": question}, {"text": answer})
+    save_chat_session(session_id, memory)
+    CHAT_ANSWERS.inc(source=source)
+    return {
+        "response": answer,
+        "session_id": session_id,
+        "memory": memory.strategy,
+        "source": source,
+        "usage": usage_report(empty_usage()),
+        "session_usage": usage_report(session_usage.get(session_id) or empty_usage())
+    }
+
+def chat_reply(session_id, memory, answer, usage):
+    """Record a model answer and its usage, and build the /chat response"""
+    record_tokens('chat', usage)
+    # Summarizing memory may have called the model after the answer
+    summary_usage = memory.take_usage()
+    record_tokens('chat_summary', summary_usage)
+    usage = add_usage(dict(usage), summary_usage)
+    CHAT_ANSWERS.inc(source='model')
+    save_chat_session(session_id, memory)
+    return {
+        "response": answer,
+        "session_id": session_id,
+        "memory": memory.strategy,
+        "source": "model",
+        "usage": usage_report(usage),
+        "session_usage": usage_report(add_session_usage(session_id, usage))
+    }
+
 # ====================================================
 # Image Extraction Functions
 # ====================================================
 
-def json_to_pydantic_model(json_data: Union[List, Dict], class_name: str = "Data") -> str:
+EXTRACTION_MODES = ('two_pass', 'single_pass', 'batched')
+
+STRUCTURE_PROMPT = "Extract invoice data from the following text description of an invoice: {description}"
+
+SINGLE_PASS_PROMPT = (
+    "You are an expert at reading invoices.\n\n"
+    "Extract the requested fields from the invoice image below exactly as they appear, "
+    "without correcting typos, OCR mistakes, or formatting issues."
+)
+
+def extract_single_pass(image_part, structured_llm):
+    """Extract the schema fields with one structured call on the image itself"""
+    return invoke_structured(
+        structured_llm, [build_image_message(image_part, SINGLE_PASS_PROMPT)], 'extract_single_pass'
+    )
+
+# ====================================================
+# Extraction pipeline stages
+#
+# Each stage takes the file's state dict ('file_info', 'mode') and adds to
+# it; a stage that sets 'result' ends the file's trip through the pipeline.
+# Token usage is collected per stage in state['usage'].
+
+def prepare_file(state, schema_fingerprint=None):
     """
-    Convert a list of field definitions to a Pydantic BaseModel class definition.
+    Stage 'prepare': read a file, check the caches, then resize and encode it
+    
+    Cache hits skip the image work: a cached result finishes the file, and
+    a cached transcription (two-pass) leaves nothing for the image to do.
+    """
+    file_info = state['file_info']
+    state.setdefault('usage', {})
+    image_bytes = load_file_bytes(file_info)
+    
+    if extraction_cache and schema_fingerprint:
+        state['cache_key'] = fingerprint(model_name, schema_fingerprint, state['mode'], preprocessing_settings(), image_bytes)
+        cached = extraction_cache.get('result', state['cache_key'])
+        if cached is not None:
+            state['result'] = {**cached, 'filename': file_info['filename']}
+            return
+    
+    state['description_key'] = description_cache_key(image_bytes)
+    if state['mode'] == 'two_pass' and extraction_cache:
+        description = extraction_cache.get('description', state['description_key'])
+        if description is not None:
+            state['description'] = description
+            return
+    
+    prepared = prepare_image(image_bytes)
+    file_info['image_stats'] = image_stats(prepared)
+    state['image_part'] = image_content(prepared)
+
+def describe_file(state):
+    """Stage 'describe': transcribe the image to text; two-pass only"""
+    if state['mode'] == 'two_pass' and 'description' not in state:
+        state['description'], state['usage']['describe'] = describe_image(state['image_part'], state['description_key'])
+
+def structure_file(state, structured_llm):
+    """Stage 'structure': extract the schema fields and cache the result"""
+    file_info = state['file_info']
+    result = None
+    if state['mode'] == 'single_pass':
+        try:
+            result, state['usage']['structure'] = extract_single_pass(state['image_part'], structured_llm)
+        except Exception as e:
+            app.logger.warning("Single-pass extraction failed for %s, using two-pass: %s", file_info['filename'], e)
+    if result is None:
+        if 'description' not in state:
+            cached = extraction_cache.get('description', state['description_key']) if extraction_cache else None
+            if cached is not None:
+                state['description'] = cached
+            else:
+                state['description'], state['usage']['describe'] = describe_image(
+                    state['image_part'], state['description_key']
+                )
+        result, usage = invoke_structured(
+            structured_llm, STRUCTURE_PROMPT.format(description=state['description']), 'extract_structured'
+        )
+        add_usage(state['usage'].setdefault('structure', empty_usage()), usage)
+    store_structured_result(state, result)
+
+def store_structured_result(state, result):
+    """Cache the extracted record and set it, with the filename, as the file's result"""
+    # Convert to dict and add filename
+    result_dict = result.dict()
+    if state.get('cache_key'):
+        extraction_cache.set('result', state['cache_key'], result_dict)
+    result_dict['filename'] = state['file_info']['filename']
+    state['result'] = result_dict
+
+def finish_file(state):
+    """
+    Turn a stage failure into an error result, add the file's token totals
+    to its result and drop the encoded image
+    """
+    if 'exception' in state:
+        state['result'] = {
+            'filename': state['file_info']['filename'],
+            'error': str(state['exception'])
+        }
+    usage = empty_usage()
+    for stage_usage in state.get('usage', {}).values():
+        add_usage(usage, stage_usage)
+    state['result'].update(usage)
+    state.pop('image_part', None)
+    state.pop('description', None)
+    return state['result']
+
+BATCH_PROMPT = (
+    "You are an expert at reading invoices.\n\n"
+    "The {count} images below are separate invoices, each preceded by its image number. "
+    "Return one record per image with image_index set to that number, and extract the requested "
+    "fields exactly as they appear, without correcting typos, OCR mistakes, or formatting issues."
+)
+
+# Gemini bills images in 768x768 tiles of 258 tokens each
+IMAGE_TILE_SIZE = 768
+IMAGE_TILE_TOKENS = 258
+
+def estimate_image_tokens(file_info):
+    """Estimate the prompt tokens an uploaded image costs from its dimensions after preprocessing"""
+    try:
+        # Only the header is parsed, the pixels are not decoded
+        source = BytesIO(file_info['data']) if 'data' in file_info else file_info['path']
+        with Image.open(source) as image:
+            width, height = image.size
+    except Exception:
+        return IMAGE_TILE_TOKENS
+    if app.config['IMAGE_PREPROCESSING']:
+        width, height = scaled_size(width, height, app.config['IMAGE_MAX_DIMENSION'])
+    return math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE) * IMAGE_TILE_TOKENS
+
+def plan_batches(files, max_images, max_bytes, max_tokens):
+    """
+    Group files into batches that stay within the request budget
+    
+    Args:
+        files (list): Uploaded files as stored in job_storage
+        max_images (int): Most images per request
+        max_bytes (int): Most base64-encoded image bytes per request, measured
+            on the raw uploads so it is an upper bound after preprocessing
+        max_tokens (int): Most estimated image tokens per request
+    
+    Returns:
+        list: Lists of file indexes, in upload order; a file over budget
+        on its own gets a batch to itself
+    """
+    batches, current, current_bytes, current_tokens = [], [], 0, 0
+    for index, file_info in enumerate(files):
+        size = math.ceil(file_size(file_info) / 3) * 4
+        tokens = estimate_image_tokens(file_info)
+        if current and (len(current) >= max_images
+                        or current_bytes + size > max_bytes
+                        or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_bytes, current_tokens = [], 0, 0
+        current.append(index)
+        current_bytes += size
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def extract_batch(batch_files, structured_llm, batch_llm, schema_fingerprint=None):
+    """
+    Extract structured data from several files with one model request
+    
+    Args:
+        batch_files (list): Uploaded files to send together
+        structured_llm: Model bound to the job's Data schema, used for fallback
+        batch_llm: Model bound to the batch wrapper of the Data schema
+        schema_fingerprint (str): Hash of the job's schema, enables the result cache
+    
+    Returns:
+        list: One result dict per file, in the same order as `batch_files`;
+        files the model skipped are retried one by one in single-pass mode
+    """
+    results = [None] * len(batch_files)
+    cache_keys = [None] * len(batch_files)
+    images = {}
+    pending = []
+    shares = {}
+    for position, file_info in enumerate(batch_files):
+        try:
+            images[position] = load_file_bytes(file_info)
+        except Exception as e:
+            results[position] = {'filename': file_info['filename'], 'error': str(e), **empty_usage()}
+            continue
+        if extraction_cache and schema_fingerprint:
+            cache_keys[position] = fingerprint(model_name, schema_fingerprint, 'batched', preprocessing_settings(), images[position])
+            cached = extraction_cache.get('result', cache_keys[position])
+            if cached is not None:
+                results[position] = {**cached, 'filename': file_info['filename'], **empty_usage()}
+                continue
+        pending.append(position)
+    
+    if pending:
+        try:
+            content = [{"type": "text", "text": BATCH_PROMPT.format(count=len(pending))}]
+            for number, position in enumerate(pending, start=1):
+                prepared = prepare_image(images[position])
+                batch_files[position]['image_stats'] = image_stats(prepared)
+                content.append({"type": "text", "text": f"Image {number}:"})
+                content.append(image_content(prepared))
+            batch, usage = invoke_structured(batch_llm, [HumanMessage(content=content)], 'extract_batch')
+            
+            # The call's tokens are shared evenly by the files sent in it
+            shares = dict(zip(pending, split_usage(usage, len(pending))))
+            for record in batch.records:
+                if 1 <= record.image_index <= len(pending):
+                    position = pending[record.image_index - 1]
+                    if results[position] is None:
+                        result_dict = record.dict(exclude={'image_index'})
+                        if cache_keys[position]:
+                            extraction_cache.set('result', cache_keys[position], result_dict)
+                        results[position] = {
+                            **result_dict, 'filename': batch_files[position]['filename'], **shares[position]
+                        }
+        except Exception as e:
+            app.logger.warning("Batched extraction of %d files failed, retrying one by one: %s", len(pending), e)
+    
+    for position, file_info in enumerate(batch_files):
+        if results[position] is None:
+            results[position] = extract_file(file_info, structured_llm, schema_fingerprint, mode='single_pass')
+            add_usage(results[position], shares.get(position, {}))
+    return results
+
+def extract_file(file_info, structured_llm, schema_fingerprint=None, mode='two_pass'):
+    """
+    Extract structured data from a single uploaded invoice file
+    
+    Runs the pipeline stages one after another in the calling thread.
+    
+    Args:
+        file_info (dict): Uploaded file with 'filename' and either 'data'
+            or a spooled 'path'
+        structured_llm: Model bound to the job's Data schema
+        schema_fingerprint (str): Hash of the job's schema, enables the result cache
+        mode (str): 'two_pass' or 'single_pass'; single-pass falls back to
+            two-pass if the combined call fails
+    
+    Returns:
+        dict: Extracted fields plus filename, or filename and error. The
+        preprocessing size report is left in file_info['image_stats'].
+    """
+    return run_file_stages({'file_info': file_info, 'mode': mode}, structured_llm, schema_fingerprint)
+
+def run_file_stages(state, structured_llm, schema_fingerprint=None):
+    """
+    Run the stages of one file in the calling thread
+    
+    Args:
+        state (dict): 'file_info' and 'mode'; gets the file's per-stage
+            seconds in 'timings' and token usage in 'usage'
+    
+    Returns:
+        dict: The file's result, see finish_file
+    """
+    state.setdefault('usage', {})
+    state.setdefault('timings', {})
+    stages = [
+        ('prepare', lambda: prepare_file(state, schema_fingerprint)),
+        ('describe', lambda: describe_file(state)),
+        ('structure', lambda: structure_file(state, structured_llm))
+    ]
+    for name, run in stages:
+        if 'result' in state or 'exception' in state:
+            break
+        if name == 'describe' and state['mode'] != 'two_pass':
+            continue
+        started = time.perf_counter()
+        try:
+            run()
+        except Exception as e:
+            state['exception'] = e
+        state['timings'][name] = round(time.perf_counter() - started, 3)
+    return finish_file(state)
+
+def get_structured_llm(schema):
+    """
+    Return the structured-output model for a stored schema
+    
+    Args:
+        schema (dict): Schema record from schema_storage
+    
+    Returns:
+        Runnable: model_vision bound to the compiled Data model, memoized
+    """
+    key = schema['fingerprint']
+    structured_llm = structured_llms.get(key)
+    if structured_llm is None:
+        Data = build_schema_model(schema['fields'])
+        structured_llm = model_vision.with_structured_output(Data, include_raw=True)
+        if len(structured_llms) >= MAX_STRUCTURED_LLMS:
+            structured_llms.pop(next(iter(structured_llms)), None)
+        structured_llms[key] = structured_llm
+    return structured_llm
+
+def get_batch_llm(schema):
+    """Return the memoized structured-output model for multi-image requests"""
+    key = schema['fingerprint'] + ':batch'
+    batch_llm = structured_llms.get(key)
+    if batch_llm is None:
+        Batch = build_batch_model(build_schema_model(schema['fields']))
+        batch_llm = model_vision.with_structured_output(Batch, include_raw=True)
+        if len(structured_llms) >= MAX_STRUCTURED_LLMS:
+            structured_llms.pop(next(iter(structured_llms)), None)
+        structured_llms[key] = batch_llm
+    return batch_llm
+
+def extract_files(files, structured_llm, concurrency=1, on_complete=None, batch_llm=None, submit=None,
+                  stage_timings=None, **options):
+    """
+    Extract structured data from a list of files
+    
+    Two-pass and single-pass files flow through the prepare, describe and
+    structure stages of a pipeline, so images are decoded and encoded while
+    earlier files wait on the model. Batched mode runs one call per batch.
     
     Args:
-        json_data: List of field definitions [name, type, description] or dict
-        class_name: Name for the Pydantic class
+        files (list): Uploaded files as stored in job_storage
+        structured_llm: Model bound to the job's Data schema
+        concurrency (int): Number of model calls (files or batches) in flight
+        on_complete (callable): Called as on_complete(index, result, seconds, stages, usage)
+            with the per-stage seconds and token usage of the file
+            as soon as each file finishes, stages mapping stage name to seconds
+        batch_llm: Model bound to the batch schema, required for 'batched' mode
+        submit (callable): Schedules a zero-argument callable and returns a
+            Future; when given, model calls run there instead of on private threads
+        stage_timings (dict): If given, filled with per-stage totals
+        **options: schema_fingerprint and mode
+    
+    Returns:
+        list: One result dict per file, in the same order as `files`
+    """
+    results = [None] * len(files)
+    
+    if options.get('mode') == 'batched':
+        units = plan_batches(
+            files, app.config['BATCH_MAX_IMAGES'], app.config['BATCH_MAX_BYTES'], app.config['BATCH_MAX_TOKENS']
+        )
+        
+        def run(unit):
+            start = time.perf_counter()
+            unit_results = extract_batch(
+                [files[index] for index in unit], structured_llm, batch_llm, options.get('schema_fingerprint')
+            )
+            seconds = time.perf_counter() - start
+            if on_complete:
+                for index, result in zip(unit, unit_results):
+                    usage = {key: result.get(key, 0) for key in TOKEN_KEYS}
+                    on_complete(index, result, seconds, {'batch': round(seconds, 3)}, {'batch': usage})
+            return unit_results
         
+        if submit:
+            futures = [submit(lambda unit=unit: run(unit)) for unit in units]
+            unit_results = [future.result() for future in futures]
+        elif concurrency <= 1 or len(units) <= 1:
+            unit_results = [run(unit) for unit in units]
+        else:
+            # executor.map yields results in submission order
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(units))) as executor:
+                unit_results = list(executor.map(run, units))
+        
+        for unit, batch_results in zip(units, unit_results):
+            for index, result in zip(unit, batch_results):
+                results[index] = result
+        return results
+    
+    mode = options.get('mode', 'two_pass')
+    states = [{'index': index, 'file_info': file_info, 'mode': mode} for index, file_info in enumerate(files)]
+    
+    def done(state):
+        results[state['index']] = finish_file(state)
+        if on_complete:
+            on_complete(
+                state['index'], state['result'], sum(state['timings'].values()), state['timings'], state['usage']
+            )
+    
+    # Model stages get `concurrency` threads each; with a scheduler, the
+    # job's concurrency limit there caps the calls actually in flight
+    workers = max(1, min(concurrency, len(files)))
+    stages = [
+        Stage('prepare', lambda state: prepare_file(state, options.get('schema_fingerprint')),
+              workers=min(app.config['PIPELINE_PREPARE_WORKERS'], len(files))),
+        Stage('describe', describe_file, workers=workers, submit=submit),
+        Stage('structure', lambda state: structure_file(state, structured_llm), workers=workers, submit=submit),
+    ]
+    if mode == 'single_pass':
+        # The structure stage reads the image itself
+        del stages[1]
+    timings = run_pipeline(states, stages, queue_size=app.config['PIPELINE_QUEUE_SIZE'], on_done=done)
+    if stage_timings is not None:
+        stage_timings.update(timings)
+    return results
+
+# ====================================================
+# Job Runner Functions
+# ====================================================
+
+def update_job(job_id, **changes):
+    """Atomically apply changes to a job record"""
+    # A job removed by /cleanup while it was running is left alone
+    job_storage.modify(job_id, lambda job_info: job_info.update(changes))
+    with job_events:
+        job_events.notify_all()
+
+def duplicate_result(result, filename, original, distance, other_job=None):
+    """Copy an original file's result to a duplicate, flagged and without its token counts"""
+    copied = {key: value for key, value in result.items() if key not in ('possible_duplicate_of', 'duplicate_job_id')}
+    copied.update(empty_usage())
+    copied.update({'filename': filename, 'duplicate_of': original, 'duplicate_distance': distance})
+    if other_job:
+        copied['duplicate_job_id'] = other_job
+    return copied
+
+def job_files(job_id):
+    """Return the uploaded files of a job, or an empty list if they are gone"""
+    return job_file_storage.get(job_id) or []
+
+def checkpoint_file(job_id, index, result):
+    """
+    Store the result of a finished file and of the duplicates waiting for it
+    
+    Near copies found by plan_duplicates are flagged on the result.
+    
     Returns:
-        String containing the Pydantic class definition
-    """
-    # Handle list of field definitions
-    if isinstance(json_data, list):
-        fields = []
-        for field_def in json_data:
-            if len(field_def) >= 3:
-                field_name = field_def[0]
-                field_type = field_def[1]
-                description = field_def[2]
-                fields.append((field_name, field_type, description))
-            else:
-                return "Error: Each field definition should have name, type, and description."
-    else:
-        return "Error: Expected a list of field definitions."
+        dict: Results of the duplicates, by file index
+    """
+    job_info = job_storage.get(job_id) or {}
+    flags = job_info.get('duplicate_flags') or []
+    if index < len(flags) and flags[index]:
+        result.update(flags[index])
+    file_result_storage[f"{job_id}:{index}"] = result
     
-    # Generate class definition
-    class_definition = [
-        "from pydantic import BaseModel, Field",
-        "from typing import List, Optional, Dict, Any, Union\n",
-        f"class {class_name}(BaseModel):"
+    copies = {}
+    members = [
+        (member, original[1]) for member, original in enumerate(job_info.get('duplicate_of') or [])
+        if original and original[0] == index
     ]
+    files = job_files(job_id) if members else []
+    for member, distance in members:
+        copies[member] = duplicate_result(result, files[member]['filename'], result['filename'], distance)
+        file_result_storage[f"{job_id}:{member}"] = copies[member]
+    return copies
+
+def record_file_done(job_id, index, result, seconds, stats=None, stages=None, usage=None):
+    """Record progress, timing, image sizes, token usage and the result of one finished file of a job"""
+    copies = checkpoint_file(job_id, index, result)
+    FILES_PROCESSED.inc(status='error' if 'error' in result else 'ok')
+    for stage, stage_seconds in (stages or {}).items():
+        STAGE_SECONDS.observe(stage_seconds, stage=stage)
+    
+    timing = {
+        'filename': result['filename'],
+        'seconds': round(seconds, 3),
+        'status': 'error' if 'error' in result else 'ok'
+    }
+    if stages:
+        timing['stages'] = stages
+    if usage:
+        timing['tokens'] = {key: result.get(key, 0) for key in TOKEN_KEYS}
+    if stats:
+        timing['bytes_in'] = stats['bytes_in']
+        timing['bytes_out'] = stats['bytes_out']
+    file_timing_storage[f"{job_id}:{index}"] = timing
+    for member, copied in copies.items():
+        file_timing_storage[f"{job_id}:{member}"] = duplicate_timing(copied)
+    
+    def record(job_info):
+        job_info['heartbeat_at'] = time.time()
+        job_info['files_completed'] += 1
+        job_info['completed_order'].append(index)
+        if 'error' in result:
+            job_info['files_failed'] += 1
+        if usage:
+            tokens = job_info['tokens']
+            for stage, stage_usage in usage.items():
+                add_usage(tokens, stage_usage)
+                add_usage(tokens['by_stage'].setdefault(stage, empty_usage()), stage_usage)
+        if stats:
+            job_info['bytes_in'] += stats['bytes_in']
+            job_info['bytes_out'] += stats['bytes_out']
+        for member, copied in copies.items():
+            job_info['files_completed'] += 1
+            job_info['completed_order'].append(member)
+            if 'error' in copied:
+                job_info['files_failed'] += 1
+    
+    job_storage.modify(job_id, record)
+    with job_events:
+        job_events.notify_all()
+
+def job_is_active(job_info):
+    """
+    Tell whether a queued or running job is still being processed
+    
+    A job owned by another process that has not finished a file for
+    JOB_STALE_SECONDS is taken to have died with that process, and may be
+    resumed. Jobs left to worker.py have no owner; their queue leases
+    already retry the files of dead workers.
+    """
+    if job_info.get('status') not in ('queued', 'running'):
+        return False
+    owner = job_info.get('owner')
+    if owner is None or owner == PROCESS_ID:
+        return True
+    return time.time() - (job_info.get('heartbeat_at') or 0) < app.config['JOB_STALE_SECONDS']
+
+# Times a run reprocesses files whose checkpoint was evicted, see requeue_missing
+CHECKPOINT_ROUNDS = 3
+
+def job_checkpoints(job_id):
+    """
+    Return the results saved so far for each file of a job
+    
+    Returns:
+        list: One result per file: the newest per-file checkpoint, else the
+        job's stored result, else None for files never finished
+    """
+    count = job_storage[job_id]['files_total']
+    results = list(result_storage.get(job_id) or [])[:count]
+    results += [None] * (count - len(results))
+    for index in range(count):
+        checkpoint = file_result_storage.get(f"{job_id}:{index}")
+        if checkpoint is not None:
+            results[index] = checkpoint
+    return results
+
+def requeue_missing(job_id, results):
+    """
+    Make the files whose checkpoint was evicted before their job finished pending again
+    
+    LRU or TTL eviction of file_result_storage can drop checkpoints of a
+    long job. Those files are processed again, up to CHECKPOINT_ROUNDS
+    times per run; after that complete_job records them as failed.
+    
+    Args:
+        job_id (str): Job whose pending files were all processed
+        results (list): Its checkpoints, see job_checkpoints
     
-    for field_name, field_type, description in fields:
-        # Sanitize field name to be a valid Python identifier
-        field_name = re.sub(r'\W|^(?=\d)', '_', field_name)
-        description+=" if No data found , show None"
+    Returns:
+        list: Indices to process again; empty when the job can complete
+    """
+    missing = [index for index, result in enumerate(results) if result is None]
+    timings = [file_timing_storage.get(f"{job_id}:{index}") for index in missing]
+    requeued = []
+    
+    def requeue(job_info):
+        if job_info.get('checkpoint_rounds', 0) >= CHECKPOINT_ROUNDS:
+            return
+        job_info['checkpoint_rounds'] = job_info.get('checkpoint_rounds', 0) + 1
+        job_info['pending'] = missing
+        job_info['files_completed'] = max(0, job_info['files_completed'] - sum(bool(timing) for timing in timings))
+        job_info['files_failed'] = max(0, job_info['files_failed'] - sum(
+            bool(timing) and timing['status'] == 'error' for timing in timings
+        ))
+        lost = set(missing)
+        job_info['completed_order'] = [index for index in job_info['completed_order'] if index not in lost]
+        requeued.extend(missing)
+    
+    if missing:
+        job_storage.modify(job_id, requeue)
+    for index in requeued:
+        file_timing_storage.pop(f"{job_id}:{index}", None)
+    if requeued:
+        app.logger.warning("Job %s lost %d checkpoints; processing them again", job_id, len(requeued))
+    return requeued
+
+def queue_job(job_id, tenant='default', priority=0, keep=None):
+    """
+    Mark a job as queued and reset its progress counters
+    
+    Args:
+        job_id (str): Job to queue
+        tenant (str): Who the job is scheduled for, see request_tenant
+        priority (int): Higher priorities are scheduled first
+        keep (dict): Results to keep by file index when resuming; only the
+            other files are processed, and tokens count this run's files only
+    
+    Returns:
+        bool: False if the job is already queued or running
+    """
+    keep = keep or {}
+    queued = []
+    
+    def queue(job_info):
+        if job_is_active(job_info):
+            return
+        count = job_info['files_total']
+        job_info.update({
+            'status': 'queued',
+            'tenant': tenant,
+            'priority': priority,
+            'owner': PROCESS_ID,
+            'error': None,
+            'files_total': count,
+            'files_completed': len(keep),
+            'files_failed': sum('error' in result for result in keep.values()),
+            'pending': [index for index in range(count) if index not in keep],
+            'duplicate_of': [None] * count,
+            'duplicate_flags': [None] * count,
+            'files_duplicate': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+            'stage_timings': {},
+            'tokens': {**empty_usage(), 'by_stage': {}},
+            'completed_order': sorted(keep),
+            'checkpoint_rounds': 0,
+            'queued_at': time.time(),
+            'heartbeat_at': time.time(),
+            'started_at': None,
+            'finished_at': None
+        })
+        queued.append(True)
+    
+    job_storage.modify(job_id, queue)
+    if not queued:
+        return False
+    # Kept files start from their checkpoints, the others from scratch
+    for index in range(job_storage[job_id]['files_total']):
+        if index in keep:
+            file_result_storage[f"{job_id}:{index}"] = keep[index]
+        else:
+            file_result_storage.pop(f"{job_id}:{index}", None)
+            file_timing_storage.pop(f"{job_id}:{index}", None)
+    # Until the job is done again its results come from the checkpoints only
+    result_storage.pop(job_id, None)
+    export_storage.pop(job_id, None)
+    return True
+
+def apply_duplicates(job_id):
+    """
+    Take the duplicates found by plan_duplicates off a queued job's pending files
+    
+    Runs when the job starts rather than when it is queued, since
+    fingerprinting reads every file.
+    
+    Returns:
+        list: The files left to process
+    """
+    job_info = job_storage[job_id]
+    pending = job_info.get('pending', list(range(job_info['files_total'])))
+    kept = set(range(job_info['files_total'])) - set(pending)
+    keep = {index: file_result_storage.get(f"{job_id}:{index}") for index in kept}
+    plan = plan_duplicates(job_id, job_info, keep)
+    reused = plan['reused']
+    for index, result in reused.items():
+        file_result_storage[f"{job_id}:{index}"] = result
+        file_timing_storage[f"{job_id}:{index}"] = duplicate_timing(result)
+    waiting = {index for index, original in enumerate(plan['duplicate_of']) if original}
+    
+    def fingerprint(files):
+        for file_info, fingerprints in zip(files, plan['fingerprints']):
+            if fingerprints:
+                file_info['sha256'], file_info['dhash'] = fingerprints
+    
+    def apply(job_info):
+        job_info['pending'] = [index for index in job_info['pending'] if index not in reused and index not in waiting]
+        job_info['duplicate_of'] = plan['duplicate_of']
+        job_info['duplicate_flags'] = plan['flags']
+        job_info['files_duplicate'] = len(reused) + len(waiting)
+        job_info['files_completed'] += len(reused)
+        job_info['files_failed'] += sum('error' in result for result in reused.values())
+        job_info['completed_order'] += sorted(reused)
+    
+    if any(plan['fingerprints']):
+        job_file_storage.modify(job_id, fingerprint)
+    job_storage.modify(job_id, apply)
+    with job_events:
+        job_events.notify_all()
+    return job_storage[job_id]['pending']
+
+def duplicate_timing(result):
+    """File timing of a file served by its duplicate's result"""
+    return {'filename': result['filename'], 'seconds': 0.0, 'status': 'duplicate'}
+
+def file_fingerprints(file_info):
+    """Return (SHA-256, dHash) of an uploaded file, computed once per file"""
+    if 'sha256' in file_info:
+        return file_info['sha256'], file_info.get('dhash')
+    data = load_file_bytes(file_info)
+    return file_digest(data), dhash(data) if app.config['DEDUP_NEAR'] != 'off' else None
+
+def plan_duplicates(job_id, job_info, keep):
+    """
+    Find the files of a job that can share another file's result
+    
+    Files are matched against the earlier files of the job, then against
+    the files of recent jobs with the same schema. Byte-identical copies
+    share results; near copies do too with DEDUP_NEAR=reuse, and are
+    otherwise extracted and flagged with 'possible_duplicate_of'.
+    
+    Args:
+        job_id (str): Job being queued
+        job_info (dict): Its record
+        keep (dict): Checkpointed results of the files not pending, by
+            index; None for checkpoints since evicted
+    
+    Returns:
+        dict: 'duplicate_of' per file ((index, distance) of the file whose
+        result it will copy, or None), 'flags' per file (flags for its
+        result, or None), 'reused' (results copied from kept files and
+        other jobs, by file index) and 'fingerprints' per file
+    """
+    files = job_files(job_id)
+    count = len(files)
+    plan = {'duplicate_of': [None] * count, 'flags': [None] * count, 'reused': {}, 'fingerprints': [None] * count}
+    if not app.config['DEDUP'] or count == 0:
+        return plan
+    
+    near = app.config['DEDUP_NEAR']
+    max_distance = app.config['DEDUP_MAX_DISTANCE']
+    scope = schema_storage[job_info['schema_id']]['fingerprint']
+    fingerprints = plan['fingerprints'] = [file_fingerprints(file_info) for file_info in files]
+    
+    def match(index, original_filename, distance, exact, result=None, other_job=None):
+        """Reuse or flag a match; returns False if the match is only flagged"""
+        kind = 'exact' if exact else 'near'
+        if exact or near == 'reuse':
+            DUPLICATE_FILES.inc(match=kind, action='reused')
+            if result is not None:
+                plan['reused'][index] = duplicate_result(
+                    result, files[index]['filename'], original_filename, distance, other_job
+                )
+            return True
+        DUPLICATE_FILES.inc(match=kind, action='flagged')
+        plan['flags'][index] = {'possible_duplicate_of': original_filename, 'duplicate_distance': distance}
+        if other_job:
+            plan['flags'][index]['duplicate_job_id'] = other_job
+        return False
+    
+    for index, found in enumerate(cluster(fingerprints, max_distance)):
+        if index in keep or found is None:
+            continue
+        original, distance = found
+        if plan['duplicate_of'][original]:
+            # A copy of a file that reuses another file's result reuses it too
+            original, distance = plan['duplicate_of'][original]
+        exact = fingerprints[index][0] == fingerprints[original][0]
+        if match(index, files[original]['filename'], distance, exact, keep.get(original)) and original not in keep:
+            plan['duplicate_of'][index] = (original, distance)
+    
+    for index, (digest, image_hash) in enumerate(fingerprints):
+        if index in keep or plan['duplicate_of'][index] or index in plan['reused']:
+            continue
+        # Files flagged within the job are extracted, so only indexed
+        matches = [] if plan['flags'][index] else duplicate_index.find(scope, digest, image_hash, max_distance)
+        reused = False
+        for distance, (other_job, other_index) in matches:
+            other = job_storage.get(other_job) if other_job != job_id else None
+            result = file_result(other_job, other_index) if other else None
+            if result is None or 'error' in result:
+                continue
+            other_files = job_files(other_job)
+            exact = other_index < len(other_files) and other_files[other_index].get('sha256') == digest
+            reused = match(index, result['filename'], distance, exact, result, other_job)
+            break
+        if not reused:
+            # Extracted here, possibly flagged: later exact copies can reuse it
+            duplicate_index.add(scope, digest, image_hash, (job_id, index))
+    
+    # Copies of a file reused from another job need not wait for it
+    for index, found in enumerate(plan['duplicate_of']):
+        if found and found[0] in plan['reused']:
+            original, distance = found
+            plan['reused'][index] = duplicate_result(
+                plan['reused'][original], files[index]['filename'], files[original]['filename'], distance
+            )
+            plan['duplicate_of'][index] = None
+    return plan
+
+def resume_plan(job_id, retry_failed=False):
+    """
+    Pick the checkpointed results a resumed job keeps
+    
+    Args:
+        job_id (str): Job to resume
+        retry_failed (bool): Also re-run files whose result has an 'error'
+    
+    Returns:
+        dict: Results to keep by file index, see queue_job
+    """
+    return {
+        index: result
+        for index, result in enumerate(job_checkpoints(job_id))
+        if result is not None and not (retry_failed and 'error' in result)
+    }
+
+def resume_options(job_id, data):
+    """
+    Read the resume options of a /process_images payload
+    
+    Returns:
+        dict: Results to keep, see resume_plan; None to process every file
+    """
+    if data.get('retry_failed'):
+        return resume_plan(job_id, retry_failed=True)
+    if data.get('resume'):
+        return resume_plan(job_id)
+    return None
+
+def finish_resumed_job(job_id):
+    """Complete a resumed job that has no file left to process"""
+    return complete_job(job_id, job_checkpoints(job_id), {})
+
+def run_job(job_id, concurrency, mode='two_pass'):
+    """
+    Process the pending files of a queued job and store its results
+    
+    The files are run by extraction_scheduler under the job's tenant and
+    priority; the job counts as running once its first file starts. Each
+    finished file is checkpointed by record_file_done, and the job's results
+    are assembled from the checkpoints, so resumed jobs keep earlier results.
+    
+    Args:
+        job_id (str): Job to process
+        concurrency (int): Number of files processed in parallel
+        mode (str): Extraction mode, see EXTRACTION_MODES
+    
+    Returns:
+        list: Results for the job's files, or None if the job failed
+    """
+    update_job(job_id, mode=mode)
+    try:
+        # Get job info from memory
+        job_info = job_storage[job_id]
+        schema_id = job_info['schema_id']
+        files = job_files(job_id)
         
-        # Add field with type annotation and Field description
-        class_definition.append(f"    {field_name}: str  = Field(description=\"{description}\")")
+        start_lock = threading.Lock()
+        started = []
+        
+        def submit(function):
+            def task():
+                with start_lock:
+                    if not started:
+                        started.append(True)
+                        update_job(job_id, status='running', started_at=time.time())
+                return function()
+            return extraction_scheduler.submit(
+                task, job_info.get('tenant', 'default'), job_info.get('priority', 0), job_id, concurrency
+            )
+        
+        # Get schema from memory
+        schema = schema_storage[schema_id]
+        
+        # Create structured output model
+        structured_llm = get_structured_llm(schema)
+        
+        stage_timings = {}
+        pending = apply_duplicates(job_id)
+        while pending:
+            extract_files(
+                [files[index] for index in pending], structured_llm, concurrency,
+                on_complete=lambda position, result, seconds, stages, usage, pending=pending: record_file_done(
+                    job_id, pending[position], result, seconds, files[pending[position]].pop('image_stats', None),
+                    stages, usage
+                ),
+                batch_llm=get_batch_llm(schema) if mode == 'batched' else None,
+                submit=submit,
+                stage_timings=stage_timings,
+                schema_fingerprint=schema['fingerprint'],
+                mode=mode
+            )
+            results = job_checkpoints(job_id)
+            pending = requeue_missing(job_id, results)
+        
+        return complete_job(job_id, job_checkpoints(job_id), stage_timings)
+    except Exception as e:
+        update_job(job_id, status='failed', error=str(e), finished_at=time.time())
+        return None
+
+def complete_job(job_id, results, stage_timings):
+    """
+    Store a finished job's results and mark it done
+    
+    Returns:
+        list: The stored results; files without a result are recorded as failed
+    """
+    files = job_files(job_id) if None in results else []
+    stored = results
+    results = [
+        result if result is not None else {
+            'filename': files[index]['filename'] if index < len(files) else None,
+            'error': 'Result was evicted before the job finished; raise MAX_FILE_RESULTS',
+            **empty_usage()
+        }
+        for index, result in enumerate(stored)
+    ]
+    # Store results in memory; the Excel file is built on first download
+    result_storage[job_id] = results
+    export_storage.pop(job_id, None)
+    
+    lost = sum(result is None for result in stored)
     
-    return "\n".join(class_definition)
+    def finish(job_info):
+        job_info.update(status='done', finished_at=time.time(), stage_timings=stage_timings)
+        job_info['files_failed'] = job_info.get('files_failed', 0) + lost
+        job_info['files_completed'] = len(results)
+    
+    job_storage.modify(job_id, finish)
+    with job_events:
+        job_events.notify_all()
+    job_info = job_storage.get(job_id) or {}
+    tenant = job_info.get('tenant', '')
+    if tenant.startswith('session:'):
+        add_session_usage(tenant[len('session:'):], job_info.get('tokens', empty_usage()))
+    # Finished jobs serve per-file results from result_storage
+    for index in range(len(results)):
+        file_result_storage.pop(f"{job_id}:{index}", None)
+    return results
+
+def job_file_timings(job_id, count):
+    """Return the timings of a job's finished files, in file order"""
+    timings = (file_timing_storage.get(f"{job_id}:{index}") for index in range(count))
+    return [timing for timing in timings if timing]
+
+def job_status(job_id):
+    """Return a JSON-serialisable snapshot of a job's state"""
+    job_info = job_storage[job_id]
+    status = {
+        'job_id': job_id,
+        'status': job_info.get('status', 'uploaded'),
+        'mode': job_info.get('mode'),
+        'priority': job_info.get('priority', 0),
+        'files_total': job_info['files_total'],
+        'files_completed': job_info.get('files_completed', 0),
+        'files_failed': job_info.get('files_failed', 0),
+        'files_duplicate': job_info.get('files_duplicate', 0),
+        'bytes_in': job_info.get('bytes_in', 0),
+        'bytes_out': job_info.get('bytes_out', 0),
+        'file_timings': job_file_timings(job_id, job_info['files_total']),
+        'stage_timings': job_info.get('stage_timings', {}),
+        'tokens': usage_report(job_info.get('tokens') or {**empty_usage(), 'by_stage': {}}),
+        'queued_at': job_info.get('queued_at'),
+        'started_at': job_info.get('started_at'),
+        'finished_at': job_info.get('finished_at'),
+        'error': job_info.get('error')
+    }
+    if status['queued_at']:
+        status['wait_seconds'] = round((status['started_at'] or time.time()) - status['queued_at'], 3)
+    if status['started_at']:
+        status['elapsed_seconds'] = round((status['finished_at'] or time.time()) - status['started_at'], 3)
+    return status
 
 # ====================================================
 # Flask Routes - Chat & Image Analysis
 # ====================================================
 
+# Held by the request being profiled: on Python 3.12+ a cProfile profiler
+# sees every thread, so a second one cannot be enabled alongside it
+profile_lock = threading.Lock()
+
+@app.before_request
+def start_request_instrumentation():
+    """Start the request timer, and a profiler when one is requested"""
+    g.request_started = time.perf_counter()
+    profile = request.args.get('profile') or request.headers.get('X-Profile')
+    if not (app.config['PROFILING'] and profile):
+        return
+    if not profile_lock.acquire(blocking=False):
+        g.profile_skipped = True
+        return
+    g.profile_locked = True
+    if profile == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            app.logger.warning("pyinstrument is not installed, profiling with cProfile")
+        else:
+            g.profiler = Profiler()
+            g.profiler.start()
+            return
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+@app.after_request
+def finish_request_instrumentation(response):
+    """Record request metrics and write the request's profile, if any"""
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+    HTTP_SECONDS.observe(time.perf_counter() - g.request_started, method=request.method, endpoint=endpoint)
+    
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        response.headers['X-Profile-File'] = write_profile(profiler)
+    elif g.get('profile_skipped'):
+        response.headers['X-Profile-Skipped'] = 'Another request is being profiled'
+    return response
+
+@app.teardown_request
+def stop_request_profiler(error=None):
+    """Stop a profiler left running by a request that raised, and let the next request profile"""
+    profiler = g.pop('profiler', None)
+    try:
+        if profiler is not None:
+            app.logger.warning("Profile of failed request written to %s", write_profile(profiler))
+    finally:
+        if g.pop('profile_locked', False):
+            profile_lock.release()
+
+def write_profile(profiler):
+    """Stop a request's profiler and write its report to PROFILE_DIR; returns the report's path"""
+    os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+    name = f"{request.endpoint or 'request'}_{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        path = os.path.join(app.config['PROFILE_DIR'], f"{name}.prof")
+        profiler.dump_stats(path)
+    else:
+        profiler.stop()
+        path = os.path.join(app.config['PROFILE_DIR'], f"{name}.html")
+        with open(path, 'w') as f:
+            f.write(profiler.output_html())
+    return path
+
+@register_collector
+def collect_runtime_metrics():
+    """Export scheduler, rate limiter, cache and store state at scrape time"""
+    scheduler = extraction_scheduler.stats()
+    families = [
+        ('invoice_scheduler_queue_depth', 'gauge', 'Extraction tasks waiting for a worker',
+         [({}, scheduler['queue_depth'])]),
+        ('invoice_scheduler_in_flight', 'gauge', 'Extraction tasks running',
+         [({}, scheduler['in_flight'])]),
+        ('invoice_store_entries', 'gauge', 'Entries held by each store',
+         [({'store': store.name}, len(store))
+          for store in (schema_storage, job_storage, job_file_storage, result_storage, export_storage,
+                        file_result_storage, file_timing_storage, chat_session_storage, answer_books,
+                        duplicate_digests)]),
+    ]
+    if rate_limiter:
+        limits = rate_limiter.stats()
+        families += [
+            ('invoice_model_concurrency_limit', 'gauge', 'Current adaptive model concurrency limit',
+             [({}, limits['concurrency_limit'])]),
+            ('invoice_model_attempts_total', 'counter', 'Model call attempts made through the rate limiter',
+             [({}, limits['calls'])]),
+            ('invoice_model_retries_total', 'counter', 'Model calls retried after throttling',
+             [({}, limits['retries'])]),
+            ('invoice_model_throttled_total', 'counter', 'Model calls rejected by the provider for quota',
+             [({}, limits['throttled'])]),
+        ]
+    if work_queue:
+        queue = work_queue.stats()
+        families.append(('invoice_work_queue_items', 'gauge', 'Worker queue files by status',
+                         [({'status': status}, queue[status]) for status in ('pending', 'leased', 'done')]))
+    if extraction_cache:
+        cache = extraction_cache.stats()
+        families.append(('invoice_cache_lookups_total', 'counter', 'Extraction cache lookups by kind and outcome',
+                         [({'kind': kind, 'outcome': 'hit'}, count) for kind, count in cache['hits'].items()] +
+                         [({'kind': kind, 'outcome': 'miss'}, count) for kind, count in cache['misses'].items()]))
+    return families
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     """Render the main chat interface"""
@@ -202,26 +1714,25 @@ def upload_image():
         session_id = os.urandom(16).hex()
     
     # Get conversation chain for this session
-    chain, memory = get_conversation_chain(session_id)
+    try:
+        chain, memory = get_conversation_chain(session_id, request.form.get('memory'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     try:
+        usage = empty_usage()
         # Get image description
-        image_description = get_image_description(image_file)
+        image_description = get_image_description(image_file, usage=usage)
         
-        # Add to memory
-        memory.save_context(
-            {"text": "Image uploaded by user."},
-            {"text": f"Image Description: {image_description}"}
-        )
+        # Pin to memory
+        memory.pin(f"Image Description: {image_description}")
         
-        # Generate suggested questions
-        suggested_questions = suggest_questions(image_description)
+        # Generate suggested questions, with their answers and the invoice facts
+        answer_book = session_answer_book(session_id, create=True)
+        suggested_questions = suggest_questions(image_description, usage=usage, answer_book=answer_book)
+        save_chat_session(session_id, memory, answer_book)
         
-        return jsonify({
-            "session_id": session_id,
-            "description": image_description,
-            "suggested_questions": suggested_questions
-        })
+        return jsonify(upload_reply(session_id, image_description, suggested_questions, usage))
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -240,16 +1751,22 @@ def chat():
         return jsonify({"error": "No session ID provided"}), 400
     
     # Get conversation chain for this session
-    chain, memory = get_conversation_chain(session_id)
+    try:
+        chain, memory = get_conversation_chain(session_id, data.get('memory'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    reply = quick_chat_reply(session_id, question, memory)
+    if reply:
+        return jsonify(reply)
     
     try:
         # Process the question
-        response = chain.invoke({"question": question})
+        collector = UsageCollector()
+        with instrumented('chat'):
+            response = chain.invoke({"question": question}, config={'callbacks': [collector]})
         
-        return jsonify({
-            "response": response['text'],
-            "session_id": session_id
-        })
+        return jsonify(chat_reply(session_id, memory, response['text'], collector.usage))
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -263,11 +1780,20 @@ def reset_conversation():
     if not session_id:
         return jsonify({"error": "No session ID provided"}), 400
     
-    if session_id in conversation_chains:
-        del conversation_chains[session_id]
+    conversation_chains.pop(session_id, None)
+    chat_session_storage.pop(session_id, None)
+    answer_books.pop(session_id, None)
     
     return jsonify({"status": "success", "message": "Conversation reset successfully"})
 
+@app.route('/usage/<session_id>', methods=['GET'])
+def get_session_usage(session_id):
+    """Report the tokens and cost of a chat session and the jobs it started"""
+    return jsonify({
+        "session_id": session_id,
+        "usage": usage_report(session_usage.get(session_id) or empty_usage())
+    })
+
 # ====================================================
 # Flask Routes - Image Extraction
 # ====================================================
@@ -281,13 +1807,21 @@ def extraction_interface():
 def create_schema():
     try:
         schema_data = request.json.get('schema', [])
+        fields = normalize_fields(schema_data)
         
-        # Generate Pydantic model from schema
+        # Generate Pydantic model source from schema, for display only
         pydantic_class_code = json_to_pydantic_model(schema_data)
         
+        # Compile once now so invalid schemas are rejected up front
+        build_schema_model(schema_data)
+        
         # Store schema in memory
         schema_id = str(uuid.uuid4())
-        schema_storage[schema_id] = pydantic_class_code
+        schema_storage[schema_id] = {
+            'fields': [list(field) for field in fields],
+            'fingerprint': schema_fingerprint(fields),
+            'code': pydantic_class_code
+        }
         
         return jsonify({
             'success': True, 
@@ -311,25 +1845,43 @@ def upload_images():
         files = request.files.getlist('files[]')
         file_data = []
         
+        # Create a job ID and store job info in memory
+        job_id = str(uuid.uuid4())
+        spool = app.config['UPLOAD_STORAGE'] == 'spool'
+        if spool:
+            os.makedirs(job_upload_dir(job_id), exist_ok=True)
+        
         for file in files:
             if file.filename == '':
                 continue
             
-            # Store file data in memory
-            file_bytes = file.read()
-            file_data.append({
-                'filename': secure_filename(file.filename),
-                'data': file_bytes
-            })
+            filename = secure_filename(file.filename)
+            if spool:
+                # Stream to disk in chunks; only the path is kept in memory
+                path = os.path.join(job_upload_dir(job_id), f"{len(file_data):05d}_{filename}")
+                file.save(path)
+                file_data.append({
+                    'filename': filename,
+                    'path': path,
+                    'size': os.path.getsize(path)
+                })
+            else:
+                # Store file data in memory
+                file_bytes = file.read()
+                file_data.append({
+                    'filename': filename,
+                    'data': file_bytes
+                })
         
         if not file_data:
+            if spool:
+                shutil.rmtree(job_upload_dir(job_id), ignore_errors=True)
             return jsonify({'success': False, 'error': 'No valid files uploaded'}), 400
         
-        # Create a job ID and store job info in memory
-        job_id = str(uuid.uuid4())
+        job_file_storage[job_id] = file_data
         job_storage[job_id] = {
             'schema_id': schema_id,
-            'files': file_data
+            'files_total': len(file_data)
         }
         
         return jsonify({
@@ -342,87 +1894,336 @@ def upload_images():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+def tenant_of(api_key, session_id, client_address):
+    """Identify who a request is scheduled for, without exposing API keys"""
+    if api_key:
+        return 'key:' + fingerprint(api_key)[:12]
+    if session_id:
+        return f'session:{session_id}'
+    return f'client:{client_address}'
+
+def request_tenant():
+    """Tenant of the current Flask request, see tenant_of"""
+    return tenant_of(
+        request.headers.get('X-API-Key'),
+        (request.get_json(silent=True) or {}).get('session_id'),
+        request.remote_addr
+    )
+
+def process_options(data):
+    """
+    Read the processing options of a /process_images payload
+    
+    Returns:
+        tuple: (concurrency, mode, priority)
+    
+    Raises:
+        ValueError: If the mode or priority is invalid
+    """
+    # Process the images, several at a time
+    concurrency = data.get('concurrency') or app.config['EXTRACTION_CONCURRENCY']
+    concurrency = max(1, min(int(concurrency), app.config['MAX_EXTRACTION_CONCURRENCY']))
+    
+    mode = data.get('mode') or app.config['EXTRACTION_MODE']
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f'Invalid mode, expected one of {", ".join(EXTRACTION_MODES)}')
+    
+    try:
+        priority = int(data.get('priority') or 0)
+    except (TypeError, ValueError):
+        raise ValueError('Priority must be an integer')
+    return concurrency, mode, priority
+
+def enqueue_pending(job_id, mode, priority):
+    """Put a queued job's files on the work queue, after taking off its duplicates"""
+    try:
+        pending = apply_duplicates(job_id)
+        if not pending:
+            complete_job(job_id, job_checkpoints(job_id), {})
+            return
+        work_queue.enqueue(job_id, pending, mode, priority)
+        # Workers own no job: the queue's leases recover files of dead workers
+        update_job(job_id, owner=None)
+    except Exception as e:
+        update_job(job_id, status='failed', error=str(e), finished_at=time.time())
+
+def enqueue_job(job_id, mode, priority):
+    """Leave a queued job to the worker.py processes and build the response"""
+    update_job(job_id, mode=mode)
+    job_executor.submit(enqueue_pending, job_id, mode, priority)
+    return {
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'message': 'Invoice data extraction queued for the workers'
+    }
+
+def completed_job_response(job_id, results):
+    """Build the response of a synchronous /process_images call"""
+    status = job_status(job_id)
+    return {
+        'success': True,
+        'job_id': job_id,
+        'message': 'Invoice data extraction complete',
+        'results': results,
+        'file_timings': status['file_timings'],
+        'stage_timings': status['stage_timings'],
+        'tokens': status['tokens'],
+        'wait_seconds': status.get('wait_seconds'),
+        'elapsed_seconds': status.get('elapsed_seconds'),
+        'bytes_in': status['bytes_in'],
+        'bytes_out': status['bytes_out']
+    }
+
 @app.route('/process_images', methods=['POST'])
 def process_images():
+    """
+    Extract data from an uploaded job
+    
+    Expected JSON payload:
+    {
+        "job_id": "...",
+        "concurrency": 4,   # optional, files processed in parallel
+        "mode": "two_pass", # optional, or "single_pass" / "batched"
+        "priority": 0,      # optional, higher runs first
+        "async": false,     # optional, return immediately and poll /job_status
+        "queue": false,     # optional, leave the job to worker.py processes
+        "resume": false,    # optional, only process files without a result
+        "retry_failed": false # optional, also re-run files that failed
+    }
+    
+    Jobs are scheduled fairly across tenants, identified by the X-API-Key
+    header, then the session_id field, then the client address.
+    
+    Every finished file is checkpointed, so a job interrupted by a crash
+    (with STORAGE_BACKEND=sqlite) or one with failed files can be resumed
+    without paying again for the files that already have a result.
+    """
     try:
         job_id = request.json.get('job_id')
         if not job_id or job_id not in job_storage:
             return jsonify({'success': False, 'error': 'Invalid job ID'}), 400
         
-        # Get job info from memory
-        job_info = job_storage[job_id]
-        schema_id = job_info['schema_id']
-        files = job_info['files']
+        try:
+            concurrency, mode, priority = process_options(request.json)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        # Get schema from memory
-        schema_code = schema_storage[schema_id]
+        if request.json.get('queue') and work_queue is None:
+            return jsonify({'success': False, 'error': 'Queued processing needs STORAGE_BACKEND=sqlite'}), 400
         
-        # Execute the schema code to define the Data class
-        locals_dict = {}
-        exec(schema_code, globals(), locals_dict)
-        Data = locals_dict['Data']
+        if not queue_job(job_id, request_tenant(), priority, resume_options(job_id, request.json)):
+            return jsonify({'success': False, 'error': 'Job is already being processed'}), 409
         
-        # Create structured output model
-        structured_llm = model_vision.with_structured_output(Data)
-        
-        # Process each image
-        results = []
-        for file_info in files:
-            try:
-                # Create temporary BytesIO object
-                file_obj = BytesIO(file_info['data'])
-                
-                # Get image description
-                image_des = get_image_description(file_obj)
-                
-                # Extract structured data
-                result = structured_llm.invoke(f"Extract invoice data from the following text description of an invoice: {image_des}")
-                
-                # Convert to dict and add filename
-                result_dict = result.dict()
-                result_dict['filename'] = file_info['filename']
-                results.append(result_dict)
-            except Exception as e:
-                results.append({
-                    'filename': file_info['filename'],
-                    'error': str(e)
-                })
+        if not job_storage[job_id]['pending']:
+            return jsonify(completed_job_response(job_id, finish_resumed_job(job_id)))
         
-        # Store results in memory
-        result_storage[job_id] = results
+        if request.json.get('queue'):
+            return jsonify(enqueue_job(job_id, mode, priority)), 202
         
-        # Create Excel file in memory
-        excel_buffer = BytesIO()
-        df = pd.DataFrame(results)
-        df.to_excel(excel_buffer, index=False)
-        excel_buffer.seek(0)
+        if request.json.get('async'):
+            job_executor.submit(run_job, job_id, concurrency, mode)
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status': 'queued',
+                'message': 'Invoice data extraction started'
+            }), 202
         
-        return jsonify({
-            'success': True,
-            'job_id': job_id,
-            'message': 'Invoice data extraction complete',
-            'results': results
-        })
+        results = run_job(job_id, concurrency, mode)
+        if results is None:
+            return jsonify({'success': False, 'error': job_storage[job_id]['error']}), 400
+        
+        return jsonify(completed_job_response(job_id, results))
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
-@app.route('/download_excel/<job_id>', methods=['GET'])
-def download_excel(job_id):
-    if job_id not in result_storage:
-        return jsonify({'success': False, 'error': 'Results not found'}), 404
+@app.route('/job_status/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Report the state and progress of a job, with its results once done"""
+    if job_id not in job_storage:
+        return jsonify({'success': False, 'error': 'Invalid job ID'}), 404
+    
+    status = job_status(job_id)
+    if status['status'] == 'done' and job_id in result_storage:
+        status['results'] = result_storage[job_id]
+    
+    return jsonify({'success': True, **status})
+
+def file_result(job_id, index):
+    """Return the result of one finished file, whether or not its job is done"""
+    result = file_result_storage.get(f"{job_id}:{index}")
+    if result is None:
+        results = result_storage.get(job_id) or []
+        result = results[index] if index < len(results) else None
+    return result
+
+def server_sent_event(event, data, event_id=None):
+    """Format one server-sent event with a JSON payload"""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, default=str)}"]
+    return "\n".join(lines) + "\n\n"
+
+def job_event_stream(job_id, cursor=0):
+    """
+    Yield server-sent events for a job until it finishes
+    
+    Every finished file produces a 'result' event with its result and the
+    job's running counts; the event id is the number of files reported so
+    far, so a reconnecting client resumes with Last-Event-ID. The stream ends
+    with a 'done' or 'failed' event carrying the final job status.
+    
+    Args:
+        job_id (str): Job to follow
+        cursor (int): Number of finished files the client has already seen
+    """
+    last_sent = time.time()
+    while True:
+        job_info = job_storage.get(job_id)
+        if job_info is None:
+            yield server_sent_event('failed', {'job_id': job_id, 'error': 'Job not found'})
+            return
+        
+        completed_order = job_info.get('completed_order', [])
+        while cursor < len(completed_order):
+            index = completed_order[cursor]
+            cursor += 1
+            yield server_sent_event('result', {
+                'index': index,
+                'result': file_result(job_id, index),
+                'files_completed': len(completed_order),
+                'files_failed': job_info.get('files_failed', 0),
+                'files_total': job_info['files_total']
+            }, event_id=cursor)
+            last_sent = time.time()
+        
+        status = job_info.get('status', 'uploaded')
+        if status not in ('queued', 'running'):
+            if status == 'uploaded':
+                yield server_sent_event('failed', {'job_id': job_id, 'error': 'Job has not been started'})
+            else:
+                yield server_sent_event(status, job_status(job_id))
+            return
+        
+        if time.time() - last_sent >= app.config['JOB_EVENTS_KEEPALIVE']:
+            # Comment line, keeps proxies from closing an idle stream
+            yield ": keep-alive\n\n"
+            last_sent = time.time()
+        
+        # Woken by progress in this process; the timeout also picks up
+        # progress made by other processes sharing the SQLite stores
+        with job_events:
+            job_events.wait(timeout=app.config['JOB_EVENTS_POLL_INTERVAL'])
+
+@app.route('/job_events/<job_id>', methods=['GET'])
+def get_job_events(job_id):
+    """Stream each file's result as a server-sent event the moment it finishes"""
+    if job_id not in job_storage:
+        return jsonify({'success': False, 'error': 'Invalid job ID'}), 404
+    
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('after') or 0
+    try:
+        cursor = max(0, int(cursor))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid Last-Event-ID'}), 400
+    
+    return Response(
+        stream_with_context(job_event_stream(job_id, cursor)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def build_excel_export(job_id):
+    """
+    Return the Excel export of a job's results, building it only once
+    
+    The workbook is cached in export_storage until the results change.
+    
+    Args:
+        job_id (str): Job whose results are exported
+    
+    Returns:
+        dict: 'data' (xlsx bytes) and 'etag' (hash of the exported results),
+        or None if the job has no results
+    """
+    export = export_storage.get(job_id)
+    if export is not None:
+        return export
+    
+    results = result_storage.get(job_id)
+    if results is None:
+        return None
     
     # Create Excel file in memory
     excel_buffer = BytesIO()
-    df = pd.DataFrame(result_storage[job_id])
-    df.to_excel(excel_buffer, index=False)
-    excel_buffer.seek(0)
+    with instrumented('excel_export'):
+        df = pd.DataFrame(results)
+        df.to_excel(excel_buffer, index=False)
     
-    return send_file(
-        excel_buffer,
+    export = {
+        'data': excel_buffer.getvalue(),
+        'etag': fingerprint(json.dumps(results, sort_keys=True, default=str))
+    }
+    export_storage[job_id] = export
+    return export
+
+@app.route('/download_excel/<job_id>', methods=['GET'])
+def download_excel(job_id):
+    export = build_excel_export(job_id)
+    if export is None:
+        return jsonify({'success': False, 'error': 'Results not found'}), 404
+    
+    # Answers If-None-Match with 304 when the client already has this version
+    response = send_file(
+        BytesIO(export['data']),
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
         as_attachment=True,
-        download_name=f'results_{job_id}.xlsx'
+        download_name=f'results_{job_id}.xlsx',
+        etag=export['etag'],
+        conditional=True
+    )
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/export/<job_id>', methods=['GET'])
+def export_results(job_id):
+    """
+    Stream a job's results as CSV, NDJSON or Parquet
+    
+    Rows are encoded in chunks and sent as a chunked response, so memory use
+    does not grow with the size of the job.
+    
+    Query parameters:
+        format: 'csv' (default), 'ndjson' or 'parquet'
+    """
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'error': f'Invalid format, expected one of {", ".join(EXPORT_FORMATS)}'}), 400
+    if export_format == 'parquet' and pq is None:
+        return jsonify({'success': False, 'error': 'Parquet export requires the pyarrow package'}), 400
+    
+    results = result_storage.get(job_id)
+    if results is None:
+        return jsonify({'success': False, 'error': 'Results not found'}), 404
+    
+    if export_format == 'ndjson':
+        chunks = ndjson_chunks(results)
+    elif export_format == 'csv':
+        chunks = csv_chunks(results, result_columns(results))
+    else:
+        # Type Parquet columns from the job's schema when it is still stored
+        job_info = job_storage.get(job_id) or {}
+        schema = schema_storage.get(job_info.get('schema_id')) or {}
+        field_types = {name: field_type for name, field_type, _ in schema.get('fields', ())}
+        field_types.update(dict.fromkeys((*TOKEN_KEYS, 'duplicate_distance'), 'int'))
+        chunks = parquet_chunks(results, result_columns(results), field_types)
+    
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=results_{job_id}.{extension}'}
     )
 
 @app.route('/cleanup', methods=['POST'])
@@ -432,8 +2233,16 @@ def cleanup():
         schema_id = request.json.get('schema_id')
         
         if job_id:
-            job_storage.pop(job_id, None)
+            job_info = job_storage.pop(job_id, None) or {}
+            job_file_storage.pop(job_id, None)
+            for index in range(job_info.get('files_total', 0)):
+                file_result_storage.pop(f"{job_id}:{index}", None)
+                file_timing_storage.pop(f"{job_id}:{index}", None)
             result_storage.pop(job_id, None)
+            export_storage.pop(job_id, None)
+            if work_queue:
+                work_queue.discard(job_id)
+            shutil.rmtree(job_upload_dir(job_id), ignore_errors=True)
         
         if schema_id:
             schema_storage.pop(schema_id, None)
@@ -451,8 +2260,9 @@ def update_results():
         if not job_id:
             return jsonify({'success': False, 'error': 'Job ID is required'}), 400
         
-        # Update results in memory
+        # Update results in memory and drop the stale Excel export
         result_storage[job_id] = updated_results
+        export_storage.pop(job_id, None)
         
         return jsonify({
             'success': True,
@@ -462,6 +2272,52 @@ def update_results():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Report extraction cache size and hit/miss counters"""
+    if not extraction_cache:
+        return jsonify({'success': True, 'enabled': False})
+    return jsonify({'success': True, 'enabled': True, **extraction_cache.stats()})
+
+@app.route('/clear_cache', methods=['POST'])
+def clear_cache():
+    """Remove every cached description and structured result"""
+    if extraction_cache:
+        extraction_cache.clear()
+    return jsonify({'success': True, 'message': 'Cache cleared successfully'})
+
+@app.route('/storage_stats', methods=['GET'])
+def storage_stats():
+    """Report size, hit/miss and eviction counters of every store"""
+    return jsonify({
+        'success': True,
+        'stores': {
+            store.name: store.stats()
+            for store in (schema_storage, job_storage, job_file_storage, result_storage, export_storage,
+                          file_result_storage, file_timing_storage, chat_session_storage, answer_books,
+                          duplicate_digests)
+        }
+    })
+
+@app.route('/scheduler_stats', methods=['GET'])
+def scheduler_stats():
+    """Report extraction queue depth, in-flight work per tenant and queue wait times"""
+    return jsonify({'success': True, **extraction_scheduler.stats()})
+
+@app.route('/queue_stats', methods=['GET'])
+def queue_stats():
+    """Report the worker queue: files pending and leased, queued jobs and active workers"""
+    if work_queue is None:
+        return jsonify({'success': False, 'error': 'Queued processing needs STORAGE_BACKEND=sqlite'}), 404
+    return jsonify({'success': True, **work_queue.stats()})
+
+@app.route('/rate_limit_stats', methods=['GET'])
+def rate_limit_stats():
+    """Report model call, retry and throttling counters and the current concurrency limit"""
+    if not rate_limiter:
+        return jsonify({'success': True, 'enabled': False})
+    return jsonify({'success': True, 'enabled': True, **rate_limiter.stats()})
+
 @app.route('/update_api_key', methods=['POST'])
 def update_api_key():
     """
@@ -484,11 +2340,12 @@ def update_api_key():
         
         # Reinitialize the model with new API key
         global model_vision
-        model_vision = ChatGoogleGenerativeAI(model=model_name)
+        model_vision = initialize_model()
         
-        # Reset all conversation chains since they use the old model
-        global conversation_chains
-        conversation_chains = {}
+        # Rebuild the conversation chains, which use the old model; the
+        # sessions' history is kept in chat_session_storage
+        conversation_chains.clear()
+        structured_llms.clear()
         
         return jsonify({
             'success': True,
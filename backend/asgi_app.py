@@ -0,0 +1,438 @@
+"""
+Async (ASGI) serving mode.
+
+The Flask app holds a worker thread for the whole of every /upload_image,
+/chat and /process_images call, although those calls mostly wait on the
+model. Here the same three routes are served by Starlette handlers that
+await the model's async interface (ainvoke) and run a job's files with
+asyncio.gather, so one process can keep hundreds of model calls in flight.
+Every other route is served by the Flask app, mounted as a WSGI app. Both
+share the same stores, caches, rate limiter and metrics, and the three
+routes take and return the same payloads as their Flask versions.
+
+Image decoding and other CPU work, and every read or write of the stores
+and the extraction cache (which may be SQLite files), runs in Starlette's
+thread pool, so it does not block the event loop. Files run with at most
+`concurrency` per job and ASYNC_MAX_IN_FLIGHT across the process;
+background jobs run on the event loop rather than on the extraction
+scheduler. Model calls also go through the shared rate limiter, so unless
+RATE_LIMIT=0 at most RATE_LIMIT_MAX_CONCURRENCY (16 by default) of them
+are in flight at once; raise it along with ASYNC_MAX_IN_FLIGHT to keep
+hundreds of calls in flight.
+
+Run with:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+Requires starlette and uvicorn; a2wsgi is used to mount Flask when it is
+installed, Starlette's deprecated WSGIMiddleware otherwise.
+"""
+import asyncio
+import os
+import time
+import warnings
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        from starlette.middleware.wsgi import WSGIMiddleware
+
+import app as backend
+from app import (
+    DESCRIPTION_PROMPT, SINGLE_PASS_PROMPT, STRUCTURE_PROMPT, HTTP_REQUESTS, HTTP_SECONDS, SuggestQue,
+    add_usage, build_image_message, description_cache_key, empty_usage, extraction_cache,
+    image_content, instrumented, record_tokens, usage_of
+)
+from pipeline import Stage, StageTimings
+from quick_answers import ChatPreparation
+from usage import TOKEN_KEYS, UsageCollector
+
+config = backend.app.config
+logger = backend.app.logger
+
+# Files being processed across all async jobs; created on first use so it
+# belongs to the server's event loop
+_file_slots = None
+
+
+def file_slots():
+    global _file_slots
+    if _file_slots is None:
+        _file_slots = asyncio.Semaphore(config['ASYNC_MAX_IN_FLIGHT'])
+    return _file_slots
+
+
+def instrumented_route(handler):
+    """Record the request metrics the Flask hooks record for Flask routes"""
+    async def route(request):
+        started = time.perf_counter()
+        response = await handler(request)
+        endpoint = request.url.path
+        HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+        HTTP_SECONDS.observe(time.perf_counter() - started, method=request.method, endpoint=endpoint)
+        return response
+    return route
+
+# ====================================================
+# Async Model Calls
+# ====================================================
+
+async def describe_image(image_part, cache_key=None):
+    """Async version of app.describe_image"""
+    with instrumented('describe'):
+        response = await backend.model_vision.ainvoke([build_image_message(image_part, DESCRIPTION_PROMPT)])
+    usage = usage_of(response)
+    record_tokens('describe', usage)
+    if extraction_cache and cache_key:
+        await run_in_threadpool(extraction_cache.set, 'description', cache_key, response.content)
+    return response.content, usage
+
+
+async def invoke_structured(structured_llm, model_input, operation):
+    """Async version of app.invoke_structured"""
+    with instrumented(operation):
+        response = await structured_llm.ainvoke(model_input)
+    usage = usage_of(response)
+    record_tokens(operation, usage)
+    if response.get('parsed') is None:
+        raise ValueError(f"Model returned no structured output: {response.get('parsing_error')}")
+    return response['parsed'], usage
+
+
+async def get_image_description(image_bytes, usage):
+    """Async version of app.get_image_description, for bytes already read"""
+    cache_key = description_cache_key(image_bytes)
+    if extraction_cache:
+        cached = await run_in_threadpool(extraction_cache.get, 'description', cache_key)
+        if cached is not None:
+            return cached
+
+    prepared = await run_in_threadpool(backend.prepare_image, image_bytes)
+    description, call_usage = await describe_image(image_content(prepared), cache_key)
+    add_usage(usage, call_usage)
+    return description
+
+
+async def suggest_questions(image_description, usage, answer_book=None):
+    """Async version of app.suggest_questions"""
+    schema = SuggestQue if answer_book is None else ChatPreparation
+    query_llm = backend.model_vision.with_structured_output(schema, include_raw=True)
+    result, call_usage = await invoke_structured(query_llm, image_description, 'suggest_questions')
+    add_usage(usage, call_usage)
+    if answer_book is not None:
+        answer_book.set_facts(result.facts.model_dump(), [(q.question, q.answer) for q in result.questions])
+    return [q.question for q in result.questions]
+
+# ====================================================
+# Async Extraction
+# ====================================================
+
+async def describe_file(state):
+    """Async version of app.describe_file"""
+    if state['mode'] == 'two_pass' and 'description' not in state:
+        state['description'], state['usage']['describe'] = await describe_image(
+            state['image_part'], state['description_key']
+        )
+
+
+async def structure_file(state, structured_llm):
+    """Async version of app.structure_file"""
+    result = None
+    if state['mode'] == 'single_pass':
+        try:
+            result, state['usage']['structure'] = await invoke_structured(
+                structured_llm, [build_image_message(state['image_part'], SINGLE_PASS_PROMPT)], 'extract_single_pass'
+            )
+        except Exception as e:
+            logger.warning("Single-pass extraction failed for %s, using two-pass: %s", state['file_info']['filename'], e)
+    if result is None:
+        if 'description' not in state:
+            cached = await run_in_threadpool(
+                extraction_cache.get, 'description', state['description_key']
+            ) if extraction_cache else None
+            if cached is not None:
+                state['description'] = cached
+            else:
+                state['description'], state['usage']['describe'] = await describe_image(
+                    state['image_part'], state['description_key']
+                )
+        result, usage = await invoke_structured(
+            structured_llm, STRUCTURE_PROMPT.format(description=state['description']), 'extract_structured'
+        )
+        add_usage(state['usage'].setdefault('structure', empty_usage()), usage)
+    await run_in_threadpool(backend.store_structured_result, state, result)
+
+
+async def run_stage(state, name, function, timings):
+    """Run one stage of a file unless an earlier stage finished or failed it"""
+    if 'result' in state or 'exception' in state:
+        return
+    started = time.perf_counter()
+    try:
+        await function(state)
+    except Exception as e:
+        state['exception'] = e
+    busy = time.perf_counter() - started
+    state['timings'][name] = round(busy, 3)
+    timings.record(name, busy, 0.0)
+
+
+async def run_job(job_id, concurrency, mode='two_pass'):
+    """
+    Async version of app.run_job
+
+    The job's files run concurrently on the event loop, at most
+    `concurrency` at a time; batched requests run in the thread pool.
+
+    Returns:
+        list: Results for the job's files, or None if the job failed
+    """
+    try:
+        job_info, files, schema = await run_in_threadpool(start_job, job_id, mode)
+        structured_llm = backend.get_structured_llm(schema)
+        fingerprint = schema['fingerprint']
+        job_slots = asyncio.Semaphore(concurrency)
+        started = []
+
+        async def mark_running():
+            if not started:
+                started.append(True)
+                await run_in_threadpool(backend.update_job, job_id, status='running', started_at=time.time())
+
+        if mode == 'batched':
+            batch_llm = backend.get_batch_llm(schema)
+            timings = StageTimings([Stage('batch', None)])
+
+            async def run_unit(unit):
+                async with job_slots, file_slots():
+                    await mark_running()
+                    start = time.perf_counter()
+                    unit_results = await run_in_threadpool(
+                        backend.extract_batch, [files[index] for index in unit], structured_llm, batch_llm, fingerprint
+                    )
+                    seconds = time.perf_counter() - start
+                    timings.record('batch', seconds, 0.0)
+                    for index, result in zip(unit, unit_results):
+                        usage = {key: result.get(key, 0) for key in TOKEN_KEYS}
+                        await run_in_threadpool(
+                            backend.record_file_done, job_id, index, result, seconds,
+                            files[index].pop('image_stats', None), {'batch': round(seconds, 3)}, {'batch': usage}
+                        )
+                    return unit_results
+
+            def process(pending):
+                units = [
+                    [pending[position] for position in unit]
+                    for unit in backend.plan_batches(
+                        [files[index] for index in pending],
+                        config['BATCH_MAX_IMAGES'], config['BATCH_MAX_BYTES'], config['BATCH_MAX_TOKENS']
+                    )
+                ]
+                return asyncio.gather(*(run_unit(unit) for unit in units))
+        else:
+            stages = ['prepare', 'structure'] if mode == 'single_pass' else ['prepare', 'describe', 'structure']
+            timings = StageTimings([Stage(name, None) for name in stages])
+
+            async def prepare(state):
+                await run_in_threadpool(backend.prepare_file, state, fingerprint)
+
+            async def structure(state):
+                await structure_file(state, structured_llm)
+
+            functions = {'prepare': prepare, 'describe': describe_file, 'structure': structure}
+
+            async def run_file(index, file_info):
+                async with job_slots, file_slots():
+                    await mark_running()
+                    state = {'index': index, 'file_info': file_info, 'mode': mode, 'usage': {}, 'timings': {}}
+                    for name in stages:
+                        await run_stage(state, name, functions[name], timings)
+                    result = backend.finish_file(state)
+                    await run_in_threadpool(
+                        backend.record_file_done, job_id, index, result, sum(state['timings'].values()),
+                        file_info.pop('image_stats', None), state['timings'], state['usage']
+                    )
+                    return result
+
+            def process(pending):
+                return asyncio.gather(*(run_file(index, files[index]) for index in pending))
+
+        # Fingerprinting reads every file
+        pending = await run_in_threadpool(backend.apply_duplicates, job_id)
+        while pending:
+            await process(pending)
+            # Resumed jobs keep the results checkpointed by earlier runs
+            pending = await run_in_threadpool(requeue_evicted, job_id)
+        return await run_in_threadpool(finish_job, job_id, timings.report())
+    except Exception as e:
+        await run_in_threadpool(backend.update_job, job_id, status='failed', error=str(e), finished_at=time.time())
+        return None
+
+
+def start_job(job_id, mode):
+    """Record the job's mode and load it, its files and its schema"""
+    backend.update_job(job_id, mode=mode)
+    job_info = backend.job_storage[job_id]
+    return job_info, backend.job_files(job_id), backend.schema_storage[job_info['schema_id']]
+
+
+def requeue_evicted(job_id):
+    """Requeue the job's files whose checkpoints were evicted"""
+    return backend.requeue_missing(job_id, backend.job_checkpoints(job_id))
+
+
+def finish_job(job_id, stage_timings):
+    """Complete the job from its checkpointed results"""
+    return backend.complete_job(job_id, backend.job_checkpoints(job_id), stage_timings)
+
+# ====================================================
+# Async Routes
+# ====================================================
+
+# Background jobs, kept referenced until they finish
+_background_jobs = set()
+
+
+def accept_job(job_id, tenant, priority, data):
+    """Queue a job with the resume options of a /process_images payload"""
+    return backend.queue_job(job_id, tenant, priority, backend.resume_options(job_id, data))
+
+
+def finish_resumed_job(job_id):
+    """Complete a resumed job with no files left and build the response"""
+    return backend.completed_job_response(job_id, backend.finish_resumed_job(job_id))
+
+
+@instrumented_route
+async def upload_image(request):
+    """Async version of the Flask /upload_image route"""
+    form = await request.form()
+    if 'image' not in form:
+        return JSONResponse({"error": "No image file provided"}, status_code=400)
+
+    image_file = form['image']
+    # Generate a session ID if not provided
+    session_id = form.get('session_id') or os.urandom(16).hex()
+
+    try:
+        chain, memory = await run_in_threadpool(backend.get_conversation_chain, session_id, form.get('memory'))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    try:
+        usage = empty_usage()
+        image_description = await get_image_description(await image_file.read(), usage)
+        memory.pin(f"Image Description: {image_description}")
+        answer_book = await run_in_threadpool(backend.session_answer_book, session_id, create=True)
+        suggested_questions = await suggest_questions(image_description, usage, answer_book)
+        await run_in_threadpool(backend.save_chat_session, session_id, memory, answer_book)
+        return JSONResponse(
+            await run_in_threadpool(backend.upload_reply, session_id, image_description, suggested_questions, usage)
+        )
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@instrumented_route
+async def chat(request):
+    """Async version of the Flask /chat route"""
+    data = await request.json()
+    question = data.get('question')
+    session_id = data.get('session_id')
+
+    if not question:
+        return JSONResponse({"error": "No question provided"}, status_code=400)
+
+    if not session_id:
+        return JSONResponse({"error": "No session ID provided"}, status_code=400)
+
+    try:
+        chain, memory = await run_in_threadpool(backend.get_conversation_chain, session_id, data.get('memory'))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    reply = await run_in_threadpool(backend.quick_chat_reply, session_id, question, memory)
+    if reply:
+        return JSONResponse(reply)
+
+    try:
+        collector = UsageCollector()
+        with instrumented('chat'):
+            response = await chain.ainvoke({"question": question}, config={'callbacks': [collector]})
+        return JSONResponse(
+            await run_in_threadpool(backend.chat_reply, session_id, memory, response['text'], collector.usage)
+        )
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@instrumented_route
+async def process_images(request):
+    """Async version of the Flask /process_images route"""
+    try:
+        data = await request.json()
+        job_id = data.get('job_id')
+        if not job_id or not await run_in_threadpool(backend.job_storage.__contains__, job_id):
+            return JSONResponse({'success': False, 'error': 'Invalid job ID'}, status_code=400)
+
+        try:
+            concurrency, mode, priority = backend.process_options(data)
+        except ValueError as e:
+            return JSONResponse({'success': False, 'error': str(e)}, status_code=400)
+
+        if data.get('queue') and backend.work_queue is None:
+            return JSONResponse({'success': False, 'error': 'Queued processing needs STORAGE_BACKEND=sqlite'}, status_code=400)
+
+        client = request.client.host if request.client else None
+        tenant = backend.tenant_of(request.headers.get('X-API-Key'), data.get('session_id'), client)
+        if not await run_in_threadpool(accept_job, job_id, tenant, priority, data):
+            return JSONResponse({'success': False, 'error': 'Job is already being processed'}, status_code=409)
+
+        if not (await run_in_threadpool(backend.job_storage.__getitem__, job_id))['pending']:
+            return JSONResponse(await run_in_threadpool(finish_resumed_job, job_id))
+
+        if data.get('queue'):
+            return JSONResponse(await run_in_threadpool(backend.enqueue_job, job_id, mode, priority), status_code=202)
+
+        if data.get('async'):
+            task = asyncio.create_task(run_job(job_id, concurrency, mode))
+            _background_jobs.add(task)
+            task.add_done_callback(_background_jobs.discard)
+            return JSONResponse({
+                'success': True,
+                'job_id': job_id,
+                'status': 'queued',
+                'message': 'Invoice data extraction started'
+            }, status_code=202)
+
+        results = await run_job(job_id, concurrency, mode)
+        if results is None:
+            job_info = await run_in_threadpool(backend.job_storage.__getitem__, job_id)
+            return JSONResponse({'success': False, 'error': job_info['error']}, status_code=400)
+        return JSONResponse(await run_in_threadpool(backend.completed_job_response, job_id, results))
+
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=400)
+
+
+app = Starlette(routes=[
+    Route('/upload_image', upload_image, methods=['POST']),
+    Route('/chat', chat, methods=['POST']),
+    Route('/process_images', process_images, methods=['POST']),
+    # Everything else is served by the Flask app
+    Mount('/', app=WSGIMiddleware(backend.app)),
+])
+app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,205 @@
+"""
+Measure extraction throughput against the fake vision model.
+
+Uploads N synthetic invoices built from the demo_images/ and data/raw/
+corpus through the Flask endpoints, processes them, and reports files/sec,
+per-file latency percentiles, peak RSS and the number of model calls. No
+API quota is used: the app runs with MODEL=fake, whose latency, error rate
+and response size are set from the command line.
+
+Each synthetic invoice is a corpus image with a unique trailer appended, so
+every file has distinct content (and distinct cache keys) while decoding to
+the same picture.
+
+Usage (from backend/):
+    python benchmarks/throughput.py --files 200 --latency 0.5 --concurrency 8
+    python benchmarks/throughput.py --files 200 --mode single_pass --error-rate 0.02 --json
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = ["demo_images/*", "data/raw/*"]
+SCHEMA = [
+    ["invoice_number", "str", "The invoice number"],
+    ["invoice_date", "str", "The invoice date"],
+    ["total_amount", "float", "The total amount"],
+    ["line_items", "List[str]", "Descriptions of the line items"],
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=100, help="Synthetic invoices to process")
+    parser.add_argument("--job-size", type=int, default=25, help="Files per uploaded job (stay under MAX_CONTENT_LENGTH)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Per-job concurrency sent to /process_images")
+    parser.add_argument("--mode", default="two_pass", choices=("two_pass", "single_pass", "batched"))
+    parser.add_argument("--async", dest="run_async", action="store_true",
+                        help="Start every job with async: true and wait for all of them")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake model seconds per call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of model calls that fail")
+    parser.add_argument("--response-size", type=int, default=0, help="Characters per fake transcription")
+    parser.add_argument("--storage", choices=("memory", "spool"), default="spool", help="UPLOAD_STORAGE mode")
+    parser.add_argument("--cache", action="store_true", help="Keep the extraction cache enabled")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    return parser.parse_args()
+
+
+def configure(args, workdir):
+    """Point the app at the fake model and throwaway storage before it is imported"""
+    os.environ.update({
+        "MODEL": "fake",
+        "FAKE_MODEL_LATENCY": str(args.latency),
+        "FAKE_MODEL_ERROR_RATE": str(args.error_rate),
+        "FAKE_MODEL_RESPONSE_SIZE": str(args.response_size),
+        "UPLOAD_STORAGE": args.storage,
+        "EXTRACTION_CACHE": "1" if args.cache else "0",
+        "EXTRACTION_CACHE_PATH": os.path.join(workdir, "cache.sqlite3"),
+        "STORAGE_PATH": os.path.join(workdir, "storage.sqlite3"),
+    })
+
+
+def load_corpus():
+    paths = sorted(path for pattern in CORPUS for path in glob.glob(os.path.join(BACKEND, pattern)))
+    return [(os.path.basename(path), open(path, "rb").read()) for path in paths]
+
+
+def synthetic_invoices(corpus, count):
+    """Yield (filename, bytes) pairs cycling through the corpus, each unique"""
+    for index in range(count):
+        name, content = corpus[index % len(corpus)]
+        stem, extension = os.path.splitext(name)
+        # Decoders ignore data after the end of the image
+        yield f"{stem}_{index:05d}{extension}", content + f"\0synthetic-{index}".encode()
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def run(args, backend):
+    client = backend.app.test_client()
+    schema_id = client.post('/create_schema', json={'schema': SCHEMA}).json['schema_id']
+    corpus = load_corpus()
+    invoices = list(synthetic_invoices(corpus, args.files))
+
+    job_ids = []
+    for start in range(0, len(invoices), args.job_size):
+        batch = invoices[start:start + args.job_size]
+        data = {'schema_id': schema_id, 'files[]': [(BytesIO(content), name) for name, content in batch]}
+        response = client.post('/upload_images', data=data, content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise SystemExit(f"Upload failed with HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        job_ids.append(response.json['job_id'])
+    del invoices
+
+    model = getattr(backend.model_vision, 'bound', backend.model_vision)
+    calls_before = model.call_counts()
+    rss_before = peak_rss_mib()
+    payload = {'concurrency': args.concurrency, 'mode': args.mode}
+
+    started = time.perf_counter()
+    if args.run_async:
+        for job_id in job_ids:
+            client.post('/process_images', json={**payload, 'job_id': job_id, 'async': True})
+        pending = set(job_ids)
+        while pending:
+            time.sleep(0.05)
+            for job_id in list(pending):
+                if client.get(f'/job_status/{job_id}').json['status'] in ('done', 'failed'):
+                    pending.discard(job_id)
+    else:
+        for job_id in job_ids:
+            client.post('/process_images', json={**payload, 'job_id': job_id})
+    elapsed = time.perf_counter() - started
+
+    latencies, failed, stage_seconds = [], 0, {}
+    for job_id in job_ids:
+        status = client.get(f'/job_status/{job_id}').json
+        for timing in status['file_timings']:
+            latencies.append(timing['seconds'])
+            failed += timing['status'] == 'error'
+        for stage, timing in status.get('stage_timings', {}).items():
+            stage_seconds[stage] = stage_seconds.get(stage, 0.0) + timing['busy_seconds']
+        client.post('/cleanup', json={'job_id': job_id})
+    latencies.sort()
+
+    calls_after = model.call_counts()
+    calls = {key: calls_after.get(key, 0) - calls_before.get(key, 0) for key in calls_after}
+    return {
+        'files': len(latencies),
+        'failed': failed,
+        'jobs': len(job_ids),
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'async': args.run_async,
+        'model_latency': args.latency,
+        'elapsed_seconds': round(elapsed, 3),
+        'files_per_second': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'latency_seconds': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else 0.0,
+        },
+        'stage_busy_seconds': {stage: round(seconds, 3) for stage, seconds in stage_seconds.items()},
+        'model_calls': calls,
+        'model_calls_per_file': round(sum(calls.get(kind, 0) for kind in ('generate', 'structured')) / max(1, len(latencies)), 2),
+        'peak_rss_mib': round(peak_rss_mib(), 1),
+        'peak_rss_growth_mib': round(peak_rss_mib() - rss_before, 1),
+    }
+
+
+def print_report(report):
+    latency = report['latency_seconds']
+    print(f"{report['files']} files in {report['jobs']} jobs, mode={report['mode']}, "
+          f"concurrency={report['concurrency']}, model latency={report['model_latency']}s")
+    print(f"  throughput     {report['files_per_second']:>8} files/s ({report['elapsed_seconds']}s total)")
+    print(f"  latency        p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  "
+          f"p99 {latency['p99']:.3f}s  max {latency['max']:.3f}s")
+    print(f"  failed files   {report['failed']:>8}")
+    print(f"  model calls    {report['model_calls']} ({report['model_calls_per_file']} per file)")
+    if report['stage_busy_seconds']:
+        print(f"  stage busy     {report['stage_busy_seconds']}")
+    print(f"  peak RSS       {report['peak_rss_mib']:>8} MiB (+{report['peak_rss_growth_mib']} MiB while processing)")
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="invoice-benchmark-")
+    configure(args, workdir)
+    os.chdir(BACKEND)
+    sys.path.insert(0, BACKEND)
+    import app as backend
+
+    backend.app.config['UPLOAD_FOLDER'] = workdir
+    try:
+        report = run(args, backend)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compare memory held by uploaded jobs in 'memory' and 'spool' storage modes.
+
+Uploads the same batch of invoice images as several jobs through the Flask
+test client, then processes them with the fake model, and reports Python
+heap usage (tracemalloc) retained after upload and at peak while processing.
+
+Usage (from backend/):
+    python benchmarks/upload_memory.py --jobs 5 --files 30
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MODEL", "fake")
+os.environ.setdefault("EXTRACTION_CACHE", "0")
+
+import app as backend  # noqa: E402
+
+CORPUS = ["demo_images/*", "data/raw/*"]
+SCHEMA = [["invoice_number", "str", "The invoice number"], ["total_amount", "float", "The total amount"]]
+
+
+def load_corpus():
+    paths = sorted(path for pattern in CORPUS for path in glob.glob(pattern))
+    return [(os.path.basename(path), open(path, "rb").read()) for path in paths]
+
+
+def run(mode, corpus, jobs, files_per_job, concurrency):
+    backend.app.config['UPLOAD_STORAGE'] = mode
+    client = backend.app.test_client()
+    schema_id = client.post('/create_schema', json={'schema': SCHEMA}).json['schema_id']
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    job_ids = []
+    for _ in range(jobs):
+        batch = [corpus[i % len(corpus)] for i in range(files_per_job)]
+        data = {'schema_id': schema_id, 'files[]': [(BytesIO(content), name) for name, content in batch]}
+        response = client.post('/upload_images', data=data, content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise SystemExit(f"Upload failed with HTTP {response.status_code}")
+        job_ids.append(response.json['job_id'])
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+
+    tracemalloc.reset_peak()
+    for job_id in job_ids:
+        client.post('/process_images', json={'job_id': job_id, 'concurrency': concurrency})
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    for job_id in job_ids:
+        client.post('/cleanup', json={'job_id': job_id})
+    return retained, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=5, help="Jobs uploaded before processing")
+    parser.add_argument("--files", type=int, default=30, help="Files per job (stay under MAX_CONTENT_LENGTH)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Files processed in parallel")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    upload_bytes = sum(len(corpus[i % len(corpus)][1]) for i in range(args.files)) * args.jobs
+    print(f"{args.jobs} jobs x {args.files} files, {upload_bytes / 2**20:.1f} MiB uploaded\n")
+    print(f"{'mode':<8} {'retained after upload':>22} {'peak while processing':>22}")
+
+    upload_folder = tempfile.mkdtemp(prefix="invoice-uploads-")
+    backend.app.config['UPLOAD_FOLDER'] = upload_folder
+    try:
+        for mode in ("memory", "spool"):
+            retained, peak = run(mode, corpus, args.jobs, args.files, args.concurrency)
+            print(f"{mode:<8} {retained / 2**20:>18.1f} MiB {peak / 2**20:>18.1f} MiB")
+    finally:
+        shutil.rmtree(upload_folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
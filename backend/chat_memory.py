@@ -0,0 +1,164 @@
+"""
+Bounded conversation memory for chat sessions.
+
+An unbounded buffer resends the whole conversation on every turn, so the
+cost of a turn grows with the length of the session. SessionMemory keeps
+the invoice transcriptions pinned (they are sent with every turn, but never
+trimmed) and bounds the rest of the history with one of these strategies:
+
+- 'buffer':  keep everything (the old behaviour)
+- 'window':  keep the last `window` question/answer exchanges
+- 'token':   drop the oldest exchanges until the history fits `max_tokens`
+- 'summary': fold the exchanges that no longer fit `max_tokens` into a
+             running summary written by the model
+
+Tokens are estimated at about four characters per token, so trimming
+never needs a tokenizer or a model call.
+
+dump_state and load_state turn the history into plain data and back, so a
+session can be stored and continued by another process.
+"""
+from typing import Any, Dict, List, Optional
+
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain_core.messages import SystemMessage, get_buffer_string, messages_from_dict, messages_to_dict
+from langchain_core.runnables.config import run_in_executor
+
+from usage import add_usage, empty_usage, usage_of
+
+MEMORY_STRATEGIES = ('buffer', 'window', 'token', 'summary')
+
+SUMMARY_PROMPT = (
+    "Progressively summarize the conversation between a user and an assistant about an invoice, "
+    "adding onto the previous summary and returning a new summary. Keep every number, date, "
+    "name and amount that was asked about or answered.\n\n"
+    "Current summary:\n{summary}\n\n"
+    "New lines of conversation:\n{new_lines}\n\n"
+    "New summary:"
+)
+
+
+def estimate_tokens(messages):
+    """Estimate the tokens of a list of messages at four characters per token"""
+    return sum(len(str(message.content)) for message in messages) // 4 + 4 * len(messages)
+
+
+class SessionMemory(BaseChatMemory):
+    """Chat history with pinned invoice facts and a bounded remainder"""
+
+    strategy: str = 'window'
+    window: int = 6
+    max_tokens: int = 2000
+    # Model that writes the running summary for the 'summary' strategy
+    summary_llm: Optional[Any] = None
+    pinned: List[str] = []
+    summary: str = ''
+    # Tokens used by summary calls that the caller has not collected yet
+    usage: Dict[str, int] = {}
+    memory_key: str = 'chat_history'
+    facts_key: str = 'invoice_facts'
+    input_key: Optional[str] = 'question'
+    return_messages: bool = True
+
+    @property
+    def memory_variables(self):
+        return [self.memory_key, self.facts_key]
+
+    def pin(self, text):
+        """Keep text, such as an invoice transcription, in every future prompt"""
+        self.pinned.append(text)
+
+    def load_memory_variables(self, inputs):
+        messages = list(self.chat_memory.messages)
+        if self.summary:
+            messages.insert(0, SystemMessage(content=f"Summary of the earlier conversation: {self.summary}"))
+        return {
+            self.memory_key: messages,
+            self.facts_key: "\n\n".join(self.pinned) or "No invoice has been uploaded yet."
+        }
+
+    def save_context(self, inputs, outputs):
+        super().save_context(inputs, outputs)
+        self.trim()
+
+    async def asave_context(self, inputs, outputs):
+        await super().asave_context(inputs, outputs)
+        if self.strategy == 'summary' and self.summary_llm is not None:
+            # Summarizing calls the model synchronously; keep it off the event loop
+            await run_in_executor(None, self.trim)
+        else:
+            self.trim()
+
+    def trim(self):
+        """Apply the strategy to the stored history"""
+        messages = self.chat_memory.messages
+        if self.strategy == 'window':
+            dropped = max(0, len(messages) - 2 * self.window)
+        elif self.strategy in ('token', 'summary'):
+            dropped = 0
+            # Drop whole exchanges, oldest first, always keeping the latest one
+            while len(messages) - dropped > 2 and estimate_tokens(messages[dropped:]) > self.max_tokens:
+                dropped += 2
+        else:
+            dropped = 0
+        if not dropped:
+            return
+        if self.strategy == 'summary' and self.summary_llm is not None:
+            self.summarize(messages[:dropped])
+        self.chat_memory.messages = messages[dropped:]
+
+    def summarize(self, messages):
+        """Fold messages into the running summary"""
+        response = self.summary_llm.invoke(
+            SUMMARY_PROMPT.format(summary=self.summary or "(empty)", new_lines=get_buffer_string(messages))
+        )
+        self.summary = str(response.content).strip()
+        add_usage(self.usage, usage_of(response))
+
+    def dump_state(self):
+        """Return the strategy, pinned texts, summary and messages as plain data"""
+        return {
+            'strategy': self.strategy,
+            'pinned': list(self.pinned),
+            'summary': self.summary,
+            'messages': messages_to_dict(self.chat_memory.messages)
+        }
+
+    def load_state(self, state):
+        """Replace the history with one returned by dump_state"""
+        self.strategy = state['strategy']
+        self.pinned = list(state['pinned'])
+        self.summary = state['summary']
+        self.chat_memory.messages = messages_from_dict(state['messages'])
+
+    def take_usage(self):
+        """Return and reset the tokens used by summary calls"""
+        usage, self.usage = self.usage or empty_usage(), empty_usage()
+        return usage
+
+    def clear(self):
+        super().clear()
+        self.summary = ''
+        self.usage = empty_usage()
+
+
+def create_memory(strategy='window', summary_llm=None, window=6, max_tokens=2000):
+    """
+    Create the memory of a chat session
+
+    Args:
+        strategy (str): One of MEMORY_STRATEGIES
+        summary_llm: Model that writes summaries, used by 'summary'
+        window (int): Exchanges kept by 'window'
+        max_tokens (int): History budget of 'token' and 'summary'
+
+    Returns:
+        SessionMemory: Memory for an LLMChain whose prompt uses
+        {chat_history} and {invoice_facts}
+
+    Raises:
+        ValueError: If the strategy is unknown
+    """
+    if strategy not in MEMORY_STRATEGIES:
+        raise ValueError(f"memory must be one of {', '.join(MEMORY_STRATEGIES)}")
+    return SessionMemory(strategy=strategy, summary_llm=summary_llm, window=window, max_tokens=max_tokens)
@@ -0,0 +1,369 @@
+"""
+Extract invoice data from a folder of scans on the command line.
+
+Files are taken from directories (searched recursively for images) and
+glob patterns, and streamed through the same extraction pipeline as the
+web app, a chunk at a time. Each result is appended to the output as soon
+as its file finishes, so a run over tens of thousands of scans keeps little
+in memory and loses little when it is interrupted.
+
+The schema file holds the same [name, type, description] list that
+/create_schema accepts.
+
+Output formats, chosen by --format or the output's extension:
+    .jsonl   one JSON object per line
+    .csv     the file name, the schema fields, error and token counts
+    .parquet a directory of part files, a new part every --part-rows rows
+             (needs pyarrow)
+
+--resume skips files that already have a row in the output, and
+--retry-failed also re-runs files whose row has an error; the new row is
+appended after the old one, and the last row of a file wins. Files are
+identified by their path as found, so resume with the same inputs from the
+same directory.
+
+Usage (from backend/):
+    python cli.py data/raw -s schema.json -o results.jsonl --concurrency 8
+    python cli.py "scans/2024-*/*.jpg" -s schema.json -o results.parquet --mode single_pass --resume
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import threading
+import time
+
+from export import csv_row
+from usage import TOKEN_KEYS, add_usage, empty_usage
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.jfif', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff', '.heic', '.heif')
+
+OUTPUT_FORMATS = ('jsonl', 'csv', 'parquet')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="Directories, image files or glob patterns")
+    parser.add_argument("-s", "--schema", required=True, help="JSON file with the [name, type, description] field list")
+    parser.add_argument("-o", "--output", required=True, help="Output file, or directory for parquet")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="Output format; defaults to the output's extension")
+    parser.add_argument("--mode", default=None, choices=("two_pass", "single_pass", "batched"), help="Extraction mode")
+    parser.add_argument("--concurrency", type=int, default=4, help="Model calls (files or batches) in flight")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Files handed to the pipeline at a time")
+    parser.add_argument("--part-rows", type=int, default=1000, help="Rows per parquet part file")
+    parser.add_argument("--resume", action="store_true", help="Skip files that already have a row in the output")
+    parser.add_argument("--retry-failed", action="store_true", help="Like --resume, but re-run files whose row has an error")
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+    args = parser.parse_args(argv)
+    args.format = args.format or output_format(args.output)
+    if args.format is None:
+        parser.error(f"cannot tell the format of {args.output}; use --format")
+    return args
+
+
+def output_format(path):
+    """Guess the output format from a path's extension"""
+    extension = os.path.splitext(path.rstrip(os.sep))[1].lower().lstrip('.')
+    return {'ndjson': 'jsonl', 'json': 'jsonl', 'pq': 'parquet'}.get(extension, extension if extension in OUTPUT_FORMATS else None)
+
+
+def find_files(inputs):
+    """
+    Expand directories and glob patterns to image files
+
+    Returns:
+        list: Paths in a stable order, without repeats
+    """
+    found = {}
+    for entry in inputs:
+        if os.path.isdir(entry):
+            paths = []
+            for directory, _, names in os.walk(entry):
+                paths.extend(os.path.join(directory, name) for name in names)
+            paths = [path for path in sorted(paths) if path.lower().endswith(IMAGE_EXTENSIONS)]
+        elif os.path.isfile(entry):
+            paths = [entry]
+        else:
+            paths = sorted(path for path in glob.glob(entry, recursive=True) if os.path.isfile(path))
+        for path in paths:
+            found.setdefault(os.path.normpath(path), None)
+    return list(found)
+
+
+def load_schema(path):
+    """Read and validate a schema file; returns its normalized fields"""
+    from schemas import build_schema_model, normalize_fields
+
+    with open(path) as f:
+        schema_data = json.load(f)
+    if isinstance(schema_data, dict) and 'schema' in schema_data:
+        schema_data = schema_data['schema']
+    fields = normalize_fields(schema_data)
+    build_schema_model(schema_data)
+    return [list(field) for field in fields]
+
+
+# ====================================================
+# Output writers
+#
+# Each writer appends rows as files finish and reports the rows of earlier
+# runs for --resume. Rows are flushed as they are written.
+
+def truncate_partial_line(path):
+    """Drop a last line left unfinished by an interrupted run"""
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+class JsonlWriter:
+    def __init__(self, path, columns, field_types):
+        self.path = path
+        if os.path.exists(path):
+            truncate_partial_line(path)
+        self.file = None
+
+    def existing(self):
+        """Yield the rows already in the output"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def write(self, row):
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        self.file.write(json.dumps(row, default=str) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class CsvWriter:
+    def __init__(self, path, columns, field_types):
+        self.path = path
+        self.columns = columns
+        if os.path.exists(path) and os.path.getsize(path):
+            truncate_partial_line(path)
+            with open(path, newline='') as f:
+                # Keep appending under the header the file was started with
+                self.columns = next(csv.reader(f), None) or columns
+        self.file = None
+        self.writer = None
+
+    def existing(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, newline='') as f:
+            yield from csv.DictReader(f)
+
+    def write(self, row):
+        if self.writer is None:
+            header = not (os.path.exists(self.path) and os.path.getsize(self.path))
+            self.file = open(self.path, 'a', newline='')
+            self.writer = csv.DictWriter(self.file, fieldnames=self.columns, extrasaction='ignore')
+            if header:
+                self.writer.writeheader()
+        self.writer.writerow(csv_row(row))
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class ParquetWriter:
+    """
+    Parquet parts in a directory
+
+    A Parquet file cannot be appended to, so every part_rows rows are
+    written as a new part; a run that is killed loses at most the rows not
+    yet written, whose files --resume then runs again.
+    """
+
+    def __init__(self, path, columns, field_types, part_rows=1000):
+        from export import arrow_schema, pq
+
+        self.path = path
+        self.part_rows = part_rows
+        self.schema, self.field_types = arrow_schema(columns, field_types)
+        self.pq = pq
+        self.rows = []
+        os.makedirs(path, exist_ok=True)
+        # Parts being written when a run was killed
+        for name in os.listdir(path):
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(path, name))
+        parts = self.parts()
+        self.next_part = int(parts[-1][len('part-'):-len('.parquet')]) + 1 if parts else 0
+
+    def parts(self):
+        return sorted(name for name in os.listdir(self.path) if name.startswith('part-') and name.endswith('.parquet'))
+
+    def existing(self):
+        for name in self.parts():
+            table = self.pq.read_table(os.path.join(self.path, name), columns=['filename', 'error'])
+            yield from table.to_pylist()
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.part_rows:
+            self.flush()
+
+    def flush(self):
+        from export import arrow_table
+
+        if not self.rows:
+            return
+        # Write under a temporary name, so a part is either whole or absent
+        name = f"part-{self.next_part:05d}.parquet"
+        temporary = os.path.join(self.path, f".{name}.tmp")
+        self.pq.write_table(arrow_table(self.rows, self.schema, self.field_types), temporary)
+        os.replace(temporary, os.path.join(self.path, name))
+        self.next_part += 1
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+
+def open_writer(args, fields):
+    """Create the writer of the chosen format, with the schema's columns"""
+    columns = ['filename'] + [name for name, _, _ in fields] + ['error', *TOKEN_KEYS]
+    field_types = {name: field_type for name, field_type, _ in fields}
+    field_types.update(dict.fromkeys(TOKEN_KEYS, 'int'))
+    if args.format == 'parquet':
+        return ParquetWriter(args.output, columns, field_types, args.part_rows)
+    if args.format == 'csv':
+        return CsvWriter(args.output, columns, field_types)
+    return JsonlWriter(args.output, columns, field_types)
+
+
+def output_exists(path):
+    """Tell whether an output file, or parquet directory, already has content"""
+    if os.path.isdir(path):
+        return bool(os.listdir(path))
+    return os.path.exists(path) and os.path.getsize(path) > 0
+
+
+def finished_files(writer, retry_failed=False):
+    """File names that already have a row, or a row without an error"""
+    finished = set()
+    for row in writer.existing():
+        if retry_failed and row.get('error'):
+            finished.discard(row.get('filename'))
+        else:
+            finished.add(row.get('filename'))
+    return finished
+
+
+# ====================================================
+# Extraction
+
+class Progress:
+    """Writes finished files' results, counts them and their tokens, and prints progress"""
+
+    def __init__(self, total, writer, quiet=False):
+        self.total = total
+        self.writer = writer
+        self.quiet = quiet
+        self.done = 0
+        self.failed = 0
+        self.usage = empty_usage()
+        self.started = time.perf_counter()
+        self.reported = self.started
+        self.lock = threading.Lock()
+
+    def record(self, result):
+        # Called from pipeline threads
+        with self.lock:
+            self.writer.write(result)
+            self.done += 1
+            self.failed += 'error' in result
+            add_usage(self.usage, {key: result.get(key, 0) for key in TOKEN_KEYS})
+            now = time.perf_counter()
+            if not self.quiet and (now - self.reported >= 5 or self.done == self.total):
+                self.reported = now
+                print(f"{self.done}/{self.total} files, {self.failed} failed, "
+                      f"{self.done / (now - self.started):.1f} files/s", file=sys.stderr, flush=True)
+
+
+def run(args, backend, paths, fields, progress):
+    """Stream the files through the pipeline and append each result as it finishes"""
+    schema = {'fields': fields, 'fingerprint': backend.schema_fingerprint(fields)}
+    structured_llm = backend.get_structured_llm(schema)
+    mode = args.mode or backend.app.config['EXTRACTION_MODE']
+    batch_llm = backend.get_batch_llm(schema) if mode == 'batched' else None
+
+    for start in range(0, len(paths), args.chunk_size):
+        chunk = [
+            {'filename': path, 'path': path, 'size': os.path.getsize(path)}
+            for path in paths[start:start + args.chunk_size]
+        ]
+        backend.extract_files(
+            chunk, structured_llm, args.concurrency, on_complete=lambda index, result, *_: progress.record(result),
+            batch_llm=batch_llm, schema_fingerprint=schema['fingerprint'], mode=mode
+        )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        fields = load_schema(args.schema)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Invalid schema file {args.schema}: {e}")
+
+    if not (args.resume or args.retry_failed) and output_exists(args.output):
+        sys.exit(f"{args.output} already exists; use --resume to add to it, or remove it")
+    paths = find_files(args.inputs)
+    try:
+        writer = open_writer(args, fields)
+    except RuntimeError as e:
+        sys.exit(str(e))
+    if args.resume or args.retry_failed:
+        finished = finished_files(writer, args.retry_failed)
+        skipped = len(paths)
+        paths = [path for path in paths if path not in finished]
+        skipped -= len(paths)
+        if not args.quiet:
+            print(f"Skipping {skipped} files already in {args.output}", file=sys.stderr)
+    if not paths:
+        writer.close()
+        print("No files to process", file=sys.stderr)
+        return
+
+    # Imported late so --help and argument errors do not load the models
+    import app as backend
+
+    progress = Progress(len(paths), writer, args.quiet)
+    try:
+        run(args, backend, paths, fields, progress)
+    except KeyboardInterrupt:
+        with progress.lock:
+            writer.close()
+        print(f"Interrupted after {progress.done} files; run again with --resume to continue", file=sys.stderr)
+        # Pipeline threads are still waiting on the model
+        os._exit(130)
+    writer.close()
+
+    report = backend.usage_report(progress.usage)
+    elapsed = time.perf_counter() - progress.started
+    print(json.dumps({
+        'files': progress.done,
+        'failed': progress.failed,
+        'seconds': round(elapsed, 1),
+        'files_per_second': round(progress.done / elapsed, 2) if elapsed else None,
+        'tokens': report,
+        'output': args.output
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
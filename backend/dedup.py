@@ -0,0 +1,255 @@
+"""
+Duplicate and near-duplicate detection for uploaded invoices.
+
+Every file gets two fingerprints:
+
+- the SHA-256 of its bytes, which matches byte-identical copies;
+- a difference hash (dHash) of the image, which matches the same invoice
+  scanned twice or re-encoded, resized or lightly cropped or lit. The image
+  is shrunk to a (size + 1) x size grayscale thumbnail, and each bit tells
+  whether a pixel is brighter than its right neighbour. Copies of one
+  invoice differ in a few bits; the Hamming distance between two hashes
+  measures how alike the images are.
+
+Near matches are looked up in a BK-tree, which only visits the subtrees
+whose distance to the query can be within range, instead of comparing
+against every known hash.
+
+Exact matches across jobs can be shared between processes through a store
+(see storage.py), so they are found by every worker on the SQLite backend.
+Near matches are looked up in a BK-tree kept by each process, so they are
+only found among files queued by the same process.
+
+Invoices printed from one template look alike at thumbnail size: a changed
+amount or invoice number moves the hash about as much as re-encoding the
+same scan does. The hash is therefore 16 x 16 = 256 bits, and the web app
+only flags near copies unless told to reuse their results (DEDUP_NEAR).
+Byte-identical copies are always safe to reuse.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+HASH_SIZE = 16
+
+
+def file_digest(data):
+    """Return the SHA-256 hex digest of a file's bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def dhash(image_bytes, size=HASH_SIZE):
+    """
+    Compute the difference hash of an image
+
+    Args:
+        image_bytes (bytes): Raw image file
+        size (int): Hash side; the hash has size * size bits
+
+    Returns:
+        int: The hash, or None if the bytes are not a readable image
+    """
+    try:
+        image = Image.open(BytesIO(image_bytes))
+        # Let JPEG decode at a reduced scale; the thumbnail is tiny anyway
+        image.draft('L', (size * 8, size * 8))
+        image = ImageOps.exif_transpose(image).convert('L').resize((size + 1, size), Image.LANCZOS)
+    except Exception:
+        return None
+    pixels = image.tobytes()
+    value = 0
+    for row in range(size):
+        for column in range(size):
+            left = pixels[row * (size + 1) + column]
+            right = pixels[row * (size + 1) + column + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a, b):
+    """Number of differing bits of two hashes"""
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree of hashes under the Hamming distance"""
+
+    def __init__(self):
+        # Nodes are [hash, items, {distance: child}]
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        """Add an item under a hash; items with equal hashes share a node"""
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """
+        Find the items whose hash is within max_distance of a hash
+
+        Returns:
+            list: (distance, item) pairs, nearest first
+        """
+        found = []
+        pending = [self.root] if self.root is not None else []
+        while pending:
+            node = pending.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                found.extend((distance, item) for item in node[1])
+            # Triangle inequality: only these children can be in range
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    pending.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+
+class DuplicateIndex:
+    """
+    Fingerprints of recently extracted files, looked up by later jobs
+
+    Entries are grouped by scope (the schema fingerprint), so only results
+    extracted with the same fields are reused. The oldest entries beyond
+    max_entries, and entries older than ttl, are dropped.
+    """
+
+    def __init__(self, max_entries=10000, ttl=24 * 3600, digests=None):
+        """
+        Args:
+            max_entries (int): Entries kept in this process
+            ttl (float): Seconds an entry can be matched
+            digests: Optional store of "<scope>:<digest>" -> item, shared
+                with other processes for exact matches; it is bounded by
+                its own size and ttl
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.digests = digests
+        self._entries = OrderedDict()
+        self._trees = {}
+        self._lock = threading.Lock()
+
+    def add(self, scope, digest, image_hash, item):
+        """
+        Remember a file
+
+        Args:
+            scope (str): Group the file can be matched in
+            digest (str): SHA-256 of the file
+            image_hash (int): dHash of the file, or None
+            item: What lookups return for the file, e.g. (job_id, index)
+        """
+        if self.digests is not None:
+            self.digests[f"{scope}:{digest}"] = item
+        with self._lock:
+            key = (scope, digest)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (time.time(), image_hash, item)
+            if image_hash is not None:
+                self._trees.setdefault(scope, BKTree()).add(image_hash, (digest, item))
+            if len(self._entries) > self.max_entries:
+                self._prune()
+
+    def find(self, scope, digest, image_hash, max_distance):
+        """
+        Find earlier files matching a file
+
+        Returns:
+            list: (distance, item) pairs, nearest first; an exact byte match
+            comes first with distance 0
+        """
+        # Outside the lock: the shared store may be a SQLite file
+        shared = self.digests.get(f"{scope}:{digest}") if self.digests is not None else None
+        with self._lock:
+            matches = []
+            exact = self._fresh((scope, digest))
+            if exact is None:
+                exact = shared
+            if exact is not None:
+                matches.append((0, exact))
+            if image_hash is not None and scope in self._trees:
+                for distance, (other, item) in self._trees[scope].search(image_hash, max_distance):
+                    if other != digest and self._fresh((scope, other)) is not None:
+                        matches.append((distance, item))
+            return matches
+
+    def _fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            return None
+        return entry[2]
+
+    def _prune(self):
+        """Drop old entries and rebuild the trees, which cannot delete nodes"""
+        cutoff = time.time() - self.ttl
+        while self._entries and (
+            len(self._entries) > self.max_entries * 3 // 4 or next(iter(self._entries.values()))[0] < cutoff
+        ):
+            self._entries.popitem(last=False)
+        self._trees = {}
+        for (scope, digest), (_, image_hash, item) in self._entries.items():
+            if image_hash is not None:
+                self._trees.setdefault(scope, BKTree()).add(image_hash, (digest, item))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def cluster(fingerprints, max_distance):
+    """
+    Group the files of one job into duplicates
+
+    Each file is matched against the files before it: byte-identical copies
+    by digest, near copies by the BK-tree of their hashes.
+
+    Args:
+        fingerprints (list): (digest, image_hash) per file, or None for
+            files that take no part
+        max_distance (int): Largest Hamming distance of near copies
+
+    Returns:
+        list: For each file, (index of the earlier file it duplicates,
+        Hamming distance) or None; byte-identical copies have distance 0
+        and point at the first file with their bytes, which may itself be
+        a near copy
+    """
+    duplicate_of = [None] * len(fingerprints)
+    by_digest = {}
+    tree = BKTree()
+    for index, fingerprint in enumerate(fingerprints):
+        if fingerprint is None:
+            continue
+        digest, image_hash = fingerprint
+        if digest in by_digest:
+            duplicate_of[index] = (by_digest[digest], 0)
+            continue
+        matches = tree.search(image_hash, max_distance) if image_hash is not None else []
+        # Later byte-identical copies match this file, even if it is a near copy
+        by_digest[digest] = index
+        if matches:
+            duplicate_of[index] = (matches[0][1], matches[0][0])
+            continue
+        if image_hash is not None:
+            tree.add(image_hash, index)
+    return duplicate_of
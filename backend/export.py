@@ -0,0 +1,191 @@
+"""
+Incremental export of extraction results as CSV, NDJSON or Parquet.
+
+Each exporter is a generator that encodes a few hundred rows at a time and
+yields the encoded chunk, so a response can be streamed to the client
+without first materialising a DataFrame or the whole file in memory.
+Parquet export needs the optional pyarrow package.
+"""
+import csv
+import json
+from io import StringIO
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+CHUNK_ROWS = 500
+
+
+def result_columns(rows, leading=('filename',)):
+    """
+    Collect the union of row keys in first-seen order
+
+    Args:
+        rows (list): Result dicts
+        leading (tuple): Columns always placed first
+
+    Returns:
+        list: Column names
+    """
+    columns = dict.fromkeys(leading)
+    for row in rows:
+        columns.update(dict.fromkeys(row))
+    return list(columns)
+
+
+def csv_row(row):
+    """Encode list and dict cells (line items, List[str] fields) as JSON for CSV"""
+    return {
+        key: json.dumps(value, default=str) if isinstance(value, (list, dict)) else value
+        for key, value in row.items()
+    }
+
+
+def csv_chunks(rows, columns):
+    """Yield CSV text: the header, then CHUNK_ROWS rows per chunk"""
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    for count, row in enumerate(rows, 1):
+        writer.writerow(csv_row(row))
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(rows):
+    """Yield newline-delimited JSON, one object per row"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, default=str))
+        if len(lines) == CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back as chunks"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+ARROW_TYPES = {
+    'str': lambda: pa.string(),
+    'int': lambda: pa.int64(),
+    'float': lambda: pa.float64(),
+    'bool': lambda: pa.bool_(),
+    'List[str]': lambda: pa.list_(pa.string()),
+}
+
+
+def _coerce(value, field_type):
+    """Convert a cell to the column's declared type; unconvertible values become null"""
+    if value is None:
+        return None
+    try:
+        if field_type == 'int':
+            return int(value)
+        if field_type == 'float':
+            return float(value)
+        if field_type == 'bool':
+            return value if isinstance(value, bool) else str(value).strip().lower() in ('true', '1', 'yes')
+        if field_type == 'List[str]':
+            return [str(item) for item in value] if isinstance(value, list) else [str(value)]
+    except (TypeError, ValueError):
+        return None
+    return value if isinstance(value, str) else json.dumps(value, default=str)
+
+
+def parquet_chunks(rows, columns, field_types=None):
+    """
+    Yield a Parquet file, one row group per CHUNK_ROWS rows
+
+    Args:
+        rows (list): Result dicts
+        columns (list): Column names, see result_columns
+        field_types (dict): Declared schema type name per column; other
+            columns are written as strings
+
+    Raises:
+        RuntimeError: If pyarrow is not installed
+    """
+    schema, field_types = arrow_schema(columns, field_types)
+
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == CHUNK_ROWS:
+                writer.write_table(arrow_table(batch, schema, field_types))
+                batch = []
+                yield sink.drain()
+        if batch:
+            writer.write_table(arrow_table(batch, schema, field_types))
+    yield sink.drain()
+
+
+def arrow_schema(columns, field_types=None):
+    """
+    Build the Arrow schema of result columns
+
+    Args:
+        columns (list): Column names
+        field_types (dict): Declared schema type name per column; other
+            columns are strings
+
+    Returns:
+        tuple: (pyarrow schema, type name per column)
+
+    Raises:
+        RuntimeError: If pyarrow is not installed
+    """
+    if pa is None:
+        raise RuntimeError("Parquet export requires the pyarrow package")
+    field_types = {column: (field_types or {}).get(column, 'str') for column in columns}
+    field_types = {column: t if t in ARROW_TYPES else 'str' for column, t in field_types.items()}
+    return pa.schema([(column, ARROW_TYPES[field_types[column]]()) for column in columns]), field_types
+
+
+def arrow_table(batch, schema, field_types):
+    """Convert result dicts to an Arrow table, see arrow_schema"""
+    return pa.Table.from_pydict({
+        column: [_coerce(row.get(column), field_types[column]) for row in batch]
+        for column in schema.names
+    }, schema=schema)
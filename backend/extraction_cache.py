@@ -0,0 +1,148 @@
+"""
+Persistent cache for model outputs, stored in SQLite.
+
+Entries are keyed by content: the SHA-256 of the image bytes plus the model
+name and prompt for descriptions, and additionally the schema fingerprint for
+structured results. Re-running the same invoice therefore never reaches the
+model again until the entry expires or is evicted.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def fingerprint(*parts):
+    """
+    Hash any mix of bytes and strings into a hex digest
+
+    Args:
+        *parts: bytes or str values, hashed in order
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        # Length prefix so ("ab", "c") and ("a", "bc") hash differently
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """SQLite-backed key/value cache with TTL and LRU size eviction"""
+
+    def __init__(self, path, max_entries=10000, ttl=7 * 24 * 3600):
+        """
+        Args:
+            path (str): SQLite database file, created if missing
+            max_entries (int): Least recently used entries beyond this are evicted
+            ttl (float): Seconds an entry stays valid after it was written
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = {}
+        self.misses = {}
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        self._conn.commit()
+
+    def get(self, kind, key):
+        """
+        Look up a cached value
+
+        Args:
+            kind (str): Entry type, e.g. 'description' or 'result'
+            key (str): Content key from fingerprint()
+
+        Returns:
+            The cached JSON value, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM entries WHERE key = ?", (f"{kind}:{key}",)
+            ).fetchone()
+            if row and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (f"{kind}:{key}",))
+                self._conn.commit()
+                self.expirations += 1
+                row = None
+            if row is None:
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+                return None
+            self._conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?", (now, f"{kind}:{key}")
+            )
+            self._conn.commit()
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+        return json.loads(row[0])
+
+    def set(self, kind, key, value):
+        """Store a JSON-serialisable value and evict entries over the size limit"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, kind, value, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (f"{kind}:{key}", kind, json.dumps(value), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        """Drop expired entries, then the least recently used ones over max_entries"""
+        expired = self._conn.execute(
+            "DELETE FROM entries WHERE created_at < ?", (now - self.ttl,)
+        ).rowcount
+        self.expirations += expired
+        count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count > self.max_entries:
+            self.evictions += self._conn.execute(
+                "DELETE FROM entries WHERE key IN "
+                "(SELECT key FROM entries ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,)
+            ).rowcount
+
+    def clear(self):
+        """Remove every entry and reset the counters"""
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self.hits, self.misses = {}, {}
+            self.evictions = self.expirations = 0
+
+    def stats(self):
+        """Return entry counts and hit/miss/eviction counters"""
+        with self._lock:
+            rows = self._conn.execute("SELECT kind, COUNT(*) FROM entries GROUP BY kind").fetchall()
+            return {
+                'entries': dict(rows),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': dict(self.hits),
+                'misses': dict(self.misses),
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
@@ -0,0 +1,237 @@
+"""
+Local stand-in for ChatGoogleGenerativeAI.
+
+Start the app with MODEL=fake to run the chat and extraction endpoints
+without calling Gemini, e.g. to load test process_images. Every call sleeps
+for FAKE_MODEL_LATENCY seconds to simulate the provider round-trip.
+
+Provider throttling can be simulated as well: FAKE_MODEL_THROTTLE is a
+pattern cycled over successive calls, where 'x' rejects the call with a 429
+and any other character lets it through (e.g. "..x" throttles every third
+call), and FAKE_MODEL_QUOTA_RPM rejects calls beyond that many in any
+60-second window.
+
+For benchmarks, FAKE_MODEL_ERROR_RATE fails that fraction of calls with a
+non-retryable error (deterministically: exactly one in every 1/rate calls)
+and FAKE_MODEL_RESPONSE_SIZE pads transcriptions to that many characters.
+call_counts() reports the calls made so far. Responses carry usage
+metadata estimated from the prompt and response sizes.
+
+Async calls (ainvoke) wait with asyncio.sleep, so the async serving mode
+can keep many simulated calls in flight on one event loop.
+"""
+import asyncio
+import threading
+import time
+import typing
+from collections import deque
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+from pydantic import BaseModel, PrivateAttr
+
+FAKE_DESCRIPTION = (
+    "INVOICE\n"
+    "Invoice Number: INV-0001\n"
+    "Invoice Date: 01/01/2024\n"
+    "Due Date: 31/01/2024\n"
+    "Bill To: Example Client Ltd.\n"
+    "From: Example Vendor Pvt. Ltd., 12 Market Road\n"
+    "Item 1 x 100.00\n"
+    "Tax: 18.00\n"
+    "Total: 118.00"
+)
+
+
+def fake_value(annotation):
+    """Return a placeholder value that validates against a field annotation"""
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        return fake_value(args[0]) if args else None
+    if origin in (list, List):
+        return []
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return fake_record(annotation)
+    if annotation is int:
+        return 0
+    if annotation is float:
+        return 0.0
+    if annotation is bool:
+        return False
+    return "N/A"
+
+
+def fake_record(schema, images=1):
+    """
+    Build an instance of a Pydantic model filled with placeholder values
+
+    A list of nested records gets one entry per input image, numbered
+    through `image_index` when the record has that field, so batched
+    extraction requests can be mapped back to their files.
+    """
+    values = {}
+    for name, field in schema.model_fields.items():
+        item_type = typing.get_args(field.annotation)[0] if typing.get_origin(field.annotation) in (list, List) else None
+        if isinstance(item_type, type) and issubclass(item_type, BaseModel):
+            records = [fake_record(item_type) for _ in range(images)]
+            if 'image_index' in item_type.model_fields:
+                for index, record in enumerate(records, start=1):
+                    record.image_index = index
+            values[name] = records
+        else:
+            values[name] = fake_value(field.annotation)
+    return schema(**values)
+
+
+# Roughly what Gemini bills for one downscaled invoice image
+FAKE_IMAGE_TOKENS = 1032
+
+
+def fake_usage(model_input, output_text):
+    """Estimate usage metadata: four characters per token, plus a flat cost per image"""
+    text = model_input if isinstance(model_input, str) else "".join(
+        part if isinstance(part, str) else str(part.get('text', ''))
+        for message in (model_input if isinstance(model_input, list) else [model_input])
+        for part in (message.content if isinstance(message.content, list) else [message.content])
+    )
+    input_tokens = len(text) // 4 + count_images(model_input) * FAKE_IMAGE_TOKENS
+    output_tokens = max(1, len(output_text) // 4)
+    return {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'total_tokens': input_tokens + output_tokens}
+
+
+def count_images(model_input):
+    """Count image parts in a prompt passed to invoke"""
+    if not isinstance(model_input, list):
+        return 0
+    return sum(
+        1
+        for message in model_input
+        if isinstance(getattr(message, 'content', None), list)
+        for part in message.content
+        if isinstance(part, dict) and part.get('type') == 'image_url'
+    )
+
+
+def padded_description(size):
+    """Return FAKE_DESCRIPTION with extra line items up to `size` characters"""
+    lines = FAKE_DESCRIPTION.split("\n")
+    text = "\n".join(lines)
+    item = 2
+    while len(text) < size:
+        lines.insert(-2, f"Item {item} x {item * 10:.2f}")
+        text = "\n".join(lines)
+        item += 1
+    return text
+
+
+class FakeModelError(Exception):
+    """Raised by FakeVisionModel for scheduled failures that should not be retried"""
+
+
+class FakeRateLimitError(Exception):
+    """Raised by FakeVisionModel in place of the provider's 429 ResourceExhausted"""
+
+    code = 429
+
+
+class FakeVisionModel(BaseChatModel):
+    """Chat model that waits `latency` seconds and returns canned output"""
+
+    latency: float = 0.0
+    response_text: str = FAKE_DESCRIPTION
+    throttle_pattern: str = ""
+    quota_per_minute: int = 0
+    error_rate: float = 0.0
+
+    _calls: int = PrivateAttr(default=0)
+    _counts: dict = PrivateAttr(default_factory=dict)
+    _accepted: deque = PrivateAttr(default_factory=deque)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def call_counts(self):
+        """Return the number of calls per kind ('generate', 'structured') and per outcome"""
+        with self._lock:
+            return dict(self._counts)
+
+    def _count(self, key):
+        self._counts[key] = self._counts.get(key, 0) + 1
+
+    def _check_quota(self, kind):
+        """Count a call and raise if the throttle schedule, quota or error rate rejects it"""
+        with self._lock:
+            call = self._calls
+            self._calls += 1
+            self._count(kind)
+            if self.error_rate and int((call + 1) * self.error_rate) > int(call * self.error_rate):
+                self._count('errors')
+                raise FakeModelError(f"Scheduled model failure (call {call + 1})")
+            if self.throttle_pattern and self.throttle_pattern[call % len(self.throttle_pattern)] == 'x':
+                self._count('throttled')
+                raise FakeRateLimitError(f"429 Resource exhausted (scheduled, call {call + 1})")
+            if self.quota_per_minute:
+                now = time.monotonic()
+                while self._accepted and now - self._accepted[0] >= 60:
+                    self._accepted.popleft()
+                if len(self._accepted) >= self.quota_per_minute:
+                    self._count('throttled')
+                    raise FakeRateLimitError(f"429 Resource exhausted (quota of {self.quota_per_minute} requests per minute)")
+                self._accepted.append(now)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-vision"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self._check_quota('generate')
+        time.sleep(self.latency)
+        return self._result(messages)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self._check_quota('generate')
+        await asyncio.sleep(self.latency)
+        return self._result(messages)
+
+    def _result(self, messages):
+        message = AIMessage(
+            content=self.response_text,
+            usage_metadata=fake_usage(messages, self.response_text),
+            response_metadata={'model_name': self._llm_type}
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def with_structured_output(self, schema, include_raw=False, **kwargs):
+        """Return a runnable that yields a placeholder `schema` instance"""
+        def _output(model_input):
+            record = fake_record(schema, images=max(1, count_images(model_input)))
+            if not include_raw:
+                return record
+            raw = AIMessage(content="", usage_metadata=fake_usage(model_input, record.model_dump_json()))
+            return {'raw': raw, 'parsed': record, 'parsing_error': None}
+
+        def _invoke(model_input):
+            self._check_quota('structured')
+            time.sleep(self.latency)
+            return _output(model_input)
+
+        async def _ainvoke(model_input):
+            self._check_quota('structured')
+            await asyncio.sleep(self.latency)
+            return _output(model_input)
+
+        return RunnableLambda(_invoke, afunc=_ainvoke)
@@ -0,0 +1,129 @@
+"""
+Shrink invoice images before they are base64-encoded for the model.
+
+Large scans are downscaled to a maximum dimension, rotated according to
+their EXIF orientation, optionally converted to grayscale and recompressed
+as JPEG or WebP. Smaller payloads upload faster and cost fewer image tokens.
+"""
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'GIF': 'image/gif',
+    'BMP': 'image/bmp',
+    'TIFF': 'image/tiff',
+    'HEIF': 'image/heif',
+}
+
+OUTPUT_FORMATS = ('JPEG', 'WEBP')
+
+EXIF_ORIENTATION = 0x0112
+
+
+def detect_mime_type(image_bytes, default='image/jpeg'):
+    """
+    Detect the MIME type of an image from its content
+
+    Args:
+        image_bytes (bytes): Raw image file
+        default (str): Returned when the format is not recognised
+
+    Returns:
+        str: MIME type such as 'image/png'
+    """
+    try:
+        image_format = Image.open(BytesIO(image_bytes)).format
+    except Exception:
+        return default
+    return MIME_TYPES.get(image_format, default)
+
+
+def scaled_size(width, height, max_dimension):
+    """Return the size an image gets after being fit into max_dimension"""
+    if not max_dimension or max(width, height) <= max_dimension:
+        return width, height
+    scale = max_dimension / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def preprocess_image(image_bytes, max_dimension=2048, quality=85, output_format='JPEG', grayscale=False):
+    """
+    Prepare an image for a vision model request
+
+    Args:
+        image_bytes (bytes): Raw uploaded image
+        max_dimension (int): Longest side in pixels after resizing, 0 to keep size
+        quality (int): JPEG/WebP quality used when recompressing
+        output_format (str): 'JPEG' or 'WEBP'
+        grayscale (bool): Convert to a single luminance channel
+
+    Returns:
+        dict: 'data' (bytes), 'mime_type', 'bytes_in', 'bytes_out',
+        'width' and 'height'. Files Pillow cannot decode, or whose
+        recompressed form would be larger and otherwise unchanged, are
+        returned as-is.
+    """
+    output_format = output_format.upper()
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format {output_format}, expected one of {', '.join(OUTPUT_FORMATS)}")
+
+    original = {
+        'data': image_bytes,
+        'mime_type': detect_mime_type(image_bytes),
+        'bytes_in': len(image_bytes),
+        'bytes_out': len(image_bytes),
+        'width': None,
+        'height': None,
+    }
+    try:
+        image = Image.open(BytesIO(image_bytes))
+        source_format = image.format
+        original['width'], original['height'] = image.size
+        changed = False
+
+        target_size = scaled_size(image.width, image.height, max_dimension)
+        if target_size != image.size:
+            # Lets the JPEG decoder downscale while decoding; no-op for other formats
+            image.draft(None, target_size)
+
+        # Rotate phone photos to their upright orientation
+        if image.getexif().get(EXIF_ORIENTATION, 1) != 1:
+            image = ImageOps.exif_transpose(image)
+            changed = True
+
+        target_size = scaled_size(image.width, image.height, max_dimension)
+        if target_size != image.size:
+            image = image.resize(target_size, Image.LANCZOS)
+        if (image.width, image.height) != (original['width'], original['height']):
+            changed = True
+
+        if grayscale and image.mode != 'L':
+            image = image.convert('L')
+            changed = True
+        elif image.mode not in ('RGB', 'L'):
+            # JPEG has no alpha channel, so flatten transparency onto white
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.split()[-1])
+
+        buffer = BytesIO()
+        image.save(buffer, format=output_format, quality=quality, optimize=True)
+        data = buffer.getvalue()
+    except Exception:
+        return original
+
+    if not changed and len(data) >= len(image_bytes) and source_format in ('JPEG', 'PNG', 'WEBP'):
+        return original
+
+    return {
+        'data': data,
+        'mime_type': MIME_TYPES[output_format],
+        'bytes_in': len(image_bytes),
+        'bytes_out': len(data),
+        'width': image.width,
+        'height': image.height,
+    }
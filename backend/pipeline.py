@@ -0,0 +1,153 @@
+"""
+Staged processing with bounded queues between the stages.
+
+Each item flows through a list of Stages, each with its own worker threads,
+so different stages work on different items at the same time: while one
+file waits on a model call, the next one is already being decoded and
+encoded. Bounded queues between the stages limit how many items are held
+in memory between stages, and per-stage timings show which stage is the
+bottleneck.
+"""
+import queue
+import threading
+import time
+
+# Marks the end of the input on a stage's queue
+DONE = object()
+
+
+class Stage:
+    """One step of a pipeline"""
+
+    def __init__(self, name, function, workers=1, submit=None):
+        """
+        Args:
+            name (str): Stage name, used in timings
+            function (callable): Called with the item's state dict; updates it
+                in place. Setting state['result'] skips the remaining stages.
+            workers (int): Threads running this stage
+            submit (callable): Optional; runs the call elsewhere, taking a
+                zero-argument callable and returning a Future
+        """
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.submit = submit
+
+
+class StageTimings:
+    """Thread-safe per-stage counters"""
+
+    def __init__(self, stages):
+        self._lock = threading.Lock()
+        self.stages = {
+            stage.name: {'items': 0, 'busy_seconds': 0.0, 'max_seconds': 0.0, 'wait_seconds': 0.0}
+            for stage in stages
+        }
+
+    def record(self, name, busy, wait):
+        with self._lock:
+            timing = self.stages[name]
+            timing['items'] += 1
+            timing['busy_seconds'] += busy
+            timing['max_seconds'] = max(timing['max_seconds'], busy)
+            timing['wait_seconds'] += wait
+
+    def report(self):
+        """Return rounded totals and means for every stage"""
+        with self._lock:
+            return {
+                name: {
+                    'items': timing['items'],
+                    'busy_seconds': round(timing['busy_seconds'], 3),
+                    'mean_seconds': round(timing['busy_seconds'] / timing['items'], 3) if timing['items'] else 0.0,
+                    'max_seconds': round(timing['max_seconds'], 3),
+                    'wait_seconds': round(timing['wait_seconds'], 3)
+                }
+                for name, timing in self.stages.items()
+            }
+
+
+def run_pipeline(states, stages, queue_size=4, on_done=None):
+    """
+    Push every state through the stages and wait for all of them
+
+    Args:
+        states (list): One dict per item; each gets a 'timings' dict with
+            the seconds it spent in every stage it ran
+        stages (list): Stage objects, in order
+        queue_size (int): Capacity of each queue between two stages
+        on_done (callable): Called with each state as soon as it leaves the
+            last stage, from a pipeline thread
+
+    Returns:
+        dict: Per-stage timings, see StageTimings.report. States whose stage
+        raised carry the exception in state['exception'].
+    """
+    timings = StageTimings(stages)
+    if not states:
+        return timings.report()
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages] + [queue.Queue()]
+    remaining = [stage.workers for stage in stages]
+    lock = threading.Lock()
+
+    def work(position, stage):
+        inbox, outbox = queues[position], queues[position + 1]
+        while True:
+            entry = inbox.get()
+            if entry is DONE:
+                break
+            state, queued_at = entry
+            if 'result' not in state and 'exception' not in state:
+                started = time.perf_counter()
+                wait = started - queued_at
+                try:
+                    if stage.submit:
+                        # Time the call itself, not its wait for a scheduler slot
+                        def call(state=state):
+                            call_started = time.perf_counter()
+                            stage.function(state)
+                            return time.perf_counter() - call_started
+                        busy = stage.submit(call).result()
+                        wait += time.perf_counter() - started - busy
+                    else:
+                        stage.function(state)
+                        busy = time.perf_counter() - started
+                except Exception as e:
+                    state['exception'] = e
+                    busy = time.perf_counter() - started
+                state['timings'][stage.name] = round(busy, 3)
+                timings.record(stage.name, busy, wait)
+            outbox.put((state, time.perf_counter()))
+        # The last worker of a stage closes the next stage's input
+        with lock:
+            remaining[position] -= 1
+            last = remaining[position] == 0
+        if last and position + 1 < len(stages):
+            for _ in range(stages[position + 1].workers):
+                queues[position + 1].put(DONE)
+
+    threads = [
+        threading.Thread(target=work, args=(position, stage), name=f"pipeline-{stage.name}", daemon=True)
+        for position, stage in enumerate(stages)
+        for _ in range(stage.workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    def feed():
+        # Blocks while the first stage's queue is full
+        for state in states:
+            state.setdefault('timings', {})
+            queues[0].put((state, time.perf_counter()))
+        for _ in range(stages[0].workers):
+            queues[0].put(DONE)
+
+    threading.Thread(target=feed, name="pipeline-feed", daemon=True).start()
+
+    for _ in states:
+        state, _ = queues[-1].get()
+        if on_done:
+            on_done(state)
+    return timings.report()
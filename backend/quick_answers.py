@@ -0,0 +1,187 @@
+"""
+Answers to simple chat questions without a model round-trip.
+
+When an invoice is uploaded for chat, the call that suggests questions
+also extracts an InvoiceFacts record and answers its own suggested
+questions. An AnswerBook per session keeps both. A question can then be
+answered in one of two ways:
+
+- field lookups: "What's the invoice number?" or "total amount?" are
+  answered from the record when the question, without filler words, names
+  exactly one field;
+- the answer cache: the suggested questions, answered from the invoice
+  alone, are matched by their normalized text.
+
+Anything else falls through to the conversation chain. Model answers are
+not cached: they may depend on the conversation ("why?", "tell me more"),
+so the same words can need a different answer later.
+"""
+import re
+import threading
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class InvoiceFacts(BaseModel):
+    """Header fields of an invoice, as printed on it"""
+    invoice_number: Optional[str] = Field(None, description="Invoice number or ID")
+    invoice_date: Optional[str] = Field(None, description="Date the invoice was issued")
+    due_date: Optional[str] = Field(None, description="Payment due date")
+    vendor_name: Optional[str] = Field(None, description="Name of the seller issuing the invoice")
+    customer_name: Optional[str] = Field(None, description="Name of the customer the invoice is billed to")
+    subtotal: Optional[str] = Field(None, description="Amount before tax, with its currency as printed")
+    tax_amount: Optional[str] = Field(None, description="Total tax, with its currency as printed")
+    total_amount: Optional[str] = Field(None, description="Total amount due, with its currency as printed")
+    currency: Optional[str] = Field(None, description="Currency of the amounts")
+
+
+class AnsweredQuestion(BaseModel):
+    question: str = Field(None, description="Generate simple and useful suggestion questions based on the given content. The questions should be directly answerable using the information within the content.")
+    answer: str = Field(None, description="Short plain-text answer to the question, taken from the content")
+
+
+class ChatPreparation(BaseModel):
+    questions: List[AnsweredQuestion]
+    facts: InvoiceFacts = Field(description="Header fields of the invoice described in the content")
+
+
+# Field -> phrases that ask for it, once filler words are removed
+FIELD_PHRASES = {
+    'invoice_number': ['number', 'invoice number', 'reference', 'bill number'],
+    'invoice_date': ['date', 'invoice date', 'issue date', 'issued', 'dated', 'bill date'],
+    'due_date': ['due date', 'due', 'payment due', 'due by', 'payment due date'],
+    'vendor_name': ['vendor', 'seller', 'supplier', 'issued by', 'vendor name', 'seller name', 'supplier name', 'company'],
+    'customer_name': ['customer', 'client', 'buyer', 'billed to', 'bill to', 'customer name', 'client name'],
+    'subtotal': ['subtotal', 'sub total', 'amount before tax', 'net amount'],
+    'tax_amount': ['tax', 'tax amount', 'vat', 'gst', 'total tax', 'sales tax'],
+    'total_amount': ['total', 'total amount', 'amount', 'amount due', 'grand total', 'total due', 'much', 'balance due'],
+    'currency': ['currency'],
+}
+
+# Phrases of "who ..." questions, which ask for a party: "who issued it?"
+# wants the vendor, while "when was it issued?" wants the invoice date
+WHO_PHRASES = {
+    'vendor_name': ['issued', 'issuer', 'sent', 'from', 'wrote'],
+    'customer_name': ['billed', 'pays', 'paying', 'receiver', 'recipient'],
+}
+
+# "invoice no" and "invoice id" without filler would be a bare "no" or "id"
+NUMBER_ABBREVIATIONS = re.compile(r"\b(invoice|bill) (no|id)\b")
+
+FIELD_LABELS = {
+    'invoice_number': "The invoice number",
+    'invoice_date': "The invoice date",
+    'due_date': "The due date",
+    'vendor_name': "The vendor",
+    'customer_name': "The customer",
+    'subtotal': "The subtotal",
+    'tax_amount': "The tax amount",
+    'total_amount': "The total amount",
+    'currency': "The currency",
+}
+
+FILLER_WORDS = {
+    'a', 'an', 'the', 'what', 'whats', 'which', 'who', 'whos', 'when', 'how', 'is', 'are', 'was', 'does',
+    'do', 's', 'of', 'on', 'in', 'for', 'this', 'that', 'my', 'me', 'please', 'tell', 'give', 'show', 'can',
+    'you', 'it', 'its', 'i', 'we', 'have', 'need', 'our', 'your', 'invoice', 'bill', 'document', 'mentioned',
+    'listed', 'stated', 'shown', 'to', 'pay'
+}
+
+# Placeholders models return for fields they could not read
+MISSING_VALUES = {'', 'n/a', 'na', 'none', 'null', 'unknown', 'not available', 'not specified', 'not mentioned'}
+
+
+def normalize_question(question):
+    """Lower-case, drop punctuation and collapse whitespace"""
+    return " ".join(re.sub(r"[^\w\s#]", "", question.lower().replace("'", "")).split())
+
+
+def content_words(text):
+    """The words of a normalized phrase that are not filler"""
+    return frozenset(word.strip('#') or 'number' for word in text.split()) - FILLER_WORDS
+
+
+def phrase_fields(phrases):
+    """Map the content words of every phrase to its field"""
+    return {content_words(phrase): field for field, items in phrases.items() for phrase in items}
+
+
+PHRASE_FIELDS = phrase_fields(FIELD_PHRASES)
+WHO_PHRASE_FIELDS = phrase_fields(WHO_PHRASES)
+
+
+def lookup_field(question):
+    """Return the field a question asks for, or None if it asks anything else"""
+    normalized = NUMBER_ABBREVIATIONS.sub(r"\1 number", normalize_question(question))
+    words = content_words(normalized)
+    if not words:
+        return None
+    if normalized.split()[0] in ('who', 'whos'):
+        field = WHO_PHRASE_FIELDS.get(words) or PHRASE_FIELDS.get(words)
+        return field if field in WHO_PHRASES else None
+    return PHRASE_FIELDS.get(words)
+
+
+def known(value):
+    return value is not None and str(value).strip().lower() not in MISSING_VALUES
+
+
+class AnswerBook:
+    """Extracted invoice facts and cached answers of one chat session"""
+
+    def __init__(self, max_answers=200):
+        self.facts = {}
+        self.answers = {}
+        self.max_answers = max_answers
+        self._lock = threading.Lock()
+
+    def set_facts(self, facts, answered_questions=()):
+        """
+        Replace the facts and the cached answers with those of a new invoice
+
+        Args:
+            facts (dict): InvoiceFacts fields
+            answered_questions (iterable): (question, answer) pairs to precompute
+        """
+        with self._lock:
+            self.facts = {name: str(value).strip() for name, value in facts.items() if known(value)}
+            self.answers = {}
+        for question, answer in answered_questions:
+            self.remember(question, answer)
+
+    def remember(self, question, answer):
+        """Cache an answer under its normalized question"""
+        if not question or not known(answer):
+            return
+        with self._lock:
+            if len(self.answers) >= self.max_answers:
+                self.answers.pop(next(iter(self.answers)))
+            self.answers[normalize_question(question)] = answer
+
+    def __getstate__(self):
+        # Pickled into the session store without its lock
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def answer(self, question):
+        """
+        Answer a question without the model
+
+        Returns:
+            tuple: (answer, source) with source 'facts' or 'cache', or
+            (None, None) when the question needs the model
+        """
+        with self._lock:
+            field = lookup_field(question)
+            if field and field in self.facts:
+                return f"{FIELD_LABELS[field]} is {self.facts[field]}.", 'facts'
+            cached = self.answers.get(normalize_question(question))
+            if cached is not None:
+                return cached, 'cache'
+        return None, None
@@ -0,0 +1,418 @@
+"""
+Client-side quota management for the vision model.
+
+One RateLimiter is shared by every request the app makes to the provider:
+
+- token buckets keep requests per minute and tokens per minute under the
+  configured quota, so bursts from several jobs are smoothed out instead of
+  being rejected with 429s;
+- an AIMD concurrency limit allows one more request in flight for every
+  window of successful calls and halves it when the provider throttles;
+- throttled calls are retried with full-jitter exponential backoff.
+
+RateLimitedModel wraps a chat model (or a structured-output runnable) so
+every invoke goes through the limiter. Async calls (ainvoke) share the same
+buckets and concurrency limit, waiting on futures and asyncio.sleep instead
+of blocking the event loop.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable
+
+THROTTLE_MARKERS = ('429', 'resource exhausted', 'resource_exhausted', 'rate limit', 'quota')
+
+
+def is_throttle_error(error):
+    """
+    Tell whether an exception means the provider rejected the call for quota
+
+    Recognises google.api_core ResourceExhausted / TooManyRequests, any
+    exception with a 429 status code, and errors whose message mentions
+    rate limits or quota.
+    """
+    if type(error).__name__ in ('ResourceExhausted', 'TooManyRequests', 'RateLimitError'):
+        return True
+    for attribute in ('code', 'status_code'):
+        try:
+            if int(getattr(error, attribute, 0) or 0) == 429:
+                return True
+        except (TypeError, ValueError):
+            pass
+    message = str(error).lower()
+    return any(marker in message for marker in THROTTLE_MARKERS)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `per_minute` / 60 per second"""
+
+    def __init__(self, per_minute, burst_seconds=1.0):
+        """
+        Args:
+            per_minute (float): Refill rate, 0 disables the bucket
+            burst_seconds (float): Capacity in seconds of refill; a small burst
+                keeps any 60-second window close to the per-minute quota
+        """
+        self.per_minute = per_minute
+        self.capacity = max(1.0, per_minute * burst_seconds / 60)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.per_minute / 60)
+        self.updated_at = now
+
+    def acquire(self, amount=1):
+        """
+        Block until the bucket can cover `amount` tokens and take them
+
+        Requests larger than the bucket wait for a full bucket and leave it
+        in debt, which later requests wait out.
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        if not self.per_minute:
+            return 0.0
+        waited = 0.0
+        while True:
+            delay = self._take(amount)
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    async def acquire_async(self, amount=1):
+        """Like acquire, but waits without blocking the event loop"""
+        if not self.per_minute:
+            return 0.0
+        waited = 0.0
+        while True:
+            delay = self._take(amount)
+            if not delay:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def _take(self, amount):
+        """Take `amount` tokens if the bucket covers them; otherwise return the seconds to wait"""
+        needed = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self.tokens >= needed:
+                self.tokens -= amount
+                return 0.0
+            return min(1.0, (needed - self.tokens) * 60 / self.per_minute)
+
+    def adjust(self, amount):
+        """Give back (positive) or take extra (negative) tokens once actual usage is known"""
+        if not self.per_minute:
+            return
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit with additive increase and multiplicative decrease"""
+
+    def __init__(self, initial, minimum=1, maximum=16, decrease_factor=0.5, cooldown=1.0):
+        """
+        Args:
+            initial (int): Starting limit
+            minimum (int): Lowest limit after repeated throttling
+            maximum (int): Highest limit reached through successful calls
+            decrease_factor (float): Limit multiplier applied on throttling
+            cooldown (float): Seconds during which further throttles from the
+                same burst do not shrink the limit again
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.decreased_at = 0.0
+        self._condition = threading.Condition()
+        # Futures of coroutines waiting for a slot, oldest first. Slots are
+        # freed by threads as well as coroutines, so waiters are woken through
+        # their loop's call_soon_threadsafe rather than an asyncio.Condition
+        self._async_waiters = deque()
+
+    def acquire(self):
+        """Block until a slot is free; returns the seconds spent waiting"""
+        started = time.monotonic()
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        return time.monotonic() - started
+
+    async def acquire_async(self):
+        """Like acquire, but waits for a free slot without blocking the event loop"""
+        started = time.monotonic()
+        with self._condition:
+            if self.in_flight < int(self.limit) and not self._async_waiters:
+                self.in_flight += 1
+                return 0.0
+            waiter = asyncio.get_running_loop().create_future()
+            self._async_waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._condition:
+                if waiter in self._async_waiters:
+                    self._async_waiters.remove(waiter)
+                else:
+                    # The slot was handed over as the wait was cancelled
+                    self.in_flight -= 1
+                    self._wake()
+            raise
+        return time.monotonic() - started
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._wake()
+
+    def on_success(self):
+        """Grow the limit by one slot per `limit` successful calls"""
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._wake()
+
+    def _wake(self):
+        """Hand free slots to waiting coroutines, oldest first, then to a waiting thread; needs the lock"""
+        while self._async_waiters and self.in_flight < int(self.limit):
+            waiter = self._async_waiters.popleft()
+            try:
+                waiter.get_loop().call_soon_threadsafe(_grant, waiter)
+            except RuntimeError:
+                # Its event loop is closed; nobody is waiting any more
+                continue
+            self.in_flight += 1
+        self._condition.notify()
+
+    def on_throttle(self):
+        """Shrink the limit, once per cooldown period"""
+        with self._condition:
+            now = time.monotonic()
+            if now - self.decreased_at >= self.cooldown:
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                self.decreased_at = now
+
+
+def _grant(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class RateLimiter:
+    """Shared quota, concurrency and retry policy for model calls"""
+
+    def __init__(
+        self,
+        requests_per_minute=0,
+        tokens_per_minute=0,
+        max_concurrency=16,
+        min_concurrency=1,
+        max_retries=5,
+        backoff_base=1.0,
+        backoff_max=60.0,
+        image_tokens=1290,
+        output_tokens=256,
+        burst_seconds=1.0,
+    ):
+        """
+        Args:
+            requests_per_minute (float): Request quota, 0 for unlimited
+            tokens_per_minute (float): Token quota, 0 for unlimited
+            max_concurrency (int): Starting and highest number of calls in flight
+            min_concurrency (int): Lowest number of calls in flight
+            max_retries (int): Retries of a throttled call before giving up
+            backoff_base (float): First retry delay ceiling in seconds
+            backoff_max (float): Largest retry delay ceiling in seconds
+            image_tokens (int): Estimated prompt tokens per image
+            output_tokens (int): Estimated completion tokens per call
+            burst_seconds (float): Quota that may be spent at once, in seconds of refill
+        """
+        self.requests = TokenBucket(requests_per_minute, burst_seconds)
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds)
+        self.concurrency = AdaptiveConcurrency(max_concurrency, min_concurrency, max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.image_tokens = image_tokens
+        self.output_tokens = output_tokens
+        self.calls = self.retries = self.throttled = self.failures = 0
+        self.waited_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _count(self, **changes):
+        with self._lock:
+            for name, amount in changes.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def estimate_tokens(self, model_input):
+        """
+        Estimate the tokens a call will use before it is made
+
+        Text is counted at about four characters per token; every image part
+        counts as `image_tokens`.
+        """
+        characters, images = 0, 0
+        messages = model_input if isinstance(model_input, list) else [model_input]
+        for message in messages:
+            content = getattr(message, 'content', message)
+            parts = content if isinstance(content, list) else [content]
+            for part in parts:
+                if isinstance(part, dict) and part.get('type') == 'image_url':
+                    images += 1
+                elif isinstance(part, dict):
+                    characters += len(str(part.get('text', '')))
+                else:
+                    characters += len(str(part))
+        return characters // 4 + images * self.image_tokens + self.output_tokens
+
+    def backoff(self, attempt, error=None):
+        """Full-jitter delay before retry `attempt` (0-based)"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        # Respect a server-provided retry hint when there is one
+        return max(delay, float(getattr(error, 'retry_after', 0) or 0))
+
+    def call(self, function, estimated_tokens=0):
+        """
+        Run a model call under the quota, retrying when it is throttled
+
+        Args:
+            function (callable): Makes the call and returns its result
+            estimated_tokens (int): Tokens to reserve, see estimate_tokens
+
+        Returns:
+            The call's result
+
+        Raises:
+            The last throttling error once max_retries is exhausted, or any
+            other error from the call immediately
+        """
+        for attempt in range(self.max_retries + 1):
+            waited = self.concurrency.acquire()
+            try:
+                waited += self.requests.acquire(1)
+                waited += self.tokens.acquire(estimated_tokens)
+                self._count(calls=1, waited_seconds=waited)
+                result = function()
+            except Exception as e:
+                self._on_error(e, attempt)
+                error = e
+            else:
+                return self._on_success(result, estimated_tokens)
+            finally:
+                self.concurrency.release()
+
+            self._count(retries=1)
+            time.sleep(self.backoff(attempt, error))
+
+    async def acall(self, function, estimated_tokens=0):
+        """
+        Async version of call
+
+        Args:
+            function (callable): Returns an awaitable that makes the call
+            estimated_tokens (int): Tokens to reserve, see estimate_tokens
+        """
+        for attempt in range(self.max_retries + 1):
+            waited = await self.concurrency.acquire_async()
+            try:
+                waited += await self.requests.acquire_async(1)
+                waited += await self.tokens.acquire_async(estimated_tokens)
+                self._count(calls=1, waited_seconds=waited)
+                result = await function()
+            except Exception as e:
+                self._on_error(e, attempt)
+                error = e
+            else:
+                return self._on_success(result, estimated_tokens)
+            finally:
+                self.concurrency.release()
+
+            self._count(retries=1)
+            await asyncio.sleep(self.backoff(attempt, error))
+
+    def _on_error(self, error, attempt):
+        """Count a failed call; re-raise it unless it was throttled and may be retried"""
+        if not is_throttle_error(error):
+            self._count(failures=1)
+            raise error
+        self._count(throttled=1)
+        self.concurrency.on_throttle()
+        if attempt == self.max_retries:
+            self._count(failures=1)
+            raise error
+
+    def _on_success(self, result, estimated_tokens):
+        """Grow the concurrency limit and settle the token reservation"""
+        self.concurrency.on_success()
+        used = usage_tokens(result)
+        if used is not None:
+            self.tokens.adjust(estimated_tokens - used)
+        return result
+
+    def stats(self):
+        """Return call counters and the current concurrency limit"""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'retries': self.retries,
+                'throttled': self.throttled,
+                'failures': self.failures,
+                'waited_seconds': round(self.waited_seconds, 3),
+                'concurrency_limit': int(self.concurrency.limit),
+                'in_flight': self.concurrency.in_flight,
+                'requests_per_minute': self.requests.per_minute,
+                'tokens_per_minute': self.tokens.per_minute
+            }
+
+
+def usage_tokens(result):
+    """Total tokens reported by the provider for a call, or None if unknown"""
+    if isinstance(result, dict) and 'raw' in result:
+        result = result['raw']
+    if isinstance(result, AIMessage) and result.usage_metadata:
+        return result.usage_metadata.get('total_tokens')
+    return None
+
+
+class RateLimitedModel(Runnable):
+    """Runnable that sends every invoke of the wrapped model through a RateLimiter"""
+
+    def __init__(self, bound, limiter):
+        """
+        Args:
+            bound (Runnable): Chat model or structured-output runnable
+            limiter (RateLimiter): Shared limiter
+        """
+        self.bound = bound
+        self.limiter = limiter
+
+    def invoke(self, input, config=None, **kwargs):
+        return self.limiter.call(
+            lambda: self.bound.invoke(input, config, **kwargs),
+            self.limiter.estimate_tokens(input)
+        )
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self.limiter.acall(
+            lambda: self.bound.ainvoke(input, config, **kwargs),
+            self.limiter.estimate_tokens(input)
+        )
+
+    def with_structured_output(self, schema, **kwargs):
+        """Bind the wrapped model to a schema, keeping the limiter"""
+        return RateLimitedModel(self.bound.with_structured_output(schema, **kwargs), self.limiter)
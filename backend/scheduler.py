@@ -0,0 +1,170 @@
+"""
+Fair, prioritised scheduling of extraction work across tenants.
+
+Jobs no longer run their files on private thread pools. Every file (or
+batch of files) is submitted to one FairScheduler, whose workers always
+pick the next task like this:
+
+1. the highest priority with runnable work goes first;
+2. within a priority, tenants take turns round-robin, so a 2,000-file
+   upload cannot starve a 3-file job from another session or API key;
+3. a tenant never has more than `max_in_flight_per_tenant` tasks running,
+   and a job never more than its own concurrency limit.
+
+Queue depth, in-flight counts and queue wait times are kept for metrics.
+"""
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty sorted list"""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Task:
+    """One queued unit of work"""
+
+    __slots__ = ('function', 'future', 'tenant', 'priority', 'job_id', 'job_limit', 'queued_at')
+
+    def __init__(self, function, tenant, priority, job_id, job_limit):
+        self.function = function
+        self.future = Future()
+        self.tenant = tenant
+        self.priority = priority
+        self.job_id = job_id
+        self.job_limit = job_limit
+        self.queued_at = time.monotonic()
+
+
+class FairScheduler:
+    """Worker pool that serves tenants round-robin within priority levels"""
+
+    def __init__(self, workers=8, max_in_flight_per_tenant=4, name='scheduler', wait_samples=1000):
+        """
+        Args:
+            workers (int): Number of worker threads
+            max_in_flight_per_tenant (int): Tasks one tenant may run at once
+            name (str): Worker thread name prefix
+            wait_samples (int): Number of recent queue wait times kept for metrics
+        """
+        self.workers = workers
+        self.max_in_flight_per_tenant = max_in_flight_per_tenant
+        # priority -> tenant -> queued tasks; tenant order is the round-robin order
+        self._queues = {}
+        self._tenant_in_flight = Counter()
+        self._job_in_flight = Counter()
+        self._waits = deque(maxlen=wait_samples)
+        self.submitted = self.completed = self.failed = 0
+        self._condition = threading.Condition()
+        for number in range(workers):
+            threading.Thread(target=self._work, name=f"{name}-{number}", daemon=True).start()
+
+    def submit(self, function, tenant='default', priority=0, job_id=None, job_limit=None):
+        """
+        Queue a callable
+
+        Args:
+            function (callable): Work to run, called without arguments
+            tenant (str): Session or API key the work belongs to
+            priority (int): Higher priorities are served first
+            job_id (str): Job the work belongs to, for the per-job limit
+            job_limit (int): Tasks of this job that may run at once
+
+        Returns:
+            concurrent.futures.Future: Resolves to the callable's return value
+        """
+        task = Task(function, tenant, priority, job_id, job_limit)
+        with self._condition:
+            self._queues.setdefault(priority, OrderedDict()).setdefault(tenant, deque()).append(task)
+            self.submitted += 1
+            self._condition.notify()
+        return task.future
+
+    def _runnable(self, task):
+        return not task.job_limit or self._job_in_flight[task.job_id] < task.job_limit
+
+    def _next_task(self):
+        """Pop the next task to run, or None if nothing is runnable; caller holds the lock"""
+        for priority in sorted(self._queues, reverse=True):
+            tenants = self._queues[priority]
+            for tenant in list(tenants):
+                if self._tenant_in_flight[tenant] >= self.max_in_flight_per_tenant:
+                    continue
+                tasks = tenants[tenant]
+                # The oldest task whose job is under its own limit
+                task = next((task for task in tasks if self._runnable(task)), None)
+                if task is None:
+                    continue
+                tasks.remove(task)
+                # Served tenants go to the back of the line
+                if tasks:
+                    tenants.move_to_end(tenant)
+                else:
+                    del tenants[tenant]
+                    if not tenants:
+                        del self._queues[priority]
+                return task
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                task = self._next_task()
+                while task is None:
+                    self._condition.wait()
+                    task = self._next_task()
+                self._tenant_in_flight[task.tenant] += 1
+                self._job_in_flight[task.job_id] += 1
+                self._waits.append(time.monotonic() - task.queued_at)
+
+            if task.future.set_running_or_notify_cancel():
+                try:
+                    task.future.set_result(task.function())
+                except BaseException as e:
+                    task.future.set_exception(e)
+
+            with self._condition:
+                self._tenant_in_flight[task.tenant] -= 1
+                self._job_in_flight[task.job_id] -= 1
+                if not self._tenant_in_flight[task.tenant]:
+                    del self._tenant_in_flight[task.tenant]
+                if not self._job_in_flight[task.job_id]:
+                    del self._job_in_flight[task.job_id]
+                if task.future.exception() is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                # Freed slots may make tasks of other tenants or jobs runnable
+                self._condition.notify_all()
+
+    def stats(self):
+        """Return queue depth, in-flight counts and queue wait time percentiles"""
+        with self._condition:
+            depth_by_tenant = Counter()
+            depth_by_priority = {}
+            for priority, tenants in self._queues.items():
+                depth_by_priority[priority] = sum(len(tasks) for tasks in tenants.values())
+                for tenant, tasks in tenants.items():
+                    depth_by_tenant[tenant] += len(tasks)
+            waits = sorted(self._waits)
+            return {
+                'workers': self.workers,
+                'max_in_flight_per_tenant': self.max_in_flight_per_tenant,
+                'queue_depth': sum(depth_by_priority.values()),
+                'queue_depth_by_priority': depth_by_priority,
+                'queue_depth_by_tenant': dict(depth_by_tenant),
+                'in_flight': sum(self._tenant_in_flight.values()),
+                'in_flight_by_tenant': dict(self._tenant_in_flight),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'wait_seconds': {
+                    'mean': round(sum(waits) / len(waits), 3),
+                    'p50': round(percentile(waits, 0.5), 3),
+                    'p95': round(percentile(waits, 0.95), 3),
+                    'max': round(waits[-1], 3)
+                } if waits else None
+            }
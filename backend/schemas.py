@@ -0,0 +1,145 @@
+"""
+Extraction schemas defined as [name, type, description] field lists.
+
+build_schema_model compiles a field list into a Pydantic model with
+pydantic.create_model. Compiled models are cached by schema fingerprint, so
+each distinct schema is only built once per process.
+"""
+import json
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Union
+
+from pydantic import Field, create_model
+
+from extraction_cache import fingerprint
+
+# Type names accepted in field definitions; anything else is treated as str
+FIELD_TYPES = {
+    'str': str,
+    'int': int,
+    'float': float,
+    'bool': bool,
+    'List[str]': List[str],
+}
+
+
+def normalize_fields(json_data: Union[List, Dict]) -> tuple:
+    """
+    Validate and normalize a list of field definitions
+
+    Args:
+        json_data: List of field definitions [name, type, description]
+
+    Returns:
+        tuple: (name, type, description) tuples with sanitized names
+
+    Raises:
+        ValueError: If the definitions are not in the expected format
+    """
+    if not isinstance(json_data, list):
+        raise ValueError("Expected a list of field definitions.")
+
+    fields = []
+    for field_def in json_data:
+        if len(field_def) < 3:
+            raise ValueError("Each field definition should have name, type, and description.")
+        field_name, field_type, description = field_def[0], field_def[1], field_def[2]
+        # Sanitize field name to be a valid Python identifier
+        field_name = re.sub(r'\W|^(?=\d)', '_', field_name)
+        # Pydantic treats leading underscores as private attributes
+        if field_name.startswith('_'):
+            field_name = 'field' + field_name
+        if field_type not in FIELD_TYPES:
+            field_type = 'str'
+        fields.append((field_name, field_type, description))
+    return tuple(fields)
+
+
+def schema_fingerprint(fields) -> str:
+    """Return a stable hash of normalized field definitions"""
+    return fingerprint(json.dumps([list(field) for field in fields]))
+
+
+@lru_cache(maxsize=256)
+def _compile_schema(fields: tuple, class_name: str):
+    definitions = {}
+    for field_name, field_type, description in fields:
+        # Required but nullable, so the model must answer every field
+        definitions[field_name] = (
+            Optional[FIELD_TYPES[field_type]],
+            Field(description=f"{description} if No data found , show None")
+        )
+    return create_model(class_name, **definitions)
+
+
+def build_schema_model(json_data: Union[List, Dict], class_name: str = "Data"):
+    """
+    Compile field definitions into a Pydantic model class
+
+    Args:
+        json_data: List of field definitions [name, type, description]
+        class_name: Name for the Pydantic class
+
+    Returns:
+        type: Cached Pydantic model class for the schema
+    """
+    return _compile_schema(normalize_fields(json_data), class_name)
+
+
+@lru_cache(maxsize=256)
+def build_batch_model(Data, class_name: str = "DataBatch"):
+    """
+    Wrap a schema model for multi-image requests
+
+    Args:
+        Data: Model class from build_schema_model
+        class_name: Name for the batch model class
+
+    Returns:
+        type: Model with a `records` list, one Data record per image, each
+        tagged with the 1-based `image_index` it was extracted from
+    """
+    Record = create_model(
+        f"{Data.__name__}Record",
+        __base__=Data,
+        image_index=(int, Field(description="Number of the image this record was extracted from"))
+    )
+    return create_model(
+        class_name,
+        records=(List[Record], Field(description="One record per invoice image, in image order"))
+    )
+
+
+def json_to_pydantic_model(json_data: Union[List, Dict], class_name: str = "Data") -> str:
+    """
+    Convert a list of field definitions to a Pydantic BaseModel class definition.
+
+    The source is informational only; extraction uses build_schema_model.
+
+    Args:
+        json_data: List of field definitions [name, type, description] or dict
+        class_name: Name for the Pydantic class
+
+    Returns:
+        String containing the Pydantic class definition
+    """
+    try:
+        fields = normalize_fields(json_data)
+    except ValueError as e:
+        return f"Error: {e}"
+
+    # Generate class definition
+    class_definition = [
+        "from pydantic import BaseModel, Field",
+        "from typing import List, Optional, Dict, Any, Union\n",
+        f"class {class_name}(BaseModel):"
+    ]
+
+    for field_name, field_type, description in fields:
+        description += " if No data found , show None"
+
+        # Add field with type annotation and Field description
+        class_definition.append(f"    {field_name}: Optional[{field_type}] = Field(description={json.dumps(description)})")
+
+    return "\n".join(class_definition)
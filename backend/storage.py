@@ -0,0 +1,333 @@
+"""
+Bounded key/value stores for schemas, jobs, results and chat sessions.
+
+MemoryStore keeps values in-process; SQLiteStore pickles them into a SQLite
+file that every worker process on the host can share. Both evict the least
+recently used entries above `max_entries` and expire entries that have not
+been written for `ttl` seconds, and both count hits, misses and evictions.
+
+SQLiteStore reads never write: a read records its access time in memory,
+and the recorded times are saved when the store next evicts. Eviction runs
+every `evict_every` writes or EVICT_INTERVAL seconds instead of on every
+write, so the store can briefly hold a few more than max_entries rows.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+MISSING = object()
+
+# Longest time in seconds a written SQLiteStore goes without eviction
+EVICT_INTERVAL = 1.0
+
+
+class MemoryStore:
+    """In-process LRU + TTL store with a dict-like interface"""
+
+    backend = 'memory'
+
+    def __init__(self, name, max_entries=1000, ttl=24 * 3600, on_evict=None):
+        """
+        Args:
+            name (str): Store name, used in metrics
+            max_entries (int): Least recently used entries beyond this are evicted
+            ttl (float): Seconds an entry lives after its last write
+            on_evict (callable): Called with the key of every evicted or expired entry
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self._data = OrderedDict()  # key -> (value, written_at)
+        self._lock = threading.RLock()
+
+    def _lookup(self, key):
+        """Return the live value for key, or MISSING; caller holds the lock"""
+        entry = self._data.get(key)
+        if entry is None:
+            return MISSING
+        if time.time() - entry[1] > self.ttl:
+            del self._data[key]
+            self.expirations += 1
+            self._evicted(key)
+            return MISSING
+        self._data.move_to_end(key)
+        return entry[0]
+
+    def _evicted(self, key):
+        if self.on_evict:
+            self.on_evict(key)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key)
+            if value is MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def __getitem__(self, key):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not MISSING
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                evicted, _ = self._data.popitem(last=False)
+                self.evictions += 1
+                self._evicted(evicted)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key)
+            if value is MISSING:
+                return default
+            del self._data[key]
+            return value
+
+    def modify(self, key, change):
+        """
+        Atomically read, change and write back a stored value
+
+        Args:
+            key: Entry to change
+            change (callable): Receives the value and mutates it in place
+
+        Returns:
+            The updated value, or None if the key is not stored
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is MISSING:
+                return None
+            change(value)
+            self._data[key] = (value, time.time())
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        """Return size and hit/miss/eviction counters"""
+        return {
+            'backend': self.backend,
+            'size': len(self),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+
+class SQLiteStore(MemoryStore):
+    """LRU + TTL store persisted in SQLite and shared between processes"""
+
+    backend = 'sqlite'
+
+    def __init__(self, name, path, max_entries=1000, ttl=24 * 3600, on_evict=None):
+        """
+        Args:
+            name (str): Store name, also the namespace inside the database
+            path (str): SQLite database file, created if missing
+            max_entries, ttl, on_evict: See MemoryStore
+        """
+        super().__init__(name, max_entries, ttl, on_evict)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Autocommit mode so transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS store ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value BLOB NOT NULL,"
+            " written_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS store_accessed ON store (namespace, accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS store_written ON store (namespace, written_at)")
+        # Writes between evictions; a twentieth of the store keeps the overshoot small
+        self.evict_every = max(1, max_entries // 20)
+        self._writes = 0
+        self._evicted_at = time.monotonic()
+        # key -> time of reads not yet saved to accessed_at
+        self._touched = {}
+
+    @contextmanager
+    def _transaction(self):
+        """Hold the process lock and a SQLite write lock for the block"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _read(self, key):
+        """Return the live value for key, or MISSING, without a write transaction"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, written_at FROM store WHERE namespace = ? AND key = ?", (self.name, key)
+            ).fetchone()
+            if row is None or time.time() - row[1] > self.ttl:
+                # Expired rows are deleted by the next eviction
+                return MISSING
+            self._touched[key] = time.time()
+        return pickle.loads(row[0])
+
+    def _load(self, conn, key):
+        row = conn.execute(
+            "SELECT value, written_at FROM store WHERE namespace = ? AND key = ?", (self.name, key)
+        ).fetchone()
+        if row is None:
+            return MISSING
+        if time.time() - row[1] > self.ttl:
+            conn.execute("DELETE FROM store WHERE namespace = ? AND key = ?", (self.name, key))
+            self.expirations += 1
+            self._evicted(key)
+            return MISSING
+        return pickle.loads(row[0])
+
+    def _store(self, conn, key, value):
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO store (namespace, key, value, written_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (self.name, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now, now)
+        )
+
+    def _maybe_evict(self, conn):
+        """Evict once every evict_every writes or EVICT_INTERVAL seconds"""
+        self._writes += 1
+        if self._writes < self.evict_every and time.monotonic() - self._evicted_at < EVICT_INTERVAL:
+            return
+        self._writes = 0
+        self._evicted_at = time.monotonic()
+        self._evict(conn)
+
+    def _evict(self, conn):
+        """Save recorded reads, drop expired rows, then the least recently used rows over max_entries"""
+        touched, self._touched = self._touched, {}
+        conn.executemany(
+            "UPDATE store SET accessed_at = MAX(accessed_at, ?) WHERE namespace = ? AND key = ?",
+            [(accessed_at, self.name, key) for key, accessed_at in touched.items()]
+        )
+        expired = [row[0] for row in conn.execute(
+            "SELECT key FROM store WHERE namespace = ? AND written_at < ?", (self.name, time.time() - self.ttl)
+        )]
+        count = conn.execute("SELECT COUNT(*) FROM store WHERE namespace = ?", (self.name,)).fetchone()[0]
+        overflow = []
+        if count - len(expired) > self.max_entries:
+            overflow = [row[0] for row in conn.execute(
+                "SELECT key FROM store WHERE namespace = ? AND written_at >= ? ORDER BY accessed_at LIMIT ?",
+                (self.name, time.time() - self.ttl, count - len(expired) - self.max_entries)
+            )]
+        conn.executemany(
+            "DELETE FROM store WHERE namespace = ? AND key = ?", [(self.name, key) for key in expired + overflow]
+        )
+        for key in expired + overflow:
+            self._evicted(key)
+        self.expirations += len(expired)
+        self.evictions += len(overflow)
+
+    def get(self, key, default=None):
+        value = self._read(key)
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT written_at FROM store WHERE namespace = ? AND key = ?", (self.name, key)
+            ).fetchone()
+        return row is not None and time.time() - row[0] <= self.ttl
+
+    def __setitem__(self, key, value):
+        with self._transaction() as conn:
+            self._store(conn, key, value)
+            self._maybe_evict(conn)
+
+    def __delitem__(self, key):
+        with self._transaction() as conn:
+            deleted = conn.execute(
+                "DELETE FROM store WHERE namespace = ? AND key = ?", (self.name, key)
+            ).rowcount
+        if not deleted:
+            raise KeyError(key)
+
+    def pop(self, key, default=None):
+        with self._transaction() as conn:
+            value = self._load(conn, key)
+            if value is not MISSING:
+                conn.execute("DELETE FROM store WHERE namespace = ? AND key = ?", (self.name, key))
+        return default if value is MISSING else value
+
+    def modify(self, key, change):
+        with self._transaction() as conn:
+            value = self._load(conn, key)
+            if value is MISSING:
+                return None
+            change(value)
+            self._store(conn, key, value)
+        return value
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM store WHERE namespace = ?", (self.name,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM store WHERE namespace = ?", (self.name,)
+            ).fetchone()[0]
+
+
+def create_store(name, backend='memory', path=None, max_entries=1000, ttl=24 * 3600, on_evict=None):
+    """
+    Create a store for the configured backend
+
+    Args:
+        name (str): Store name / namespace
+        backend (str): 'memory' or 'sqlite'
+        path (str): SQLite database file, required for 'sqlite'
+        max_entries, ttl, on_evict: See MemoryStore
+
+    Returns:
+        MemoryStore or SQLiteStore
+    """
+    if backend == 'sqlite':
+        return SQLiteStore(name, path, max_entries, ttl, on_evict)
+    if backend == 'memory':
+        return MemoryStore(name, max_entries, ttl, on_evict)
+    raise ValueError(f"Unknown storage backend {backend}, expected 'memory' or 'sqlite'")
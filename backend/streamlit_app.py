@@ -19,7 +19,9 @@ from langchain_core.prompts.chat import (
 )
 from pydantic import BaseModel, Field
 from typing import Any, Dict, List, Union, Optional
-import re
+from extraction_cache import ExtractionCache, fingerprint
+from image_preprocessing import preprocess_image
+from schemas import build_schema_model, normalize_fields, schema_fingerprint
 
 # Load environment variables
 load_dotenv()
@@ -105,6 +107,15 @@ def initialize_model():
         return ChatGoogleGenerativeAI(model=st.session_state.model_name)
     return None
 
+@st.cache_resource
+def get_extraction_cache():
+    """Open the shared extraction cache once per server process"""
+    return ExtractionCache(
+        os.getenv("EXTRACTION_CACHE_PATH", os.path.join("backend", "data", "database", "extraction_cache.sqlite3")),
+        max_entries=int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", 10000)),
+        ttl=float(os.getenv("EXTRACTION_CACHE_TTL", 7 * 24 * 3600))
+    )
+
 def load_demo_image(image_path):
     """Load demo image from the backend/demo_images folder"""
     try:
@@ -119,6 +130,25 @@ def load_demo_image(image_path):
         st.error(f"Error loading demo image: {str(e)}")
         return None
 
+# Same settings and defaults as the Flask backend
+IMAGE_SETTINGS = {
+    'max_dimension': int(os.getenv("IMAGE_MAX_DIMENSION", 2048)),
+    'quality': int(os.getenv("IMAGE_QUALITY", 85)),
+    'output_format': os.getenv("IMAGE_FORMAT", "JPEG").upper(),
+    'grayscale': os.getenv("IMAGE_GRAYSCALE", "0") == "1",
+}
+
+def image_content(image_bytes):
+    """Downscale and recompress an image, then build its image_url content part"""
+    prepared = preprocess_image(image_bytes, **IMAGE_SETTINGS)
+    image_data = base64.b64encode(prepared['data']).decode("utf-8")
+    return {
+        "type": "image_url",
+        "image_url": {"url": f"data:{prepared['mime_type']};base64,{image_data}"},
+    }
+
+DESCRIPTION_PROMPT = "Act as Image Analyst. Analyze and extract insights from images. An expert in visual content interpretation and text Extraction with years of experience in image analysis"
+
 def get_image_description(image_file):
     """Get description of an image using Gemini Vision"""
     model = initialize_model()
@@ -131,20 +161,39 @@ def get_image_description(image_file):
     else:
         image_bytes = image_file
     
-    image_data = base64.b64encode(image_bytes).decode("utf-8")
+    # Reuse the transcription when this image was already analyzed
+    cache = get_extraction_cache()
+    cache_key = fingerprint(st.session_state.model_name, DESCRIPTION_PROMPT, json.dumps(IMAGE_SETTINGS), image_bytes)
+    cached = cache.get('description', cache_key)
+    if cached is not None:
+        return cached
     
     message = HumanMessage(
         content=[
-            {"type": "text", "text": "Act as Image Analyst. Analyze and extract insights from images. An expert in visual content interpretation and text Extraction with years of experience in image analysis"},
-            {
-                "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{image_data}"},
-            },
+            {"type": "text", "text": DESCRIPTION_PROMPT},
+            image_content(image_bytes),
         ],
     )
     response = model.invoke([message])
+    cache.set('description', cache_key, response.content)
     return response.content
 
+SINGLE_PASS_PROMPT = (
+    "You are an expert at reading invoices.\n\n"
+    "Extract the requested fields from the invoice image below exactly as they appear, "
+    "without correcting typos, OCR mistakes, or formatting issues."
+)
+
+def extract_single_pass(image_bytes, structured_llm):
+    """Extract schema fields with one structured call on the image itself"""
+    message = HumanMessage(
+        content=[
+            {"type": "text", "text": SINGLE_PASS_PROMPT},
+            image_content(image_bytes),
+        ],
+    )
+    return structured_llm.invoke([message])
+
 def suggest_questions(image_description):
     """Generate suggested questions based on image description"""
     model = initialize_model()
@@ -183,28 +232,11 @@ def get_conversation_chain():
     
     return chain
 
-def json_to_pydantic_model(json_data: List, class_name: str = "Data") -> str:
-    """Convert field definitions to Pydantic BaseModel class definition"""
-    fields = []
-    for field_def in json_data:
-        if len(field_def) >= 3:
-            field_name = field_def[0]
-            field_type = field_def[1]
-            description = field_def[2]
-            fields.append((field_name, field_type, description))
-    
-    class_definition = [
-        "from pydantic import BaseModel, Field",
-        "from typing import List, Optional, Dict, Any, Union\n",
-        f"class {class_name}(BaseModel):"
-    ]
-    
-    for field_name, field_type, description in fields:
-        field_name = re.sub(r'\W|^(?=\d)', '_', field_name)
-        description += " if No data found , show None"
-        class_definition.append(f"    {field_name}: str = Field(description=\"{description}\")")
-    
-    return "\n".join(class_definition)
+@st.cache_resource(show_spinner=False)
+def get_structured_llm(api_key, model_name, schema_key, _Data):
+    """Bind the model to a compiled schema once per API key, model and schema"""
+    os.environ['GOOGLE_API_KEY'] = api_key
+    return ChatGoogleGenerativeAI(model=model_name).with_structured_output(_Data)
 
 # Sidebar Configuration
 with st.sidebar:
@@ -538,24 +570,33 @@ else:  # Invoice Extraction mode
     
     has_files = (uploaded_files and len(uploaded_files) > 0) or ('bulk_demo_images' in st.session_state and st.session_state.bulk_demo_images)
     
+    extraction_mode = st.radio(
+        "Extraction Mode",
+        ["two_pass", "single_pass"],
+        format_func=lambda mode: {
+            "single_pass": "⚡ Single-pass (image → fields, one model call)",
+            "two_pass": "📝 Two-pass (transcribe, then extract fields)"
+        }[mode],
+        horizontal=True,
+        help="Single-pass halves model calls per invoice and falls back to two-pass if it fails"
+    )
+    
     if st.button("🚀 Process Images", type="primary", disabled=not has_files or not st.session_state.extraction_fields):
         if not has_files:
             st.error("Please upload files or load demo images.")
         elif not st.session_state.extraction_fields:
             st.error("Please define at least one extraction field.")
         else:
-            # Generate schema
-            schema_code = json_to_pydantic_model(st.session_state.extraction_fields)
+            # Compile schema (cached per distinct field list)
+            fields = normalize_fields(st.session_state.extraction_fields)
+            schema_key = schema_fingerprint(fields)
+            Data = build_schema_model(st.session_state.extraction_fields)
             
             with st.spinner("Processing images..."):
-                # Execute schema code
-                locals_dict = {}
-                exec(schema_code, globals(), locals_dict)
-                Data = locals_dict['Data']
-                
                 # Initialize model
-                model = initialize_model()
-                structured_llm = model.with_structured_output(Data)
+                structured_llm = get_structured_llm(
+                    st.session_state.api_key, st.session_state.model_name, schema_key, Data
+                )
                 
                 # Process each image
                 results = []
@@ -583,23 +624,42 @@ else:  # Invoice Extraction mode
                 
                 progress_bar = st.progress(0)
                 
+                cache = get_extraction_cache()
+                
                 for i, file_info in enumerate(all_files):
                     try:
-                        # Get image description based on file type
+                        # Get image bytes based on file type
                         if file_info['type'] == 'demo':
-                            image_desc = get_image_description(file_info['data'])
+                            image_bytes = file_info['data']
                         else:
                             # Reset file pointer for uploaded files
                             file_info['data'].seek(0)
-                            image_desc = get_image_description(file_info['data'])
+                            image_bytes = file_info['data'].read()
+                        
+                        # Skip the model calls when this image and schema were already extracted
+                        cache_key = fingerprint(st.session_state.model_name, schema_key, extraction_mode, json.dumps(IMAGE_SETTINGS), image_bytes)
+                        result_dict = cache.get('result', cache_key)
                         
-                        # Extract structured data
-                        result = structured_llm.invoke(
-                            f"Extract invoice data from the following text description of an invoice: {image_desc}"
-                        )
+                        if result_dict is None:
+                            result = None
+                            if extraction_mode == "single_pass":
+                                try:
+                                    result = extract_single_pass(image_bytes, structured_llm)
+                                except Exception:
+                                    result = None
+                            
+                            if result is None:
+                                image_desc = get_image_description(image_bytes)
+                                
+                                # Extract structured data
+                                result = structured_llm.invoke(
+                                    f"Extract invoice data from the following text description of an invoice: {image_desc}"
+                                )
+                            
+                            # Convert to dict
+                            result_dict = result.dict()
+                            cache.set('result', cache_key, result_dict)
                         
-                        # Convert to dict
-                        result_dict = result.dict()
                         result_dict['filename'] = file_info['name']
                         result_dict['source'] = file_info['type']
                         results.append(result_dict)
@@ -634,35 +694,35 @@ else:  # Invoice Extraction mode
         # Download options
         col1, col2, col3 = st.columns(3)
         
-        with col1:
-            # Download as Excel
+        # Files are only encoded when their download button is clicked
+        def excel_bytes():
             buffer = BytesIO()
             df.to_excel(buffer, index=False)
-            buffer.seek(0)
-            
+            return buffer.getvalue()
+        
+        with col1:
+            # Download as Excel
             st.download_button(
                 label="📥 Download Excel",
-                data=buffer.getvalue(),
+                data=excel_bytes,
                 file_name=f"invoice_extraction_results_{uuid.uuid4().hex[:8]}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
         
         with col2:
             # Download as CSV
-            csv = df.to_csv(index=False)
             st.download_button(
                 label="📥 Download CSV",
-                data=csv,
+                data=lambda: df.to_csv(index=False),
                 file_name=f"invoice_extraction_results_{uuid.uuid4().hex[:8]}.csv",
                 mime="text/csv"
             )
         
         with col3:
             # Download as JSON
-            json_data = df.to_json(orient='records', indent=2)
             st.download_button(
                 label="📥 Download JSON",
-                data=json_data,
+                data=lambda: df.to_json(orient='records', indent=2),
                 file_name=f"invoice_extraction_results_{uuid.uuid4().hex[:8]}.json",
                 mime="application/json"
             )
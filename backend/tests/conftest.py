@@ -0,0 +1,83 @@
+import os
+import random
+import sys
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def invoice_image(seed, quality=90, size=(600, 800)):
+    """JPEG bytes of a made-up invoice page; equal seeds give near copies at other qualities"""
+    rng = random.Random(seed)
+    image = Image.new('L', size, 255)
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.rectangle([x, y, x + rng.randrange(40, 300), y + rng.randrange(20, 200)], fill=rng.randrange(0, 200))
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=quality)
+    return output.getvalue()
+
+
+def model_calls(model):
+    """Calls made to a FakeVisionModel so far, both kinds together"""
+    counts = model.call_counts()
+    return counts.get('generate', 0) + counts.get('structured', 0)
+
+
+def process(client, job_id, **options):
+    return client.post('/process_images', json={'job_id': job_id, **options}).json
+
+
+def failed_indices(results):
+    return [index for index, result in enumerate(results) if 'error' in result]
+
+
+@pytest.fixture(scope='session')
+def backend(tmp_path_factory):
+    """The Flask app module, on the fake model with in-memory stores and fast retries"""
+    os.environ.update({
+        'MODEL': 'fake',
+        'STORAGE_BACKEND': 'memory',
+        'EXTRACTION_CACHE': '0',
+        'RATE_LIMIT_BACKOFF': '0.01',
+        'RATE_LIMIT_BACKOFF_MAX': '0.05',
+        'RATE_LIMIT_RETRIES': '8',
+    })
+    import app
+    app.app.config['UPLOAD_FOLDER'] = str(tmp_path_factory.mktemp('uploads'))
+    return app
+
+
+@pytest.fixture
+def fake_model(backend):
+    """The app's FakeVisionModel, with its failure settings restored after the test"""
+    model = backend.model_vision.bound
+    saved = (model.throttle_pattern, model.error_rate, model.latency)
+    yield model
+    model.throttle_pattern, model.error_rate, model.latency = saved
+
+
+@pytest.fixture
+def client(backend):
+    return backend.app.test_client()
+
+
+@pytest.fixture
+def schema_id(client):
+    response = client.post('/create_schema', json={'schema': [['invoice_number', 'str', 'Invoice number']]})
+    return response.json['schema_id']
+
+
+@pytest.fixture
+def upload(client, schema_id):
+    """Upload (filename, bytes) pairs as a job and return its id"""
+    def upload(files):
+        data = {'schema_id': schema_id, 'files[]': [(BytesIO(content), name) for name, content in files]}
+        response = client.post('/upload_images', data=data, content_type='multipart/form-data')
+        return response.json['job_id']
+    return upload
@@ -0,0 +1,29 @@
+from io import BytesIO
+
+import pytest
+
+from conftest import invoice_image
+
+
+@pytest.fixture
+def asgi_client(backend):
+    testclient = pytest.importorskip('starlette.testclient')
+    import asgi_app
+    return testclient.TestClient(asgi_app.app)
+
+
+def test_upload_image_suggests_questions_without_quick_answers(backend, asgi_client, fake_model, monkeypatch):
+    monkeypatch.setitem(backend.app.config, 'CHAT_QUICK_ANSWERS', False)
+
+    def blocking(*args, **kwargs):
+        raise AssertionError("suggest_questions must go through the async model path")
+
+    monkeypatch.setattr(backend, 'suggest_questions', blocking)
+    structured = fake_model.call_counts().get('structured', 0)
+
+    response = asgi_client.post('/upload_image', files={'image': ('invoice.jpg', BytesIO(invoice_image(700)), 'image/jpeg')})
+
+    assert response.status_code == 200
+    assert isinstance(response.json()['suggested_questions'], list)
+    assert fake_model.call_counts()['structured'] == structured + 1
+    assert backend.answer_books.get(response.json()['session_id']) is None
@@ -0,0 +1,77 @@
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from conftest import invoice_image, model_calls
+
+FIELDS = [['invoice_number', 'str', 'Invoice number']]
+
+
+def upload(seed, size=(600, 800)):
+    return {'filename': f"invoice{seed}.jpg", 'data': invoice_image(seed, size=size)}
+
+
+def test_plan_batches_splits_on_every_budget(backend):
+    files = [upload(seed) for seed in range(1400, 1405)]
+    # 600 x 800 is two 768-pixel tiles
+    tokens = backend.estimate_image_tokens(files[0])
+    size = max(len(file_info['data']) for file_info in files) * 4 // 3 + 4
+    assert tokens == 2 * backend.IMAGE_TILE_TOKENS
+
+    assert backend.plan_batches(files, 2, 10 ** 9, 10 ** 9) == [[0, 1], [2, 3], [4]]
+    assert backend.plan_batches(files, 10, 3 * size, 10 ** 9) == [[0, 1, 2], [3, 4]]
+    assert backend.plan_batches(files, 10, 10 ** 9, 2 * tokens) == [[0, 1], [2, 3], [4]]
+
+
+def test_plan_batches_gives_oversized_files_their_own_batch(backend):
+    files = [upload(1410), upload(1411, size=(3000, 3000)), upload(1412)]
+
+    assert backend.plan_batches(files, 10, 10 ** 9, 3 * backend.estimate_image_tokens(files[0])) == [[0], [1], [2]]
+
+
+def batch_model(backend, respond):
+    """Structured batch runnable answering with respond(count), a list of (image_index, invoice_number)"""
+    Batch = backend.build_batch_model(backend.build_schema_model(FIELDS))
+
+    def invoke(messages):
+        count = sum(1 for part in messages[0].content if part.get('type') == 'image_url')
+        records = [{'image_index': index, 'invoice_number': number} for index, number in respond(count)]
+        raw = AIMessage(content="", usage_metadata={'input_tokens': 900, 'output_tokens': 30, 'total_tokens': 930})
+        return {'raw': raw, 'parsed': Batch(records=records), 'parsing_error': None}
+    return RunnableLambda(invoke)
+
+
+@pytest.fixture
+def structured_llm(backend):
+    return backend.model_vision.with_structured_output(backend.build_schema_model(FIELDS), include_raw=True)
+
+
+def test_extract_batch_maps_records_by_image_index(backend, fake_model, structured_llm):
+    files = [upload(seed) for seed in range(1420, 1423)]
+    # Out of order, image 2 missing, and an index past the batch
+    batch_llm = batch_model(backend, lambda count: [(3, 'third'), (1, 'first'), (9, 'stray')])
+
+    calls = model_calls(fake_model)
+    results = backend.extract_batch(files, structured_llm, batch_llm)
+
+    assert [result['filename'] for result in results] == [file_info['filename'] for file_info in files]
+    assert results[0]['invoice_number'] == 'first'
+    assert results[2]['invoice_number'] == 'third'
+    # The skipped file is extracted on its own
+    assert results[1]['invoice_number'] == 'N/A'
+    assert model_calls(fake_model) - calls == 1
+    # The batch call's tokens are shared by the three files
+    assert sum(result['input_tokens'] for result in (results[0], results[2])) == 600
+
+
+def test_failed_batch_falls_back_to_one_file_at_a_time(backend, fake_model, structured_llm):
+    files = [upload(seed) for seed in range(1430, 1433)]
+
+    def fail(count):
+        raise ValueError("malformed batch response")
+
+    calls = model_calls(fake_model)
+    results = backend.extract_batch(files, structured_llm, batch_model(backend, fail))
+
+    assert all(result['invoice_number'] == 'N/A' for result in results)
+    assert model_calls(fake_model) - calls == 3
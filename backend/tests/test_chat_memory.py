@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+from chat_memory import create_memory, estimate_tokens
+from fake_model import FakeVisionModel
+
+
+class ThreadRecordingModel(FakeVisionModel):
+    """FakeVisionModel that remembers which thread each call ran on"""
+
+    threads: list = []
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.threads.append(threading.current_thread())
+        return super()._generate(messages, stop, run_manager, **kwargs)
+
+
+def exchange(turn):
+    return {'question': f"What is line {turn} of the invoice? " * 5}, {'text': f"Line {turn} is 100.00. " * 10}
+
+
+def test_window_keeps_last_exchanges_sync_and_async():
+    sync_memory = create_memory('window', window=2)
+    async_memory = create_memory('window', window=2)
+
+    async def save_all():
+        for turn in range(10):
+            await async_memory.asave_context(*exchange(turn))
+
+    for turn in range(10):
+        sync_memory.save_context(*exchange(turn))
+    asyncio.run(save_all())
+
+    assert len(sync_memory.chat_memory.messages) == 4
+    assert [m.content for m in async_memory.chat_memory.messages] == [m.content for m in sync_memory.chat_memory.messages]
+
+
+def test_token_budget_applies_to_asave_context():
+    memory = create_memory('token', max_tokens=150)
+
+    async def save_all():
+        for turn in range(10):
+            await memory.asave_context(*exchange(turn))
+
+    asyncio.run(save_all())
+
+    assert estimate_tokens(memory.chat_memory.messages) <= 150 or len(memory.chat_memory.messages) == 2
+
+
+def test_summary_asave_context_summarizes_off_the_event_loop():
+    model = ThreadRecordingModel(response_text="User asked about invoice lines; each is 100.00.", threads=[])
+    memory = create_memory('summary', summary_llm=model, max_tokens=150)
+    loop_threads = []
+
+    async def save_all():
+        loop_threads.append(threading.current_thread())
+        for turn in range(10):
+            await memory.asave_context(*exchange(turn))
+
+    asyncio.run(save_all())
+
+    assert model.threads, "the history never exceeded the budget"
+    assert loop_threads[0] not in model.threads
+    assert memory.summary == "User asked about invoice lines; each is 100.00."
+    assert memory.take_usage()['input_tokens'] > 0
+    assert len(memory.chat_memory.messages) < 20
+
+
+def test_state_round_trip_continues_the_session():
+    memory = create_memory('window', window=2)
+    memory.pin("Image Description: Invoice INV-0001")
+    for turn in range(4):
+        memory.save_context(*exchange(turn))
+
+    restored = create_memory('buffer', window=2)
+    restored.load_state(memory.dump_state())
+    restored.save_context(*exchange(4))
+
+    assert restored.strategy == 'window'
+    assert restored.load_memory_variables({})['invoice_facts'] == "Image Description: Invoice INV-0001"
+    assert len(restored.chat_memory.messages) == 4
+    assert restored.chat_memory.messages[-1].content == exchange(4)[1]['text']
@@ -0,0 +1,73 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import cli
+from conftest import invoice_image, model_calls
+
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cli.py')
+SCHEMA = [['invoice_number', 'str', 'Invoice number'], ['total', 'float', 'Total amount']]
+
+
+def write_inputs(directory, count, seed=800):
+    scans = directory / 'scans'
+    scans.mkdir()
+    for number in range(count):
+        (scans / f"invoice{number}.jpg").write_bytes(invoice_image(seed + number))
+    schema = directory / 'schema.json'
+    schema.write_text(json.dumps(SCHEMA))
+    return scans, schema
+
+
+def test_cli_leaves_the_working_directory_alone(tmp_path):
+    scans, schema = write_inputs(tmp_path, 2)
+    env = dict(os.environ, MODEL='fake', EXTRACTION_CACHE='0', STORAGE_BACKEND='memory')
+
+    completed = subprocess.run(
+        [sys.executable, CLI, 'scans', '-s', 'schema.json', '-o', 'results.jsonl', '--quiet'],
+        cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120
+    )
+
+    assert completed.returncode == 0, completed.stderr
+    assert json.loads(completed.stdout)['files'] == 2
+    assert sorted(os.listdir(tmp_path)) == ['results.jsonl', 'scans', 'schema.json']
+
+
+def read_rows(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_resume_and_retry_failed_only_run_what_is_missing(backend, fake_model, tmp_path, capsys):
+    scans, schema = write_inputs(tmp_path, 4, seed=820)
+    output = tmp_path / 'results.jsonl'
+    command = [str(scans), '-s', str(schema), '-o', str(output), '--mode', 'two_pass', '--concurrency', '1', '--quiet']
+    fake_model.error_rate = 0.25
+
+    cli.main(command)
+    failed = {row['filename'] for row in read_rows(output) if 'error' in row}
+    assert len(read_rows(output)) == 4 and failed
+
+    fake_model.error_rate = 0
+    with pytest.raises(SystemExit):
+        cli.main(command)
+
+    # An interrupted run can leave half a row behind
+    with open(output, 'a') as f:
+        f.write('{"filename": "')
+    calls = model_calls(fake_model)
+    cli.main(command + ['--resume'])
+    assert model_calls(fake_model) == calls
+    assert len(read_rows(output)) == 4
+
+    capsys.readouterr()
+    cli.main(command + ['--retry-failed'])
+    assert json.loads(capsys.readouterr().out)['files'] == len(failed)
+    # Two calls (describe, then extract) per re-run file
+    assert model_calls(fake_model) - calls == 2 * len(failed)
+    rows = read_rows(output)
+    assert len(rows) == 4 + len(failed)
+    assert not any('error' in row for row in rows[4:])
+    assert {row['filename'] for row in rows[4:]} == failed
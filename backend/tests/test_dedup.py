@@ -0,0 +1,93 @@
+from conftest import invoice_image, model_calls, process
+from dedup import DuplicateIndex, cluster
+from storage import SQLiteStore
+
+
+def test_identical_files_are_extracted_once(client, upload, fake_model):
+    original, other = invoice_image(400), invoice_image(401)
+    job_id = upload([('a.jpg', original), ('b.jpg', other), ('a_copy.jpg', original)])
+    calls = model_calls(fake_model)
+
+    results = process(client, job_id)['results']
+
+    assert model_calls(fake_model) - calls == 4
+    assert results[2]['filename'] == 'a_copy.jpg'
+    assert results[2]['duplicate_of'] == 'a.jpg'
+    assert results[2]['duplicate_distance'] == 0
+    assert client.get(f"/job_status/{job_id}").json['files_duplicate'] == 1
+
+    # A later job reuses the result without calling the model
+    again = upload([('a_again.jpg', original)])
+    calls = model_calls(fake_model)
+    [result] = process(client, again)['results']
+
+    assert model_calls(fake_model) == calls
+    assert result['duplicate_job_id'] == job_id
+
+
+def test_near_copies_are_flagged_not_reused(client, upload, fake_model):
+    scan = invoice_image(500)
+    rescan = invoice_image(500, quality=40)
+    assert scan != rescan
+    job_id = upload([('scan.jpg', scan), ('rescan.jpg', rescan)])
+    calls = model_calls(fake_model)
+
+    results = process(client, job_id)['results']
+
+    # Re-encoded copies may differ in content, so they are extracted and only flagged
+    assert model_calls(fake_model) - calls == 4
+    assert results[1]['possible_duplicate_of'] == 'scan.jpg'
+    assert 'duplicate_of' not in results[1]
+
+
+def test_copies_of_a_flagged_file_reuse_its_result(client, upload, fake_model):
+    scan, rescan = invoice_image(510), invoice_image(510, quality=40)
+    job_id = upload([('scan.jpg', scan), ('rescan.jpg', rescan), ('rescan_copy.jpg', rescan)])
+    calls = model_calls(fake_model)
+
+    results = process(client, job_id)['results']
+
+    assert model_calls(fake_model) - calls == 4
+    assert results[1]['possible_duplicate_of'] == 'scan.jpg'
+    assert (results[2]['duplicate_of'], results[2]['duplicate_distance']) == ('rescan.jpg', 0)
+
+    # Flagged files are indexed for later jobs as well
+    again = upload([('rescan_again.jpg', rescan)])
+    calls = model_calls(fake_model)
+    [result] = process(client, again)['results']
+
+    assert model_calls(fake_model) == calls
+    assert (result['duplicate_of'], result['duplicate_job_id']) == ('rescan.jpg', job_id)
+
+
+def test_reused_near_copies_pass_their_original_on(backend, client, upload, fake_model, monkeypatch):
+    monkeypatch.setitem(backend.app.config, 'DEDUP_NEAR', 'reuse')
+    scan, rescan = invoice_image(520), invoice_image(520, quality=40)
+    job_id = upload([('scan.jpg', scan), ('rescan.jpg', rescan), ('rescan_copy.jpg', rescan)])
+    calls = model_calls(fake_model)
+
+    results = process(client, job_id)['results']
+
+    assert model_calls(fake_model) - calls == 2
+    assert [result.get('duplicate_of') for result in results] == [None, 'scan.jpg', 'scan.jpg']
+
+
+def test_cluster_matches_copies_of_near_copies_exactly():
+    near = 0b1111
+    fingerprints = [('a', 0), ('b', near), ('b', near), ('a', 0), None]
+
+    assert cluster(fingerprints, max_distance=4) == [None, (0, 4), (1, 0), (0, 0), None]
+
+
+def test_exact_matches_are_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'store.sqlite3')
+    first = DuplicateIndex(digests=SQLiteStore('duplicate_digests', path))
+    second = DuplicateIndex(digests=SQLiteStore('duplicate_digests', path))
+
+    first.add('schema', 'digest', 0b1010, ('job-1', 0))
+
+    assert second.find('schema', 'digest', 0b1010, max_distance=4) == [(0, ('job-1', 0))]
+    assert second.find('other-schema', 'digest', 0b1010, max_distance=4) == []
+    # Near matches are only known to the process that saw the file
+    assert second.find('schema', 'other-digest', 0b1011, max_distance=4) == []
+    assert first.find('schema', 'other-digest', 0b1011, max_distance=4) == [(1, ('job-1', 0))]
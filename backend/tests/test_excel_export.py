@@ -0,0 +1,49 @@
+from io import BytesIO
+
+import pandas as pd
+
+ROWS = [{'filename': 'a.jpg', 'invoice_number': 'INV-1'}, {'filename': 'b.jpg', 'invoice_number': 'INV-2'}]
+
+
+def update(client, job_id, results):
+    response = client.post('/update_results', json={'job_id': job_id, 'results': results})
+    assert response.get_json()['success']
+
+
+def test_unchanged_results_answer_304(backend, client):
+    update(client, 'excel-etag', ROWS)
+
+    first = client.get('/download_excel/excel-etag')
+    assert first.status_code == 200
+    assert first.headers['ETag']
+    assert pd.read_excel(BytesIO(first.data))['invoice_number'].tolist() == ['INV-1', 'INV-2']
+
+    again = client.get('/download_excel/excel-etag', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.data == b""
+
+
+def test_workbook_is_built_once(backend, client, monkeypatch):
+    update(client, 'excel-cached', ROWS)
+    client.get('/download_excel/excel-cached')
+    built = []
+    monkeypatch.setattr(backend.pd, 'DataFrame', lambda *args, **kwargs: built.append(args))
+
+    assert client.get('/download_excel/excel-cached').status_code == 200
+    assert built == []
+
+
+def test_updated_results_get_a_new_export(backend, client):
+    update(client, 'excel-update', ROWS)
+    first = client.get('/download_excel/excel-update')
+
+    update(client, 'excel-update', [dict(ROWS[0], invoice_number='INV-9'), ROWS[1]])
+    second = client.get('/download_excel/excel-update', headers={'If-None-Match': first.headers['ETag']})
+
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert pd.read_excel(BytesIO(second.data))['invoice_number'].tolist() == ['INV-9', 'INV-2']
+
+
+def test_unknown_job_is_not_found(client):
+    assert client.get('/download_excel/no-such-job').status_code == 404
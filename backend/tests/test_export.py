@@ -0,0 +1,65 @@
+import csv
+import json
+from io import BytesIO, StringIO
+
+import pytest
+
+import export
+from export import csv_chunks, ndjson_chunks, parquet_chunks, result_columns
+
+ROWS = [
+    {'filename': 'a.jpg', 'invoice_number': 'INV-1', 'total': '10.5', 'tags': ['paid', 'eu'],
+     'line_items': [{'description': 'Widget', 'amount': 10.5}]},
+    {'filename': 'b.jpg', 'invoice_number': 'INV-2', 'total': 'n/a', 'tags': [], 'error': 'Unreadable'},
+]
+
+
+def test_result_columns_keep_first_seen_order():
+    assert result_columns(ROWS) == ['filename', 'invoice_number', 'total', 'tags', 'line_items', 'error']
+
+
+def test_csv_encodes_lists_as_json(monkeypatch):
+    monkeypatch.setattr(export, 'CHUNK_ROWS', 1)
+
+    chunks = list(csv_chunks(ROWS, result_columns(ROWS)))
+    rows = list(csv.DictReader(StringIO("".join(chunks))))
+
+    assert len(chunks) == 2
+    assert json.loads(rows[0]['tags']) == ['paid', 'eu']
+    assert json.loads(rows[0]['line_items']) == [{'description': 'Widget', 'amount': 10.5}]
+    assert rows[1]['error'] == 'Unreadable'
+    assert rows[1]['line_items'] == ''
+
+
+def test_ndjson_writes_one_object_per_line():
+    lines = "".join(ndjson_chunks(ROWS)).splitlines()
+
+    assert [json.loads(line) for line in lines] == ROWS
+
+
+def test_parquet_types_columns_from_the_schema(monkeypatch):
+    pq = pytest.importorskip('pyarrow.parquet')
+    monkeypatch.setattr(export, 'CHUNK_ROWS', 1)
+
+    data = b"".join(parquet_chunks(ROWS, result_columns(ROWS), {'total': 'float', 'tags': 'List[str]'}))
+    table = pq.read_table(BytesIO(data))
+
+    assert table.num_rows == 2
+    assert str(table.schema.field('total').type) == 'double'
+    # Values that do not convert become null instead of failing the export
+    assert table.column('total').to_pylist() == [10.5, None]
+    assert table.column('tags').to_pylist() == [['paid', 'eu'], []]
+    assert json.loads(table.column('line_items').to_pylist()[0]) == [{'description': 'Widget', 'amount': 10.5}]
+
+
+def test_export_endpoint_streams_job_results(backend, client):
+    backend.result_storage['export-job'] = ROWS
+
+    response = client.get('/export/export-job?format=csv')
+    rows = list(csv.DictReader(StringIO(response.get_data(as_text=True))))
+
+    assert response.mimetype == 'text/csv'
+    assert 'results_export-job.csv' in response.headers['Content-Disposition']
+    assert [row['invoice_number'] for row in rows] == ['INV-1', 'INV-2']
+    assert client.get('/export/export-job?format=xml').status_code == 400
+    assert client.get('/export/missing?format=ndjson').status_code == 404
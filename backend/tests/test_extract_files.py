@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from conftest import invoice_image
+from fake_model import FakeVisionModel
+
+FIELDS = [['invoice_number', 'str', 'Invoice number']]
+
+_lock = threading.Lock()
+
+
+class TrackingModel(FakeVisionModel):
+    """FakeVisionModel that counts describe calls in flight and can hold up the first one"""
+
+    first_latency: float = 0.0
+    stats: dict = {}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        with _lock:
+            call = self.stats['calls'] = self.stats.get('calls', 0) + 1
+            self.stats['running'] = self.stats.get('running', 0) + 1
+            self.stats['peak'] = max(self.stats.get('peak', 0), self.stats['running'])
+        try:
+            if call == 1:
+                time.sleep(self.first_latency)
+            return super()._generate(messages, stop, run_manager, **kwargs)
+        finally:
+            with _lock:
+                self.stats['running'] -= 1
+
+
+@pytest.fixture
+def use_model(backend, monkeypatch):
+    """Route the app's model calls to a TrackingModel"""
+    concurrency = backend.rate_limiter.concurrency
+    # Earlier throttling tests may have lowered the adaptive limit
+    monkeypatch.setattr(concurrency, 'limit', concurrency.maximum)
+
+    def use_model(**options):
+        model = TrackingModel(**options)
+        monkeypatch.setattr(backend.model_vision, 'bound', model)
+        return model
+    return use_model
+
+
+def extract(backend, count, concurrency, seed, on_complete=None):
+    files = [{'filename': f"file{n}.jpg", 'data': invoice_image(seed + n)} for n in range(count)]
+    structured_llm = backend.model_vision.with_structured_output(
+        backend.build_schema_model(FIELDS), include_raw=True
+    )
+    return backend.extract_files(files, structured_llm, concurrency, on_complete=on_complete, mode='two_pass')
+
+
+def test_results_keep_file_order(backend, use_model):
+    use_model(latency=0.01, first_latency=0.2)
+    finished = []
+
+    results = extract(backend, 5, 3, 1000, on_complete=lambda index, *_: finished.append(index))
+
+    # The first file's slow call finishes last, but its result stays first
+    assert finished[-1] == 0
+    assert [result['filename'] for result in results] == [f"file{n}.jpg" for n in range(5)]
+    assert all('invoice_number' in result for result in results)
+
+
+def test_concurrency_caps_model_calls_in_flight(backend, use_model):
+    model = use_model(latency=0.05)
+
+    started = time.monotonic()
+    extract(backend, 6, 2, 1100)
+
+    assert model.stats['peak'] == 2
+    # Six describe calls two at a time, then the last structure call
+    assert time.monotonic() - started >= 0.15
+
+
+def test_failed_files_do_not_fail_the_others(backend, use_model):
+    model = use_model(error_rate=0.25, latency=0.01)
+
+    results = extract(backend, 6, 3, 1200)
+
+    failed = [result for result in results if 'error' in result]
+    assert 1 <= len(failed) <= 3
+    assert all('Scheduled model failure' in result['error'] for result in failed)
+    assert all('invoice_number' in result for result in results if 'error' not in result)
+    assert [result['filename'] for result in results] == [f"file{n}.jpg" for n in range(6)]
+    # Each failed file stopped at its first failed call
+    assert model.call_counts()['errors'] == len(failed)
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from conftest import invoice_image, model_calls
+from extraction_cache import ExtractionCache, fingerprint
+
+FIELDS = [['invoice_number', 'str', 'Invoice number']]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ExtractionCache(str(tmp_path / 'cache.sqlite3'))
+
+
+def test_values_are_kept_by_kind_and_across_instances(cache):
+    key = fingerprint(b"image bytes", "model")
+    cache.set('description', key, "Invoice INV-7")
+
+    assert cache.get('description', key) == "Invoice INV-7"
+    assert cache.get('result', key) is None
+    assert ExtractionCache(cache.path).get('description', key) == "Invoice INV-7"
+    assert cache.stats()['hits'] == {'description': 1}
+    assert cache.stats()['misses'] == {'result': 1}
+
+
+def test_entries_expire_and_least_recently_used_are_evicted(tmp_path):
+    cache = ExtractionCache(str(tmp_path / 'cache.sqlite3'), max_entries=2, ttl=0.1)
+    cache.set('result', 'a', {'total': 1})
+    time.sleep(0.01)
+    cache.set('result', 'b', {'total': 2})
+    time.sleep(0.01)
+    cache.get('result', 'a')
+    cache.set('result', 'c', {'total': 3})
+
+    assert cache.get('result', 'b') is None
+    assert cache.get('result', 'a') == {'total': 1}
+    time.sleep(0.15)
+    assert cache.get('result', 'c') is None
+
+
+def extract(backend, files, fields=FIELDS):
+    schema = {'fields': fields, 'fingerprint': backend.schema_fingerprint(fields)}
+    return backend.extract_files(
+        files, backend.get_structured_llm(schema), 2, schema_fingerprint=schema['fingerprint'], mode='two_pass'
+    )
+
+
+def test_cache_hits_skip_the_model(backend, fake_model, cache, monkeypatch):
+    monkeypatch.setattr(backend, 'extraction_cache', cache)
+    image = invoice_image(1300)
+
+    calls = model_calls(fake_model)
+    first = extract(backend, [{'filename': 'first.jpg', 'data': image}])
+    assert model_calls(fake_model) - calls == 2
+
+    calls = model_calls(fake_model)
+    [again] = extract(backend, [{'filename': 'again.jpg', 'data': image}])
+    assert model_calls(fake_model) == calls
+    assert again['invoice_number'] == first[0]['invoice_number']
+    assert again['filename'] == 'again.jpg'
+    assert again['input_tokens'] == again['output_tokens'] == 0
+
+    # Another schema reuses the cached description and only extracts the fields
+    calls = model_calls(fake_model)
+    extract(backend, [{'filename': 'other.jpg', 'data': image}], FIELDS + [['total', 'float', 'Total']])
+    assert model_calls(fake_model) - calls == 1
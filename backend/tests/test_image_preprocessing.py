@@ -0,0 +1,83 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from image_preprocessing import EXIF_ORIENTATION, detect_mime_type, preprocess_image
+
+
+def encode(image, image_format='JPEG', **options):
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def open_image(data):
+    return Image.open(BytesIO(data))
+
+
+def test_large_images_are_fit_into_the_maximum_dimension():
+    data = encode(Image.new('RGB', (3000, 1500), (200, 200, 200)))
+
+    prepared = preprocess_image(data, max_dimension=1000)
+
+    assert (prepared['width'], prepared['height']) == (1000, 500)
+    assert open_image(prepared['data']).size == (1000, 500)
+    assert prepared['bytes_in'] == len(data)
+    assert prepared['bytes_out'] == len(prepared['data']) < len(data)
+
+
+def test_exif_orientation_is_applied():
+    # Stored landscape with its top half red; orientation 6 means rotate 90 degrees clockwise to view
+    image = Image.new('RGB', (600, 300), (255, 255, 255))
+    image.paste((255, 0, 0), (0, 0, 600, 150))
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6
+
+    prepared = preprocess_image(encode(image, exif=exif.tobytes()), max_dimension=0)
+
+    upright = open_image(prepared['data'])
+    assert upright.size == (300, 600)
+    assert upright.getexif().get(EXIF_ORIENTATION, 1) == 1
+    # The stored top edge is now the right edge
+    assert upright.getpixel((280, 300))[1] < 50
+    assert upright.getpixel((20, 300))[1] > 200
+
+
+@pytest.mark.parametrize('image_format, mime_type', [
+    ('JPEG', 'image/jpeg'),
+    ('PNG', 'image/png'),
+    ('WEBP', 'image/webp'),
+    ('GIF', 'image/gif'),
+])
+def test_mime_type_comes_from_the_content(image_format, mime_type):
+    assert detect_mime_type(encode(Image.new('RGB', (20, 20)), image_format)) == mime_type
+
+
+def test_undecodable_files_are_returned_unchanged():
+    prepared = preprocess_image(b"%PDF-1.4 not an image")
+
+    assert prepared['data'] == b"%PDF-1.4 not an image"
+    assert prepared['mime_type'] == 'image/jpeg'
+    assert detect_mime_type(b"%PDF-1.4", default='application/octet-stream') == 'application/octet-stream'
+
+
+def test_output_format_sets_the_mime_type():
+    data = encode(Image.new('RGBA', (400, 400), (0, 0, 255, 128)), 'PNG')
+
+    webp = preprocess_image(data, max_dimension=200, output_format='webp')
+    jpeg = preprocess_image(data, max_dimension=200, grayscale=True)
+
+    assert webp['mime_type'] == 'image/webp' and open_image(webp['data']).format == 'WEBP'
+    assert jpeg['mime_type'] == 'image/jpeg' and open_image(jpeg['data']).mode == 'L'
+    with pytest.raises(ValueError):
+        preprocess_image(data, output_format='PNG')
+
+
+def test_small_images_that_would_grow_are_kept():
+    data = encode(Image.effect_noise((100, 100), 80).convert('RGB'), quality=20)
+
+    prepared = preprocess_image(data, quality=95)
+
+    assert prepared['data'] == data
+    assert (prepared['width'], prepared['height']) == (100, 100)
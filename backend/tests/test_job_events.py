@@ -0,0 +1,58 @@
+import json
+
+from conftest import invoice_image
+
+
+def read_events(response):
+    """Parse a server-sent event stream into (event, id, data) tuples, skipping comments"""
+    events = []
+    for block in response.get_data(as_text=True).split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if line and not line.startswith(":"))
+        if fields:
+            events.append((fields['event'], fields.get('id'), json.loads(fields['data'])))
+    return events
+
+
+def test_results_stream_while_the_job_runs(client, upload, fake_model):
+    job_id = upload([(f"live{n}.jpg", invoice_image(1500 + n)) for n in range(3)])
+    fake_model.latency = 0.05
+
+    started = client.post('/process_images', json={'job_id': job_id, 'async': True, 'concurrency': 1})
+    assert started.status_code == 202
+    response = client.get(f'/job_events/{job_id}')
+
+    assert response.mimetype == 'text/event-stream'
+    events = read_events(response)
+    results = [data for event, _, data in events if event == 'result']
+    assert [event_id for event, event_id, _ in events if event == 'result'] == ['1', '2', '3']
+    assert sorted(data['index'] for data in results) == [0, 1, 2]
+    assert [data['files_completed'] for data in results] == [1, 2, 3]
+    assert all(data['result']['filename'] == f"live{data['index']}.jpg" for data in results)
+    event, _, final = events[-1]
+    assert event == 'done' and final['status'] == 'done'
+
+
+def test_reconnecting_client_resumes_after_the_last_event(client, upload):
+    job_id = upload([(f"resume{n}.jpg", invoice_image(1510 + n)) for n in range(3)])
+    client.post('/process_images', json={'job_id': job_id})
+
+    events = read_events(client.get(f'/job_events/{job_id}', headers={'Last-Event-ID': '2'}))
+
+    assert [(event, event_id) for event, event_id, _ in events] == [('result', '3'), ('done', None)]
+    assert [event for event, _, _ in read_events(client.get(f'/job_events/{job_id}?after=3'))] == ['done']
+
+
+def test_job_that_was_not_started_fails(client, upload):
+    job_id = upload([("idle.jpg", invoice_image(1520))])
+
+    [(event, _, data)] = read_events(client.get(f'/job_events/{job_id}'))
+
+    assert event == 'failed'
+    assert data['error'] == 'Job has not been started'
+
+
+def test_invalid_requests_are_rejected(client, upload):
+    job_id = upload([("bad.jpg", invoice_image(1530))])
+
+    assert client.get('/job_events/no-such-job').status_code == 404
+    assert client.get(f'/job_events/{job_id}', headers={'Last-Event-ID': 'abc'}).status_code == 400
@@ -0,0 +1,14 @@
+import pytest
+
+
+def test_instrumented_times_operations_and_counts_failures(backend):
+    with backend.instrumented('test_operation'):
+        pass
+    with pytest.raises(ValueError):
+        with backend.instrumented('test_operation'):
+            raise ValueError("model failure")
+
+    lines = backend.render_metrics().splitlines()
+
+    assert 'invoice_operation_duration_seconds_count{operation="test_operation"} 2' in lines
+    assert 'invoice_operation_errors_total{operation="test_operation"} 1' in lines
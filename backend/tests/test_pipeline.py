@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from pipeline import Stage, run_pipeline
+
+
+def traced(name, seconds=0.0, fail=None):
+    """Stage function that appends its name to state['trace']"""
+    def function(state):
+        if fail is not None and state['n'] == fail:
+            raise ValueError(f"{name} failed")
+        time.sleep(seconds)
+        state.setdefault('trace', []).append(name)
+    return function
+
+
+def test_items_pass_every_stage_in_order():
+    states = [{'n': n} for n in range(6)]
+    done = []
+    stages = [Stage('decode', traced('decode')), Stage('model', traced('model', 0.01), workers=3),
+              Stage('parse', traced('parse'))]
+
+    report = run_pipeline(states, stages, queue_size=2, on_done=done.append)
+
+    assert sorted(state['n'] for state in done) == list(range(6))
+    assert all(state['trace'] == ['decode', 'model', 'parse'] for state in states)
+    assert all(set(state['timings']) == {'decode', 'model', 'parse'} for state in states)
+    assert [report[name]['items'] for name in ('decode', 'model', 'parse')] == [6, 6, 6]
+    assert report['model']['max_seconds'] >= 0.01
+
+
+def test_stages_work_on_different_items_at_the_same_time():
+    states = [{'n': n} for n in range(5)]
+    stages = [Stage('read', traced('read', 0.05)), Stage('model', traced('model', 0.05))]
+
+    started = time.monotonic()
+    run_pipeline(states, stages)
+
+    # One stage after the other would take 0.5 seconds
+    assert time.monotonic() - started < 0.4
+
+
+def test_full_queues_hold_back_the_earlier_stages():
+    lock = threading.Lock()
+    counts = {'read': 0, 'model': 0, 'lead': 0}
+
+    def read(state):
+        with lock:
+            counts['read'] += 1
+            counts['lead'] = max(counts['lead'], counts['read'] - counts['model'])
+
+    def model(state):
+        with lock:
+            counts['model'] += 1
+        time.sleep(0.01)
+
+    run_pipeline([{'n': n} for n in range(20)], [Stage('read', read), Stage('model', model)], queue_size=1)
+
+    # One item queued for the model stage and one waiting to be queued
+    assert counts['model'] == 20
+    assert counts['lead'] <= 3
+
+
+def test_failed_and_finished_items_skip_the_remaining_stages():
+    def cached(state):
+        if state['n'] == 1:
+            state['result'] = 'cached'
+
+    states = [{'n': n} for n in range(3)]
+    stages = [Stage('lookup', cached), Stage('model', traced('model', fail=2)), Stage('parse', traced('parse'))]
+
+    report = run_pipeline(states, stages)
+
+    assert states[0]['trace'] == ['model', 'parse']
+    assert 'trace' not in states[1] and states[1]['result'] == 'cached'
+    assert str(states[2]['exception']) == "model failed" and 'trace' not in states[2]
+    assert report['parse']['items'] == 1
+
+
+def test_submit_runs_the_stage_elsewhere():
+    submitted = []
+
+    def submit(call):
+        future = Future()
+        submitted.append(call)
+        future.set_result(call())
+        return future
+
+    states = [{'n': n} for n in range(3)]
+    run_pipeline(states, [Stage('model', traced('model'), submit=submit)])
+
+    assert len(submitted) == 3
+    assert all(state['trace'] == ['model'] for state in states)
+
+
+def test_no_items():
+    assert run_pipeline([], [Stage('model', traced('model'))]) == {
+        'model': {'items': 0, 'busy_seconds': 0.0, 'mean_seconds': 0.0, 'max_seconds': 0.0, 'wait_seconds': 0.0}
+    }
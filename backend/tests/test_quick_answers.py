@@ -0,0 +1,57 @@
+from io import BytesIO
+
+import pytest
+
+from conftest import invoice_image, model_calls
+from quick_answers import AnswerBook, lookup_field
+
+
+@pytest.mark.parametrize('question, field', [
+    ("What's the invoice number?", 'invoice_number'),
+    ("What is the invoice no?", 'invoice_number'),
+    ("Invoice ID?", 'invoice_number'),
+    ("invoice #", 'invoice_number'),
+    ("When was it issued?", 'invoice_date'),
+    ("Who issued it?", 'vendor_name'),
+    ("Who is it from?", 'vendor_name'),
+    ("Who is the customer?", 'customer_name'),
+    ("total amount?", 'total_amount'),
+    ("When is it due?", 'due_date'),
+])
+def test_lookup_field(question, field):
+    assert lookup_field(question) == field
+
+
+@pytest.mark.parametrize('question', ["no", "No.", "id", "Who is the total?", "Why is the tax so high?"])
+def test_lookup_field_leaves_other_questions_to_the_model(question):
+    assert lookup_field(question) is None
+
+
+def test_answer_book_answers_from_facts_then_cache():
+    book = AnswerBook()
+    book.set_facts(
+        {'invoice_number': 'INV-7', 'invoice_date': '2024-03-01', 'vendor_name': 'Acme Ltd', 'total_amount': 'N/A'},
+        [("What does the invoice cover?", "Consulting services")]
+    )
+
+    assert book.answer("Who issued it?") == ("The vendor is Acme Ltd.", 'facts')
+    assert book.answer("what does the invoice cover") == ("Consulting services", 'cache')
+    # Placeholder values are not facts
+    assert book.answer("What's the total?") == (None, None)
+    assert book.answer("No.") == (None, None)
+
+
+def test_model_answers_are_not_replayed(backend, client, fake_model):
+    upload = client.post('/upload_image', data={'image': (BytesIO(invoice_image(600)), 'invoice.jpg')},
+                         content_type='multipart/form-data').json
+    session_id = upload['session_id']
+
+    sources = []
+    for _ in range(2):
+        calls = model_calls(fake_model)
+        reply = client.post('/chat', json={'session_id': session_id, 'question': "Why?"}).json
+        sources.append((reply['source'], model_calls(fake_model) - calls))
+
+    # A follow-up depends on the conversation, so both go to the model
+    assert sources == [('model', 1), ('model', 1)]
+    assert "why" not in backend.answer_books[session_id].answers
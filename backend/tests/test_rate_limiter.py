@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from conftest import failed_indices, invoice_image, process
+from fake_model import FakeModelError, FakeRateLimitError, FakeVisionModel
+from rate_limiter import AdaptiveConcurrency, RateLimitedModel, RateLimiter, TokenBucket
+
+PROMPT = [HumanMessage(content="Describe the invoice")]
+
+
+def limited(max_retries=5, max_concurrency=16, **model_options):
+    model = FakeVisionModel(**model_options)
+    limiter = RateLimiter(max_concurrency=max_concurrency, max_retries=max_retries, backoff_base=0.001, backoff_max=0.005)
+    return model, limiter, RateLimitedModel(model, limiter)
+
+
+def test_acquire_async_waits_for_a_release_from_another_thread():
+    concurrency = AdaptiveConcurrency(1, maximum=1)
+    concurrency.acquire()
+    threading.Timer(0.05, concurrency.release).start()
+
+    waited = asyncio.run(concurrency.acquire_async())
+
+    assert waited >= 0.04
+    assert concurrency.in_flight == 1
+
+
+def test_acquire_async_wakes_waiters_in_order():
+    concurrency = AdaptiveConcurrency(2, maximum=2)
+    order = []
+
+    async def call(name):
+        await concurrency.acquire_async()
+        order.append(name)
+        await asyncio.sleep(0.01)
+        concurrency.release()
+
+    async def main():
+        await asyncio.gather(*(call(n) for n in range(6)))
+
+    asyncio.run(main())
+
+    assert order == list(range(6))
+    assert concurrency.in_flight == 0
+
+
+def test_cancelled_waiter_does_not_keep_a_slot():
+    concurrency = AdaptiveConcurrency(1, maximum=1)
+
+    async def main():
+        await concurrency.acquire_async()
+        waiter = asyncio.ensure_future(concurrency.acquire_async())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        concurrency.release()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert concurrency.in_flight == 0
+        # The slot is free for the next caller
+        await asyncio.wait_for(concurrency.acquire_async(), 1)
+
+    asyncio.run(main())
+    assert concurrency.in_flight == 1
+
+
+
+def test_throttled_calls_are_retried_until_they_succeed():
+    model, limiter, runnable = limited(throttle_pattern="xx.", latency=0.01)
+
+    result = runnable.invoke(PROMPT)
+
+    assert result.content
+    assert model.call_counts() == {'generate': 3, 'throttled': 2}
+    stats = limiter.stats()
+    assert (stats['calls'], stats['retries'], stats['throttled'], stats['failures']) == (3, 2, 2, 0)
+    assert stats['in_flight'] == 0
+
+
+def test_throttling_halves_the_concurrency_limit():
+    model, limiter, runnable = limited(max_concurrency=8, throttle_pattern="x.")
+
+    runnable.invoke(PROMPT)
+
+    assert limiter.stats()['concurrency_limit'] == 4
+
+
+def test_gives_up_after_max_retries():
+    model, limiter, runnable = limited(max_retries=3, throttle_pattern="x")
+
+    with pytest.raises(FakeRateLimitError):
+        runnable.invoke(PROMPT)
+
+    assert model.call_counts()['throttled'] == 4
+    stats = limiter.stats()
+    assert (stats['retries'], stats['failures'], stats['in_flight']) == (3, 1, 0)
+
+
+def test_other_errors_are_not_retried():
+    model, limiter, runnable = limited(error_rate=1.0)
+
+    with pytest.raises(FakeModelError):
+        runnable.invoke(PROMPT)
+
+    assert model.call_counts() == {'generate': 1, 'errors': 1}
+    assert limiter.stats()['retries'] == 0
+
+
+def test_ainvoke_retries_throttled_calls():
+    model, limiter, runnable = limited(throttle_pattern="x..", latency=0.01)
+
+    async def main():
+        return await asyncio.gather(*(runnable.ainvoke(PROMPT) for _ in range(4)))
+
+    results = asyncio.run(main())
+
+    assert len(results) == 4
+    assert model.call_counts()['throttled'] == 2
+    assert limiter.stats()['retries'] == 2
+
+
+def test_concurrency_limit_caps_calls_in_flight():
+    model, limiter, runnable = limited(max_concurrency=2, latency=0.05)
+
+    async def main():
+        await asyncio.gather(*(runnable.ainvoke(PROMPT) for _ in range(6)))
+
+    started = time.monotonic()
+    asyncio.run(main())
+
+    # Six calls two at a time take three rounds of latency
+    assert time.monotonic() - started >= 0.15
+    assert limiter.stats()['in_flight'] == 0
+
+
+def test_token_bucket_paces_acquires_at_the_quota():
+    bucket = TokenBucket(per_minute=1200)
+
+    started = time.monotonic()
+    for _ in range(30):
+        bucket.acquire()
+
+    # 20 per second, with a burst of 20 available up front
+    assert 0.4 <= time.monotonic() - started < 1.5
+
+
+def test_throttled_job_completes_with_retries(backend, client, upload, fake_model):
+    job_id = upload([(f"throttled{n}.jpg", invoice_image(100 + n)) for n in range(4)])
+    throttled = backend.rate_limiter.stats()['throttled']
+    fake_model.throttle_pattern = "x.."
+    fake_model.latency = 0.01
+
+    response = process(client, job_id, concurrency=2)
+
+    assert response['success']
+    assert failed_indices(response['results']) == []
+    assert backend.rate_limiter.stats()['throttled'] > throttled
+    assert client.get(f"/job_status/{job_id}").json['files_completed'] == 4
@@ -0,0 +1,48 @@
+import time
+
+from conftest import failed_indices, invoice_image, model_calls, process
+
+
+def test_retry_failed_only_reruns_failed_files(client, upload, fake_model):
+    job_id = upload([(f"flaky{n}.jpg", invoice_image(200 + n)) for n in range(4)])
+    fake_model.error_rate = 0.25
+
+    failed = failed_indices(process(client, job_id, concurrency=1)['results'])
+    assert failed
+
+    fake_model.error_rate = 0
+    calls = model_calls(fake_model)
+    response = process(client, job_id, retry_failed=True)
+
+    assert response['success']
+    assert failed_indices(response['results']) == []
+    # Two calls (describe, then extract) per re-run file
+    assert model_calls(fake_model) - calls == 2 * len(failed)
+
+    calls = model_calls(fake_model)
+    response = process(client, job_id, resume=True)
+    assert len(response['results']) == 4
+    assert model_calls(fake_model) == calls
+
+
+def test_resume_after_crash_skips_checkpointed_files(backend, client, upload, fake_model):
+    job_id = upload([(f"crashed{n}.jpg", invoice_image(300 + n)) for n in range(4)])
+    results = process(client, job_id)['results']
+    # Leave the job as a dead process would: running, with checkpoints for two files
+    backend.update_job(job_id, status='running', owner='dead:1', heartbeat_at=time.time())
+    backend.result_storage.pop(job_id)
+    for index in range(4):
+        backend.file_result_storage.pop(f"{job_id}:{index}")
+    for index in (0, 2):
+        backend.file_result_storage[f"{job_id}:{index}"] = results[index]
+
+    # A live owner keeps the job
+    assert client.post('/process_images', json={'job_id': job_id, 'resume': True}).status_code == 409
+
+    backend.update_job(job_id, heartbeat_at=time.time() - 10 * backend.app.config['JOB_STALE_SECONDS'])
+    calls = model_calls(fake_model)
+    response = process(client, job_id, resume=True)
+
+    assert response['success']
+    assert [result['filename'] for result in response['results']] == [f"crashed{n}.jpg" for n in range(4)]
+    assert model_calls(fake_model) - calls == 4
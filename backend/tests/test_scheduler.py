@@ -0,0 +1,109 @@
+import threading
+import time
+
+from scheduler import FairScheduler
+
+
+def submit_all(scheduler, tasks, order, **options):
+    return [
+        scheduler.submit(lambda name=name: order.append(name), tenant=tenant, **options)
+        for tenant, name in tasks
+    ]
+
+
+def hold(scheduler, **options):
+    """Occupy a worker until the returned event is set, so later tasks queue up"""
+    release, started = threading.Event(), threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    future = scheduler.submit(blocker, **options)
+    started.wait(5)
+    return release, future
+
+
+def test_tenants_take_turns():
+    scheduler = FairScheduler(workers=1, max_in_flight_per_tenant=4)
+    release, _ = hold(scheduler, tenant='blocker')
+    order = []
+    futures = submit_all(scheduler, [('big', f"big{n}") for n in range(10)] + [('small', 'small0'), ('small', 'small1')], order)
+
+    release.set()
+    for future in futures:
+        future.result(5)
+
+    # The small job is served between the big job's files, not after all of them
+    assert order[:4] == ['big0', 'small0', 'big1', 'small1']
+    assert order[4:] == [f"big{n}" for n in range(2, 10)]
+
+
+def test_higher_priority_goes_first():
+    scheduler = FairScheduler(workers=1)
+    release, _ = hold(scheduler, tenant='blocker')
+    order = []
+    low = submit_all(scheduler, [('a', 'low0'), ('a', 'low1')], order, priority=0)
+    high = submit_all(scheduler, [('b', 'high0'), ('b', 'high1')], order, priority=5)
+
+    release.set()
+    for future in low + high:
+        future.result(5)
+
+    assert order == ['high0', 'high1', 'low0', 'low1']
+
+
+def peak_in_flight(scheduler, submissions):
+    """Run a sleeping task per dict of submit options and return the most that ran at once"""
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def task():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    for future in [scheduler.submit(task, **options) for options in submissions]:
+        future.result(5)
+    return peak[0]
+
+
+def test_tenant_in_flight_limit():
+    scheduler = FairScheduler(workers=8, max_in_flight_per_tenant=2)
+
+    assert peak_in_flight(scheduler, [{'tenant': 'a'}] * 10) == 2
+
+
+def test_job_limit():
+    scheduler = FairScheduler(workers=8, max_in_flight_per_tenant=8)
+
+    assert peak_in_flight(scheduler, [{'tenant': 'a', 'job_id': 'job', 'job_limit': 3}] * 9) == 3
+
+
+def test_other_tenants_use_free_workers():
+    scheduler = FairScheduler(workers=4, max_in_flight_per_tenant=2)
+
+    assert peak_in_flight(scheduler, [{'tenant': 'a'}] * 6 + [{'tenant': 'b'}] * 6) == 4
+
+
+def test_stats_count_completed_and_failed_tasks():
+    scheduler = FairScheduler(workers=2)
+
+    def fail():
+        raise ValueError("broken file")
+
+    ok = scheduler.submit(lambda: 1, tenant='a')
+    failed = scheduler.submit(fail, tenant='a')
+    assert ok.result(5) == 1
+    assert isinstance(failed.exception(5), ValueError)
+    # Counters are updated just after the future resolves
+    deadline = time.monotonic() + 5
+    while scheduler.stats()['completed'] + scheduler.stats()['failed'] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    stats = scheduler.stats()
+    assert (stats['submitted'], stats['completed'], stats['failed']) == (2, 1, 1)
+    assert stats['queue_depth'] == 0
@@ -0,0 +1,67 @@
+from typing import List, Optional
+
+import pydantic
+import pytest
+
+from schemas import build_batch_model, build_schema_model, json_to_pydantic_model, normalize_fields, schema_fingerprint
+
+SCHEMA = [
+    ['invoice number', 'str', 'Invoice number'],
+    ['total', 'float', 'Total amount'],
+    ['lines', 'int', 'Number of line items'],
+    ['paid', 'bool', 'Whether it is paid'],
+    ['tags', 'List[str]', 'Labels'],
+    ['2nd_vendor', 'decimal', 'Unknown type'],
+]
+
+
+def test_field_types_and_names():
+    Data = build_schema_model(SCHEMA)
+    fields = Data.model_fields
+
+    # Names become identifiers; a leading underscore would make the field private
+    assert list(fields) == ['invoice_number', 'total', 'lines', 'paid', 'tags', 'field_2nd_vendor']
+    assert fields['total'].annotation == Optional[float]
+    assert fields['tags'].annotation == Optional[List[str]]
+    # Unknown type names fall back to str
+    assert fields['field_2nd_vendor'].annotation == Optional[str]
+    assert fields['total'].description == "Total amount if No data found , show None"
+
+
+def test_fields_are_required_but_nullable():
+    Data = build_schema_model(SCHEMA[:2])
+
+    assert Data(invoice_number=None, total="12.5").total == 12.5
+    with pytest.raises(pydantic.ValidationError):
+        Data(invoice_number="INV-1")
+
+
+def test_models_are_memoized():
+    Data = build_schema_model(SCHEMA)
+
+    assert build_schema_model([list(field) for field in SCHEMA]) is Data
+    assert build_schema_model(SCHEMA[:2]) is not Data
+    assert build_batch_model(Data) is build_batch_model(Data)
+
+
+def test_fingerprint_follows_the_normalized_fields():
+    fields = normalize_fields(SCHEMA)
+
+    assert schema_fingerprint(fields) == schema_fingerprint(normalize_fields([list(field) for field in SCHEMA]))
+    assert schema_fingerprint(fields) != schema_fingerprint(fields[:2])
+
+
+def test_batch_model_tags_records_with_their_image():
+    Batch = build_batch_model(build_schema_model(SCHEMA[:1]))
+
+    batch = Batch(records=[{'invoice_number': 'A', 'image_index': 1}, {'invoice_number': None, 'image_index': 2}])
+
+    assert [record.image_index for record in batch.records] == [1, 2]
+
+
+def test_invalid_definitions_are_rejected():
+    with pytest.raises(ValueError):
+        build_schema_model({'invoice_number': 'str'})
+    with pytest.raises(ValueError):
+        build_schema_model([['invoice_number', 'str']])
+    assert json_to_pydantic_model([['invoice_number']]).startswith("Error:")
@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+from storage import MemoryStore, SQLiteStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_store(request, tmp_path):
+    def make_store(max_entries=1000, ttl=3600, on_evict=None, name='test'):
+        if request.param == 'memory':
+            return MemoryStore(name, max_entries=max_entries, ttl=ttl, on_evict=on_evict)
+        return SQLiteStore(name, str(tmp_path / 'store.sqlite3'), max_entries=max_entries, ttl=ttl, on_evict=on_evict)
+    return make_store
+
+
+def fill(store, keys):
+    for key in keys:
+        store[key] = {'key': key}
+        # Distinct access times for the LRU order
+        time.sleep(0.002)
+
+
+def test_least_recently_used_entry_is_evicted(make_store):
+    evicted = []
+    store = make_store(max_entries=3, on_evict=evicted.append)
+    fill(store, 'abc')
+
+    # Reading 'a' makes 'b' the least recently used
+    assert store.get('a') == {'key': 'a'}
+    time.sleep(0.002)
+    store['d'] = {'key': 'd'}
+
+    assert evicted == ['b']
+    assert 'b' not in store
+    assert all(key in store for key in 'acd')
+    assert store.stats()['evictions'] == 1
+
+
+def test_entries_expire_after_ttl(make_store):
+    store = make_store(ttl=0.05)
+    store['invoice'] = {'total': 10}
+    assert store.get('invoice') == {'total': 10}
+
+    time.sleep(0.1)
+
+    assert 'invoice' not in store
+    assert store.get('invoice') is None
+    with pytest.raises(KeyError):
+        store['invoice']
+
+
+def test_writes_restart_the_ttl(make_store):
+    store = make_store(ttl=0.2)
+    store['job'] = {'status': 'running'}
+    time.sleep(0.12)
+    store.modify('job', lambda job: job.update(status='completed'))
+    time.sleep(0.12)
+
+    assert store.get('job') == {'status': 'completed'}
+
+
+def test_modify_is_atomic_across_threads(make_store):
+    store = make_store()
+    store['counter'] = {'count': 0}
+
+    def add():
+        for _ in range(50):
+            store.modify('counter', lambda value: value.update(count=value['count'] + 1))
+
+    threads = [threading.Thread(target=add) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store['counter'] == {'count': 200}
+    assert store.modify('missing', lambda value: value.update(count=1)) is None
+
+
+def test_pop_and_delete(make_store):
+    store = make_store()
+    fill(store, 'ab')
+
+    assert store.pop('a') == {'key': 'a'}
+    assert store.pop('a', 'gone') == 'gone'
+    del store['b']
+    with pytest.raises(KeyError):
+        del store['b']
+    assert len(store) == 0
+
+
+def test_sqlite_stores_share_entries(tmp_path):
+    path = str(tmp_path / 'store.sqlite3')
+    writer = SQLiteStore('jobs', path)
+    reader = SQLiteStore('jobs', path)
+    other = SQLiteStore('schemas', path)
+
+    writer['job'] = {'status': 'running'}
+    writer.modify('job', lambda job: job.update(status='completed'))
+
+    assert reader['job'] == {'status': 'completed'}
+    # Namespaces keep stores apart inside one database
+    assert 'job' not in other
+
+
+def test_sqlite_reads_do_not_write(tmp_path):
+    store = SQLiteStore('jobs', str(tmp_path / 'store.sqlite3'))
+    store['job'] = {'status': 'running'}
+    changes = store._conn.total_changes
+
+    for _ in range(20):
+        store.get('job')
+        'job' in store
+
+    assert store._conn.total_changes == changes
+
+
+def test_sqlite_evicts_periodically_within_bound(tmp_path):
+    evicted = []
+    store = SQLiteStore('files', str(tmp_path / 'store.sqlite3'), max_entries=100, on_evict=evicted.append)
+
+    for number in range(500):
+        store[str(number)] = number
+        assert len(store) <= store.max_entries + store.evict_every
+
+    # The oldest entries went first
+    assert evicted[:10] == [str(number) for number in range(10)]
+    assert '499' in store
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from work_queue import WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WorkQueue(str(tmp_path / 'queue.sqlite3'))
+
+
+def test_claim_and_complete(queue):
+    queue.enqueue('job', [0, 1])
+
+    first = queue.claim('worker-1')
+    second = queue.claim('worker-1')
+
+    assert first == [{'job_id': 'job', 'index': 0, 'mode': 'two_pass', 'attempts': 1}]
+    assert second[0]['index'] == 1
+    assert queue.claim('worker-1') == []
+    assert queue.complete('worker-1', first[0]) == (True, False)
+    assert queue.complete('worker-1', second[0]) == (True, True)
+    assert not queue.has_work()
+    assert queue.stats()['done'] == 2
+
+
+def test_expired_lease_is_claimed_by_another_worker(queue):
+    queue.enqueue('job', [0])
+    [stale] = queue.claim('crashed', lease_seconds=0.05)
+    assert queue.claim('survivor') == []
+
+    time.sleep(0.1)
+    assert queue.stats()['expired_leases'] == 1
+    [item] = queue.claim('survivor')
+
+    assert item['attempts'] == 2
+    # The worker that lost its lease cannot mark the item done
+    assert queue.complete('crashed', stale) == (False, False)
+    assert queue.complete('survivor', item) == (True, True)
+
+
+def test_renew_keeps_the_lease(queue):
+    queue.enqueue('job', [0])
+    items = queue.claim('worker-1', lease_seconds=0.05)
+
+    queue.renew('worker-1', items, lease_seconds=60)
+    time.sleep(0.1)
+
+    assert queue.claim('worker-2') == []
+    assert queue.stats()['active_workers'] == 1
+
+
+def test_higher_priority_jobs_are_claimed_first(queue):
+    queue.enqueue('background', [0, 1], priority=0)
+    queue.enqueue('interactive', [0], priority=10)
+
+    assert queue.claim('worker', limit=5)[0]['job_id'] == 'interactive'
+    assert [item['job_id'] for item in queue.claim('worker', limit=5)] == ['background', 'background']
+
+
+def test_batched_jobs_are_claimed_a_batch_at_a_time(queue):
+    queue.enqueue('job', range(5), mode='batched')
+
+    batches = [queue.claim('worker', limit=1, batch_limit=2) for _ in range(3)]
+
+    assert [[item['index'] for item in batch] for batch in batches] == [[0, 1], [2, 3], [4]]
+    assert all(item['mode'] == 'batched' for batch in batches for item in batch)
+
+
+def test_enqueue_replaces_and_discard_drops_a_job(queue):
+    queue.enqueue('job', [0, 1, 2])
+    queue.enqueue('job', [2])
+    assert queue.stats()['pending'] == 1
+
+    queue.discard('job')
+
+    assert not queue.has_work()
+    assert queue.claim('worker') == []
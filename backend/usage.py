@@ -0,0 +1,71 @@
+"""
+Token usage accounting for model calls.
+
+Usage is a dict of 'input_tokens' and 'output_tokens', taken from the
+usage_metadata the provider attaches to each AIMessage. Structured-output
+runnables are created with include_raw=True so their raw message, and its
+usage, is not thrown away; chains report usage through UsageCollector.
+"""
+import threading
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage
+
+TOKEN_KEYS = ('input_tokens', 'output_tokens')
+
+
+def empty_usage():
+    return {key: 0 for key in TOKEN_KEYS}
+
+
+def usage_of(response):
+    """
+    Read token usage from a model response
+
+    Args:
+        response: AIMessage, or the dict returned by a structured-output
+            runnable created with include_raw=True
+
+    Returns:
+        dict: input_tokens and output_tokens, zero when not reported
+    """
+    if isinstance(response, dict) and 'raw' in response:
+        response = response['raw']
+    metadata = response.usage_metadata if isinstance(response, AIMessage) else None
+    return {key: (metadata or {}).get(key, 0) for key in TOKEN_KEYS}
+
+
+def add_usage(total, usage):
+    """Add usage into total in place and return total"""
+    for key in TOKEN_KEYS:
+        total[key] = total.get(key, 0) + usage.get(key, 0)
+    return total
+
+
+def split_usage(usage, parts):
+    """Share the usage of one call evenly between `parts` files"""
+    shares = [empty_usage() for _ in range(parts)]
+    for key in TOKEN_KEYS:
+        base, remainder = divmod(usage.get(key, 0), parts)
+        for position, share in enumerate(shares):
+            share[key] = base + (1 if position < remainder else 0)
+    return shares
+
+
+def usage_cost(usage, input_price=0.0, output_price=0.0):
+    """Cost of the usage given prices per million input and output tokens"""
+    return round((usage.get('input_tokens', 0) * input_price + usage.get('output_tokens', 0) * output_price) / 1e6, 6)
+
+
+class UsageCollector(BaseCallbackHandler):
+    """Callback handler that sums the usage of every model call in a run"""
+
+    def __init__(self):
+        self.usage = empty_usage()
+        self._lock = threading.Lock()
+
+    def on_llm_end(self, response, **kwargs):
+        with self._lock:
+            for generations in response.generations:
+                for generation in generations:
+                    add_usage(self.usage, usage_of(getattr(generation, 'message', None)))
@@ -0,0 +1,183 @@
+"""
+Durable queue of extraction work shared by worker processes.
+
+Every file of a queued job is one row of a SQLite table. Workers claim
+rows under a lease; a worker that is killed stops renewing its leases, and
+once they expire the rows are claimed again by another worker. Rows are
+marked done only by the worker that holds their lease, so a file finished
+twice after a lost lease is counted once.
+
+SQLite's write lock (BEGIN IMMEDIATE) makes claims atomic across
+processes on one host; WAL mode lets readers run alongside the workers.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Rows a worker may claim: waiting ones, and leased ones whose worker died
+CLAIMABLE = "(status = 'pending' OR (status = 'leased' AND leased_until < ?))"
+
+
+class WorkQueue:
+    """SQLite-backed queue of (job, file) work items with leases"""
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): SQLite database file, created if missing; may be
+                shared with the storage backend
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Autocommit mode so transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS work_items ("
+            " job_id TEXT NOT NULL,"
+            " file_index INTEGER NOT NULL,"
+            " mode TEXT NOT NULL,"
+            " priority INTEGER NOT NULL,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " worker TEXT,"
+            " leased_until REAL,"
+            " queued_at REAL NOT NULL,"
+            " finished_at REAL,"
+            " PRIMARY KEY (job_id, file_index))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS work_items_claim ON work_items (status, priority, queued_at)")
+
+    @contextmanager
+    def _transaction(self):
+        """Hold the process lock and a SQLite write lock for the block"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def enqueue(self, job_id, indices, mode='two_pass', priority=0):
+        """Queue files of a job by index, replacing any earlier items of the job"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM work_items WHERE job_id = ?", (job_id,))
+            conn.executemany(
+                "INSERT INTO work_items (job_id, file_index, mode, priority, status, queued_at)"
+                " VALUES (?, ?, ?, ?, 'pending', ?)",
+                [(job_id, index, mode, priority, now) for index in indices]
+            )
+
+    def claim(self, worker, lease_seconds=300, limit=1, batch_limit=1):
+        """
+        Lease the next work items
+
+        Items come from one job, highest priority and oldest job first, so
+        a batched job can be claimed a batch at a time.
+
+        Args:
+            worker (str): Name of the claiming worker
+            lease_seconds (float): How long the items stay leased without renew
+            limit (int): Largest number of items to claim
+            batch_limit (int): Largest number of items to claim from a job
+                in 'batched' mode
+
+        Returns:
+            list: Claimed items as dicts with job_id, index, mode and
+            attempts (counting this one); empty if nothing is claimable
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            first = conn.execute(
+                f"SELECT job_id, mode FROM work_items WHERE {CLAIMABLE}"
+                " ORDER BY priority DESC, queued_at, job_id, file_index LIMIT 1",
+                (now,)
+            ).fetchone()
+            if first is None:
+                return []
+            job_id, mode = first
+            rows = conn.execute(
+                f"SELECT file_index, attempts FROM work_items WHERE job_id = ? AND {CLAIMABLE}"
+                " ORDER BY file_index LIMIT ?",
+                (job_id, now, batch_limit if mode == 'batched' else limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE work_items SET status = 'leased', worker = ?, leased_until = ?, attempts = attempts + 1"
+                " WHERE job_id = ? AND file_index = ?",
+                [(worker, now + lease_seconds, job_id, index) for index, _ in rows]
+            )
+        return [
+            {'job_id': job_id, 'index': index, 'mode': mode, 'attempts': attempts + 1}
+            for index, attempts in rows
+        ]
+
+    def renew(self, worker, items, lease_seconds=300):
+        """Extend the leases a worker still holds"""
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE work_items SET leased_until = ?"
+                " WHERE job_id = ? AND file_index = ? AND worker = ? AND status = 'leased'",
+                [(time.time() + lease_seconds, item['job_id'], item['index'], worker) for item in items]
+            )
+
+    def complete(self, worker, item):
+        """
+        Mark an item done
+
+        Returns:
+            tuple: (completed, job_finished); completed is False if the
+            worker lost the lease and another worker took the item over,
+            job_finished is True for the completion that finished the job
+        """
+        with self._transaction() as conn:
+            completed = conn.execute(
+                "UPDATE work_items SET status = 'done', finished_at = ?"
+                " WHERE job_id = ? AND file_index = ? AND worker = ? AND status = 'leased'",
+                (time.time(), item['job_id'], item['index'], worker)
+            ).rowcount == 1
+            remaining = conn.execute(
+                "SELECT COUNT(*) FROM work_items WHERE job_id = ? AND status != 'done'", (item['job_id'],)
+            ).fetchone()[0]
+        return completed, completed and remaining == 0
+
+    def discard(self, job_id):
+        """Drop every item of a job, e.g. after the job was cleaned up"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM work_items WHERE job_id = ?", (job_id,))
+
+    def has_work(self):
+        """Tell whether any item is waiting or leased"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM work_items WHERE status != 'done' LIMIT 1"
+            ).fetchone() is not None
+
+    def stats(self):
+        """Return item counts by status, the number of queued jobs and expired leases"""
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM work_items GROUP BY status").fetchall())
+            jobs = self._conn.execute(
+                "SELECT COUNT(DISTINCT job_id) FROM work_items WHERE status != 'done'"
+            ).fetchone()[0]
+            expired = self._conn.execute(
+                "SELECT COUNT(*) FROM work_items WHERE status = 'leased' AND leased_until < ?", (time.time(),)
+            ).fetchone()[0]
+            workers = self._conn.execute(
+                "SELECT COUNT(DISTINCT worker) FROM work_items WHERE status = 'leased' AND leased_until >= ?",
+                (time.time(),)
+            ).fetchone()[0]
+        return {
+            'pending': counts.get('pending', 0),
+            'leased': counts.get('leased', 0),
+            'done': counts.get('done', 0),
+            'jobs': jobs,
+            'expired_leases': expired,
+            'active_workers': workers
+        }
@@ -0,0 +1,217 @@
+"""
+Extraction worker processes fed by the durable work queue.
+
+Jobs put on the queue with "queue": true in /process_images are processed
+here, outside the web app, by several processes that each run a few
+threads. The processes share the web app's SQLite stores, so progress
+shows up in /job_status and /job_events, and finished results can be
+downloaded from /download_excel as usual.
+
+Every file is leased from the queue while it is processed. The lease is
+renewed while the file is being processed. If a worker is killed, its
+leases expire and other workers retry those files. A file whose lease
+has expired WORKER_MAX_ATTEMPTS times is recorded as failed. The worker
+that completes a job's last file stores the job's results.
+
+The web app and the workers must share the storage and the uploads:
+    STORAGE_BACKEND=sqlite UPLOAD_STORAGE=spool python app.py
+    STORAGE_BACKEND=sqlite UPLOAD_STORAGE=spool python worker.py --processes 4 --threads 4
+
+Use --drain to exit once the queue is empty, e.g. for overnight backfills.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="Files each process works on at once")
+    parser.add_argument("--poll", type=float, default=2.0, help="Seconds between polls of an empty queue")
+    parser.add_argument("--drain", action="store_true", help="Exit once no work is pending or leased")
+    return parser.parse_args(argv)
+
+
+def stage_summary(file_timings):
+    """Per-stage totals of a job's files, in the shape of pipeline.StageTimings.report"""
+    totals = {}
+    for timing in file_timings:
+        for stage, seconds in ((timing or {}).get('stages') or {}).items():
+            total = totals.setdefault(stage, {'items': 0, 'busy_seconds': 0.0, 'max_seconds': 0.0})
+            total['items'] += 1
+            total['busy_seconds'] += seconds
+            total['max_seconds'] = max(total['max_seconds'], seconds)
+    return {
+        stage: {
+            'items': total['items'],
+            'busy_seconds': round(total['busy_seconds'], 3),
+            'mean_seconds': round(total['busy_seconds'] / total['items'], 3),
+            'max_seconds': round(total['max_seconds'], 3),
+            'wait_seconds': 0.0
+        }
+        for stage, total in totals.items()
+    }
+
+
+class Worker:
+    """Claims work items and processes them with the web app's extraction code"""
+
+    def __init__(self, backend, name):
+        """
+        Args:
+            backend (module): The imported app module
+            name (str): Worker name recorded on its leases
+        """
+        self.backend = backend
+        self.name = name
+        self.queue = backend.work_queue
+        self.lease_seconds = backend.app.config['WORKER_LEASE_SECONDS']
+        self.max_attempts = backend.app.config['WORKER_MAX_ATTEMPTS']
+        self.batch_size = backend.app.config['BATCH_MAX_IMAGES']
+
+    def run(self, poll, drain):
+        """Process items until stopped, or until the queue is empty when draining"""
+        while True:
+            items = self.queue.claim(self.name, self.lease_seconds, batch_limit=self.batch_size)
+            if not items:
+                if drain and not self.queue.has_work():
+                    return
+                time.sleep(poll)
+                continue
+            try:
+                self.process(items)
+            except Exception as e:
+                # The items stay leased and are retried once the lease expires
+                self.backend.app.logger.exception("Worker %s failed on job %s: %s", self.name, items[0]['job_id'], e)
+
+    def process(self, items):
+        """Process claimed items of one job, renewing their leases meanwhile"""
+        backend = self.backend
+        job_id = items[0]['job_id']
+        job_info = backend.job_storage.get(job_id)
+        if job_info is None:
+            # Cleaned up while queued
+            self.queue.discard(job_id)
+            return
+
+        def start(job):
+            if job.get('status') == 'queued':
+                job.update(status='running', started_at=time.time())
+        backend.job_storage.modify(job_id, start)
+
+        stop = threading.Event()
+        renewer = threading.Thread(target=self.renew, args=(items, stop), daemon=True)
+        renewer.start()
+        try:
+            for item, result, seconds, stages, usage, stats in self.extract(job_info, items):
+                # Store the result, and its duplicates' copies, before
+                # completing, so the job's last completion finds every result
+                backend.checkpoint_file(job_id, item['index'], result)
+                completed, job_finished = self.queue.complete(self.name, item)
+                if completed:
+                    backend.record_file_done(job_id, item['index'], result, seconds, stats, stages, usage)
+                if job_finished:
+                    self.finish_job(job_id)
+        finally:
+            stop.set()
+
+    def renew(self, items, stop):
+        while not stop.wait(self.lease_seconds / 3):
+            self.queue.renew(self.name, items, self.lease_seconds)
+
+    def extract(self, job_info, items):
+        """Yield (item, result, seconds, stages, usage, image stats) for claimed items"""
+        backend = self.backend
+        files = backend.job_files(items[0]['job_id'])
+        schema = backend.schema_storage[job_info['schema_id']]
+        structured_llm = backend.get_structured_llm(schema)
+        fingerprint = schema['fingerprint']
+
+        runnable = []
+        for item in items:
+            if item['attempts'] > self.max_attempts:
+                error = f"Gave up after {self.max_attempts} attempts; the worker processing it stopped"
+                result = {'filename': files[item['index']]['filename'], 'error': error}
+                yield item, {**result, **backend.empty_usage()}, 0.0, {}, {}, None
+            else:
+                runnable.append(item)
+
+        if len(runnable) > 1 and runnable[0]['mode'] == 'batched':
+            started = time.perf_counter()
+            results = backend.extract_batch(
+                [files[item['index']] for item in runnable], structured_llm, backend.get_batch_llm(schema), fingerprint
+            )
+            seconds = time.perf_counter() - started
+            for item, result in zip(runnable, results):
+                usage = {key: result.get(key, 0) for key in backend.TOKEN_KEYS}
+                stats = files[item['index']].pop('image_stats', None)
+                yield item, result, seconds, {'batch': round(seconds, 3)}, {'batch': usage}, stats
+            return
+
+        for item in runnable:
+            file_info = files[item['index']]
+            mode = 'single_pass' if item['mode'] == 'batched' else item['mode']
+            state = {'file_info': file_info, 'mode': mode}
+            result = backend.run_file_stages(state, structured_llm, fingerprint)
+            yield (
+                item, result, sum(state['timings'].values()), state['timings'], state['usage'],
+                file_info.pop('image_stats', None)
+            )
+
+    def finish_job(self, job_id):
+        """Store the results of a job whose last file was just completed"""
+        backend = self.backend
+        job_info = backend.job_storage.get(job_id) or {'files_total': 0}
+        results = [backend.file_result_storage.get(f"{job_id}:{index}") for index in range(job_info['files_total'])]
+        missing = backend.requeue_missing(job_id, results)
+        if missing:
+            # Checkpoints evicted meanwhile: those files go back on the queue
+            self.queue.enqueue(job_id, missing, job_info.get('mode') or 'two_pass', job_info.get('priority', 0))
+            return
+        backend.complete_job(job_id, results, stage_summary(backend.job_file_timings(job_id, len(results))))
+        self.queue.discard(job_id)
+
+
+def work(number, args):
+    """Entry point of one worker process"""
+    import app as backend
+
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [
+        threading.Thread(target=Worker(backend, f"{name}:{thread}").run, args=(args.poll, args.drain), daemon=True)
+        for thread in range(max(1, args.threads))
+    ]
+    for thread in threads:
+        thread.start()
+    print(f"Worker {number} ({name}) started with {len(threads)} threads", flush=True)
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    args = parse_args()
+    if os.getenv("STORAGE_BACKEND", "memory") != "sqlite":
+        sys.exit("worker.py needs STORAGE_BACKEND=sqlite, shared with the web app")
+    if os.getenv("UPLOAD_STORAGE", "spool") != "spool":
+        sys.exit("worker.py needs UPLOAD_STORAGE=spool, so uploads are read from disk")
+
+    # Fresh interpreters: the app module starts threads at import
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=work, args=(number, args), name=f"worker-{number}") for number in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -294,24 +294,58 @@ export default function BulkImageProcessing() {
       setStatus('Processing images...');
       setStatusType('info');
       
+      // Start the job in the background, then follow its event stream
       const response = await fetch('http://127.0.0.1:5000/process_images', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ job_id: jobId })
+        body: JSON.stringify({ job_id: jobId, async: true })
       });
       
       const data = await response.json();
       
-      if (data.success) {
-        setResults(data.results);
+      if (!data.success) {
+        setStatus(`Error: ${data.error}`);
+        setStatusType('error');
+        displayToast(`Error: ${data.error}`, 'error');
+        return;
+      }
+      
+      // Show each file's result as soon as the server reports it
+      const streamed = [];
+      const job = await new Promise((resolve, reject) => {
+        const events = new EventSource(`http://127.0.0.1:5000/job_events/${jobId}`);
+        events.addEventListener('result', (event) => {
+          const update = JSON.parse(event.data);
+          streamed[update.index] = update.result;
+          setResults(streamed.filter(Boolean));
+          setStatus(`Processing images... ${update.files_completed}/${update.files_total} done`);
+        });
+        events.addEventListener('done', (event) => {
+          events.close();
+          resolve(JSON.parse(event.data));
+        });
+        events.addEventListener('failed', (event) => {
+          events.close();
+          resolve(JSON.parse(event.data));
+        });
+        events.onerror = () => {
+          // EventSource reconnects on its own unless the stream was closed for good
+          if (events.readyState === EventSource.CLOSED) {
+            reject(new Error('Lost connection to the server'));
+          }
+        };
+      });
+      
+      if (job.status === 'done') {
+        setResults(streamed.filter(Boolean));
         setStatus('Processing complete');
         setStatusType('success');
         setActiveStep(4);
         displayToast('Data extraction completed!', 'success');
       } else {
-        setStatus(`Error: ${data.error}`);
+        setStatus(`Error: ${job.error}`);
         setStatusType('error');
-        displayToast(`Error: ${data.error}`, 'error');
+        displayToast(`Error: ${job.error}`, 'error');
       }
     } catch (error) {
       setStatus(`Error: ${error.message}`);